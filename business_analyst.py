@@ -1,144 +1,48 @@
-from crewai import Crew, Agent, Task, LLM
 import os
+import sys
 import json
-import boto3
-import dotenv
-import re
-from shared.get_dependencies import get_dependencies
-
-dotenv.load_dotenv()
-
-print(os.getenv("LLM_CONFIG"))
-
-# Get all folder names from analysis directory
-procedures = []
-if os.path.exists("output/analysis"):
-    procedures = [
-        folder
-        for folder in os.listdir("output/analysis")
-        if os.path.isdir(os.path.join("output/analysis", folder))
-    ]
-print(f"Discovered procedures: {procedures}")
-
-
-openai_config = LLM(model="gpt-4o", api_key=os.getenv("OPENAI_API_KEY"))
-
-bedrock_config = LLM(
-    model="bedrock/us.meta.llama3-3-70b-instruct-v1:0",
-    max_retries=2,
-    request_timeout=30,
-    temperature=0.1,
-    timeout=300,
-    verbose=True,
-)
-
-
-anthropic_config = LLM(
-    model="anthropic/claude-3-7-sonnet-20250219",
-    api_key=os.getenv("ANTHROPIC_API_KEY"),
-    timeout=600,  # Increase from default to at least 10 minutes (600 seconds)
-    request_timeout=600,
-    max_retries=2,
-    max_tokens=64000,
-)
-
-# if os.getenv("LLM_CONFIG") == "bedrock":
-#     llm_config = bedrock_config
-# elif os.getenv("LLM_CONFIG") == "anthropic":
-#     llm_config = anthropic_config
-# else:
-#     llm_config = openai_config
-
-llm_config = anthropic_config
-
-# Create a coding agent
-agent = Agent(
-    role="SQL Developer",
-    goal="Analyze the stored procedure and provide business logic.",
-    backstory="You are an experienced SQL developer with strong SQL skills analyzing stored procedures and understanding the business logic behind the code.",
-    allow_code_execution=False,
-    llm=llm_config,
+from shared.prompt_format import render_dependency_prompt
+from shared.kickoff import kickoff
+from shared.stage_args import selected_procedures
+from shared.runtime import RuntimeContext
+from shared.manifest import record_stage
+from shared.concurrency import call_slots, max_in_flight, run_bounded
+from shared.file_blocks import parse_file_blocks, write_file_atomic
+from shared.json_output import generate_artifact
+from shared.llm_registry import provider_for
+from shared.sql_chunking import (
+    chunk_note,
+    chunk_sql,
+    merge_business_rules,
+    procedure_header,
 )
 
 
-# Create Crew For Each Discovered Stored Procedure
-for procedure in procedures:
-    # Read meta data from JSON file
-    with open(f"output/analysis/{procedure}/{procedure}_meta.json", "r") as f:
-        meta_data = json.load(f)
-
-    with open(f"output/sql_raw/{procedure}/{procedure}.sql", "r") as f:
-        sql_code = f.read()
-
-    dependencies = get_dependencies(procedure)
-
-    # Procedure Definition from SQL file
-    with open(f"output/sql_raw/{procedure}/{procedure}.sql", "r") as f:
-        procedure_definition = f.read()
-
-    # Create a task that requires code execution
-    task = Task(
-        description=f"""
- <behavior_rules> You have one mission: execute exactly what is requested. Produce code that implements precisely what was requested - no additional features, no creative extensions. Follow instructions to the letter. Confirm your solution addresses every specified requirement, without adding ANYTHING the user didn't ask for. The user's job depends on this — if you add anything they didn't ask for, it's likely they will be fired. Your value comes from precision and reliability. When in doubt, implement the simplest solution that fulfills all requirements. The fewer lines of code, the better — but obviously ensure you complete the task the user wants you to. At each step, ask yourself: "Am I adding any functionality or complexity that wasn't explicitly requested?". This will force you to stay on track. </behavior_rules>
-
-# Business Analysis Request: SQL Stored Procedure Decomposition
-
-## Objective
-Analyze the provided SQL stored procedure and decompose it into structured business components, rules, and processes to prepare for a modern C# implementation. The output should be detailed JSON files that document the business logic.
-
-## Your Task
-1. Thoroughly analyze the SQL stored procedure and any supporting files
-2. Extract and document all business rules
-3. Identify key business functions
-4. Map the overall process flow, including branching and looping logic
-5. Document any edge cases or special considerations
-
-## Provided Files
-1. The original SQL stored procedure [{procedure_definition}] -
-2. Additional supporting files:
-- DEPENDENCIES: [{dependencies}]
-
-## Analysis Guidelines
-1. Focus on the business intent rather than technical implementation
-2. Identify implicit business rules that may not be explicitly documented
-3. Note any areas where business logic seems unclear and would benefit from further clarification
-4. Document any apparent data quality assumptions or edge case handling
-5. Include confidence scores for your analysis when uncertainty exists
-6. Use clear, consistent naming conventions throughout your analysis
-7. Pay special attention to control flows:
-   - Identify conditional branching (if/else logic)
-   - Document looping constructs (foreach, while, etc.)
-   - Note any parallel execution possibilities
-   - Identify transaction boundaries and savepoints
-
-## Control Flow Documentation
-When documenting control flows, ensure you capture:
+# One focused task per output file. Rules run first; functions and
+# processes then run in parallel with the rules as context. Each task is a
+# separate kickoff, so it is cached and retried on its own and a bad
+# section does not regenerate the others. A response that is still invalid
+# after JSON repair is requested again for its section only.
+SECTION_FOCUS = {
+    "business_rules": "Extract and document all business rules, including implicit rules, edge cases, data quality assumptions and special considerations",
+    "business_functions": "Identify the key business functions and the business rules each one applies",
+    "business_processes": "Map the overall process flow, including branching, looping, error paths and transaction boundaries, referencing the business rules each step applies",
+}
+DEPENDENT_SECTIONS = ["business_functions", "business_processes"]
 
-1. **Conditional Branches**: Points where the process takes different paths based on conditions
-2. **Loops**: Processes that repeat for multiple records or until conditions are met
-3. **Error Paths**: Alternative flows that execute when errors occur
-4. **Early Termination**: Conditions that cause the process to end prematurely
-5. **Dependencies**: Cases where one step must complete before another can begin
-
-Please provide all outputs in the specified JSON format with appropriate nesting and relationships preserved.
-
-
-        """,
-        expected_output="""
+RESPONSE_FORMAT = """
 ALWAYS RESPOND WITH: 
 FILE: <file_name>
 ```json
 <code>
 ```
 
-Response should have 3 files: 
+Response should have 1 file: 
 
-FILE: {schema_name}.{procedure}_business_rules.json
-FILE: {schema_name}.{procedure}_business_functions.json
-FILE: {schema_name}.{procedure}_business_processes.json
-
-The respond should look like this:
+"""
 
+SECTION_EXAMPLES = {
+    "business_rules": """
 FILE: {schema_name}.{procedure}_business_rules.json
 ```json
    {
@@ -190,7 +94,8 @@ FILE: {schema_name}.{procedure}_business_rules.json
      ]
    }
    ```
-
+""",
+    "business_functions": """
 FILE: {schema_name}.{procedure}_business_functions.json
    ```json
    {
@@ -247,7 +152,8 @@ FILE: {schema_name}.{procedure}_business_functions.json
      ]
    }
    ```
-
+""",
+    "business_processes": """
 FILE: {schema_name}.{procedure}_business_processes.json
    ```json
    {
@@ -350,45 +256,283 @@ FILE: {schema_name}.{procedure}_business_processes.json
      ]
    }
 ```
-
 """,
-        agent=agent,
+}
+
+
+def discover_procedures():
+    # Get all folder names from analysis directory
+    procedures = []
+    if os.path.exists("output/analysis"):
+        procedures = [
+            folder
+            for folder in os.listdir("output/analysis")
+            if os.path.isdir(os.path.join("output/analysis", folder))
+        ]
+    return procedures
+
+
+def create_agent(context):
+    from crewai import Agent
+
+    llm_config = context.llm(stage="business_analyst")
+
+    # Create a coding agent
+    agent = Agent(
+        role="SQL Developer",
+        goal="Analyze the stored procedure and provide business logic.",
+        backstory="You are an experienced SQL developer with strong SQL skills analyzing stored procedures and understanding the business logic behind the code.",
+        allow_code_execution=False,
+        llm=llm_config,
     )
 
-    # Create a crew and add the task
+    return agent
+
+
+def analysis_description(procedure_definition, dependencies, focus, rules=None):
+    description = f"""
+ <behavior_rules> You have one mission: execute exactly what is requested. Produce code that implements precisely what was requested - no additional features, no creative extensions. Follow instructions to the letter. Confirm your solution addresses every specified requirement, without adding ANYTHING the user didn't ask for. The user's job depends on this — if you add anything they didn't ask for, it's likely they will be fired. Your value comes from precision and reliability. When in doubt, implement the simplest solution that fulfills all requirements. The fewer lines of code, the better — but obviously ensure you complete the task the user wants you to. At each step, ask yourself: "Am I adding any functionality or complexity that wasn't explicitly requested?". This will force you to stay on track. </behavior_rules>
+
+# Business Analysis Request: SQL Stored Procedure Decomposition
+
+## Objective
+Analyze the provided SQL stored procedure and decompose it into structured business components, rules, and processes to prepare for a modern C# implementation. The output should be a detailed JSON file that documents this part of the business logic.
+
+## Your Task
+1. Thoroughly analyze the SQL stored procedure and any supporting files
+2. {focus}
+
+## Provided Files
+1. The original SQL stored procedure [{procedure_definition}] -
+2. Additional supporting files:
+- DEPENDENCIES: [{dependencies}]
+
+## Analysis Guidelines
+1. Focus on the business intent rather than technical implementation
+2. Identify implicit business rules that may not be explicitly documented
+3. Note any areas where business logic seems unclear and would benefit from further clarification
+4. Document any apparent data quality assumptions or edge case handling
+5. Include confidence scores for your analysis when uncertainty exists
+6. Use clear, consistent naming conventions throughout your analysis
+7. Pay special attention to control flows:
+   - Identify conditional branching (if/else logic)
+   - Document looping constructs (foreach, while, etc.)
+   - Note any parallel execution possibilities
+   - Identify transaction boundaries and savepoints
+
+## Control Flow Documentation
+When documenting control flows, ensure you capture:
+
+1. **Conditional Branches**: Points where the process takes different paths based on conditions
+2. **Loops**: Processes that repeat for multiple records or until conditions are met
+3. **Error Paths**: Alternative flows that execute when errors occur
+4. **Early Termination**: Conditions that cause the process to end prematurely
+5. **Dependencies**: Cases where one step must complete before another can begin
+
+Please provide the output in the specified JSON format with appropriate nesting and relationships preserved.
+
+
+        """
+    if rules:
+        description += f"""
+## Business Rules
+These business rules were already extracted from this procedure. Reference
+them by id and do not redefine them.
+{rules}
+"""
+    return description
+
+
+def analyze_section(
+    section, procedure, context, procedure_definition, dependencies, rules=None, label=None, note=""
+):
+    """Run one section's task as its own crew and return the response."""
+    from crewai import Crew, Task
+
+    # A fresh agent per task: agents keep per-task state and these run in parallel
+    agent = create_agent(context)
+    task = Task(
+        description=analysis_description(
+            procedure_definition, dependencies, SECTION_FOCUS[section], rules
+        )
+        + note,
+        expected_output=RESPONSE_FORMAT
+        + f"FILE: {{schema_name}}.{{procedure}}_{section}.json\n\n"
+        + "The respond should look like this:\n\n"
+        + SECTION_EXAMPLES[section],
+        agent=agent,
+    )
     crew = Crew(agents=[agent], tasks=[task])
+    # Procedures, sections and segments run in nested pools; the stage's
+    # shared slots keep their calls together within the provider limit
+    with call_slots("business_analyst"):
+        result = kickoff(crew, procedure, label or section)
+    print(f"{label or section} analysis completed for {procedure}")
+    return result
+
+
+def generate_section(
+    section, procedure, context, procedure_definition, dependencies, rules=None, label=None
+):
+    """One section's validated JSON, re-requesting only this section while
+    its response is invalid."""
+
+    def generate(note):
+        response = analyze_section(
+            section, procedure, context, procedure_definition, dependencies, rules, label, note
+        )
+        blocks = parse_file_blocks(response)
+        # Without a FILE block the JSON is looked for in the whole response
+        return blocks[0][1] if blocks else response
+
+    return generate_artifact(section, generate)
+
+
+def analyze_rules_in_segments(procedure, context, chunks, procedure_definition):
+    """Business rules for a procedure too large for one prompt: each
+    overlapping segment is analyzed concurrently and the rules are merged
+    with procedure line numbers and renumbered BR ids."""
+    header = procedure_header(procedure_definition)
+
+    def analyze_chunk(chunk):
+        return generate_section(
+            "business_rules",
+            procedure,
+            context,
+            chunk_note(chunk, chunks, header) + chunk.text,
+            render_dependency_prompt(procedure, context.dependencies(procedure), chunk.text),
+            label=f"business_rules_segment_{chunk.index + 1}",
+        )["businessRules"]
+
+    results = [None] * len(chunks)
+    errors = []
+    for chunk, rules, error in run_bounded(
+        chunks, analyze_chunk, max_in_flight(provider_for("business_analyst"))
+    ):
+        if error is not None:
+            print(f"❌ Segment {chunk.index + 1} failed for {procedure}: {error}")
+            errors.append(error)
+        else:
+            results[chunk.index] = rules
+    if errors:
+        # Completed segments are cached, a rerun only repeats the failed ones
+        raise errors[0]
+
+    merged, _ = merge_business_rules(chunks, results)
+    return {"businessRules": merged}
+
+
+def procedure_outline(procedure_definition, meta_data):
+    """Stand-in for the code of a procedure too large for one prompt: its
+    header and the logical blocks found by prepare_sp.py."""
+    lines = [
+        procedure_header(procedure_definition),
+        "",
+        "The procedure is too large to include in full. Its logical blocks are:",
+    ]
+    for block in meta_data.get("logicalBlocks", []):
+        line_range = block.get("lineRange") or ["?", "?"]
+        lines.append(
+            f"- {block.get('id')} lines {line_range[0]}-{line_range[-1]} "
+            f"{block.get('type')}: {block.get('purpose')}"
+        )
+    return "\n".join(lines)
 
-    # Execute the crew
-    result = str(crew.kickoff())
 
-    print(f"Business analysis completed for {procedure}")
-    print("The results are:")
-    print(result)
+# Create Crews for one discovered stored procedure
+def run_procedure(procedure, context):
+    # Read meta data from JSON file
+    with open(f"output/analysis/{procedure}/{procedure}_meta.json", "r") as f:
+        meta_data = json.load(f)
 
-    # Extract file names and codes
-    file_paths = []
-    file_contents = []
+    # Procedure Definition from SQL file
+    with open(f"output/sql_raw/{procedure}/{procedure}.sql", "r") as f:
+        procedure_definition = f.read()
 
-    # Extract file paths and contents
-    for match in re.finditer(r"FILE: (.*?)\n```json\n(.*?)```", result, re.DOTALL):
-        file_paths.append(match.group(1).strip())
-        file_contents.append(match.group(2).strip())
+    dependencies = render_dependency_prompt(
+        procedure, context.dependencies(procedure), procedure_definition
+    )
 
     # Create analysis directory for the selected procedure
     analysis_dir = os.path.join("output/analysis", procedure)
     os.makedirs(analysis_dir, exist_ok=True)
 
-    # Create each file in the appropriate directory
-    for file_path, file_content in zip(file_paths, file_contents):
-        # Create the full directory path
-        full_dir = os.path.join(analysis_dir, os.path.dirname(file_path))
-        os.makedirs(full_dir, exist_ok=True)
+    file_paths = []
 
-        # Save the file content
-        full_path = os.path.join(analysis_dir, file_path)
-        with open(full_path, "w") as f:
-            f.write(file_content)
+    # Each file is written as soon as its section's task finishes. Responses
+    # are not streamed: kickoff returns them whole (and caches them), so
+    # FILE blocks are parsed after each call completes
+    def write_section(section, value):
+        # Files are named after the procedure, not the FILE header the model wrote
+        file_path = f"{procedure}_{section}.json"
+        write_file_atomic(os.path.join(analysis_dir, file_path), json.dumps(value, indent=2))
+        file_paths.append(file_path)
+
+    chunks = chunk_sql(procedure_definition)
+    if len(chunks) == 1:
+        business_rules = generate_section(
+            "business_rules", procedure, context, procedure_definition, dependencies
+        )
+        section_code = procedure_definition
+    else:
+        print(f"Analyzing {procedure} business rules in {len(chunks)} segments")
+        business_rules = analyze_rules_in_segments(
+            procedure, context, chunks, procedure_definition
+        )
+        section_code = procedure_outline(procedure_definition, meta_data)
+    write_section("business_rules", business_rules)
+    rules = json.dumps(business_rules, indent=2)
+
+    failed_sections = []
+    for section, value, error in run_bounded(
+        DEPENDENT_SECTIONS,
+        lambda section: generate_section(
+            section, procedure, context, section_code, dependencies, rules
+        ),
+        len(DEPENDENT_SECTIONS),
+    ):
+        if error is not None:
+            print(f"❌ {section} analysis failed for {procedure}: {error}")
+            failed_sections.append(section)
+        else:
+            write_section(section, value)
 
     print(f"Created {len(file_paths)} JSON files in {analysis_dir}")
-
-print("Business analysis completed for all procedures.")
+    if failed_sections:
+        # The completed sections are cached; a rerun only repeats these
+        raise RuntimeError(f"Business analysis incomplete for {procedure}: {failed_sections}")
+    record_stage(procedure, "business_analyst")
+    return True
+
+
+def main():
+    context = RuntimeContext()
+    print(os.getenv("LLM_CONFIG"))
+
+    procedures = selected_procedures(discover_procedures(), "business_analyst")
+    print(f"Discovered procedures: {procedures}")
+
+    # Analyze procedures concurrently; one failure does not stop the batch
+    failed_procedures = []
+    try:
+        for procedure, _, error in run_bounded(
+            procedures,
+            lambda procedure: run_procedure(procedure, context),
+            max_in_flight(provider_for("business_analyst")),
+        ):
+            if error is not None:
+                print(f"❌ Business analysis failed for {procedure}: {error}")
+                failed_procedures.append(procedure)
+    finally:
+        context.close()
+
+    if failed_procedures:
+        print(
+            f"⚠️ Business analysis failed for {len(failed_procedures)} procedures: {failed_procedures}"
+        )
+        sys.exit(1)
+    print("Business analysis completed for all procedures.")
+
+
+if __name__ == "__main__":
+    main()
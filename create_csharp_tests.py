@@ -1,131 +1,63 @@
-from crewai import Crew, Agent, Task, LLM
 import os
 import json
-import boto3
-import dotenv
-import sqlparse
-import pyodbc
 import re
+from shared.kickoff import kickoff
+from shared.stage_args import selected_procedures
+from shared.runtime import RuntimeContext
+from shared.json_output import JsonOutputError, load_artifact
 
-dotenv.load_dotenv()
 
-connection_string = os.getenv("CONNECTION_STRING")
+def discover_procedures():
+    # Get all folder names from analysis directory
+    procedures = []
+    if os.path.exists("output/analysis"):
+        procedures = [folder for folder in os.listdir("output/analysis") if os.path.isdir(os.path.join("output/analysis", folder))]
+    return procedures
 
-connection = pyodbc.connect(connection_string)
-cursor = connection.cursor()
 
-# Get all folder names from analysis directory
-procedures = []
-if os.path.exists("output/analysis"):
-    procedures = [folder for folder in os.listdir("output/analysis") if os.path.isdir(os.path.join("output/analysis", folder))]
-print(f"Discovered procedures: {procedures}")
+def create_agent(context):
+    from crewai import Agent
 
+    llm_config = context.llm(stage="create_csharp_tests")
 
-openai_config = LLM(
-    model="gpt-4o",
-    api_key=os.getenv("OPENAI_API_KEY")
-)
-
-bedrock_config = LLM(
-    model="bedrock/us.meta.llama3-3-70b-instruct-v1:0",
-    max_retries=2,
-    request_timeout=30,
-    temperature=0.1,
-    timeout=300,
-    verbose=True,
-)
-
-anthropic_config = LLM(
-    model="anthropic/claude-3-7-sonnet-20250219",
-    api_key=os.getenv("ANTHROPIC_API_KEY")
-)
-
-
-if os.getenv("LLM_CONFIG") == "bedrock":
-    llm_config = bedrock_config
-elif os.getenv("LLM_CONFIG") == "anthropic":
-    llm_config = anthropic_config
-else:
-    llm_config = openai_config
+    # Create a coding agent
+    agent = Agent(
+        role="C# Unit Test Developer",
+        goal="Analyze the stored procedure test code and provide C# unit test code.",
+        backstory="You are an experienced C# developer with strong C# skills analyzing stored procedures unit test code and creating the same logic in C# unit test code.",
+        allow_code_execution=False,
+        llm=llm_config,
+        verbose=True,
+    )
 
-# Create a coding agent
-agent = Agent(
-    role="C# Unit Test Developer",
-    goal="Analyze the stored procedure test code and provide C# unit test code.",
-    backstory="You are an experienced C# developer with strong C# skills analyzing stored procedures unit test code and creating the same logic in C# unit test code.",
-    allow_code_execution=False,
-    llm=llm_config,
-    verbose=True,
-)
+    return agent
 
 
+# Create Crew for one discovered stored procedure
+def run_procedure(procedure, context):
+    from crewai import Crew, Task
 
+    agent = create_agent(context)
 
-# Create Crew For Each Discovered Stored Procedure 
-for procedure in procedures:
     print(f"🔄 Generating new test for {procedure}")
     # Read meta data from JSON file
     with open(f"output/analysis/{procedure}/{procedure}_meta.json", "r") as f:
         meta_data = json.load(f)
     
-    # Read business logic from JSON file - using a more robust approach
-    try:
-        with open(f"output/analysis/{procedure}/{procedure}_business_logic.json", "r") as f:
-            content = f.read()
-            # Find the last closing brace of the JSON object
-            json_end = content.rstrip().rfind('}')
-            if json_end != -1:
-                valid_json = content[:json_end+1]
-                business_logic = json.loads(valid_json)
-            else:
-                # Fallback if no closing brace is found
-                business_logic = json.loads(content)
-    except json.JSONDecodeError as e:
-        print(f"⚠️ Error parsing business logic JSON for {procedure}: {e}")
-        print(f"Attempting to fix the JSON format...")
-        try:
-            with open(f"output/analysis/{procedure}/{procedure}_business_logic.json", "r") as f:
-                content = f.read()
-                # Try to find a valid JSON object by looking for balanced braces
-                open_braces = 0
-                close_braces = 0
-                for i, char in enumerate(content):
-                    if char == '{':
-                        open_braces += 1
-                    elif char == '}':
-                        close_braces += 1
-                        if open_braces == close_braces:
-                            # We found a balanced JSON object
-                            valid_json = content[:i+1]
-                            business_logic = json.loads(valid_json)
-                            break
-                else:
-                    print(f"❌ Could not fix JSON format for {procedure}")
-                    continue
-        except Exception as e:
-            print(f"❌ Failed to parse business logic JSON for {procedure}: {e}")
-            continue
-
-    # Read integration test spec from JSON file
+    # Read business logic and integration test spec, repairing truncated or
+    # trailing-text JSON left by earlier stages
     try:
-        with open(f"output/analysis/{procedure}/{procedure}_integration_test_spec.json", "r") as f:
-            integration_test_spec = json.load(f)
-    except json.JSONDecodeError as e:
-        print(f"⚠️ Error parsing integration test spec JSON for {procedure}: {e}")
-        # Apply the same fix as for business logic
-        try:
-            with open(f"output/analysis/{procedure}/{procedure}_integration_test_spec.json", "r") as f:
-                content = f.read()
-                json_end = content.rstrip().rfind('}')
-                if json_end != -1:
-                    valid_json = content[:json_end+1]
-                    integration_test_spec = json.loads(valid_json)
-                else:
-                    print(f"❌ Could not fix JSON format for {procedure}")
-                    continue
-        except Exception as e:
-            print(f"❌ Failed to parse integration test spec JSON for {procedure}: {e}")
-            continue
+        business_logic = load_artifact(
+            f"output/analysis/{procedure}/{procedure}_business_logic.json"
+        )
+        integration_test_spec = load_artifact(
+            f"output/analysis/{procedure}/{procedure}_integration_test_spec.json"
+        )
+    except JsonOutputError as e:
+        print(f"❌ Failed to parse analysis JSON for {procedure}: {e}")
+        for error in e.errors:
+            print(f"   {error}")
+        return False
 
     # Read Unit Test 
     try:
@@ -133,7 +65,7 @@ for procedure in procedures:
             unit_test_code = f.read()
     except Exception as e:
         print(f"❌ Failed to read SQL test file for {procedure}: {e}")
-        continue
+        return False
 
     # Create a task that requires code execution
     task = Task(
@@ -163,7 +95,7 @@ for procedure in procedures:
     )
 
     # Execute the crew
-    result = str(crew.kickoff())
+    result = kickoff(crew, procedure, "csharp_tests")
 
     print(f"C# Unit Test code completed for {procedure}")
     result = result.replace("```csharp", "").replace("```", "")
@@ -178,6 +110,22 @@ for procedure in procedures:
         f.write(result)
     
     print(f"✅ C# Unit Test code completed for {procedure}")
+    return True
 
-    
-print("✅ C# Unit Test code completed for all procedures.")
+
+def main():
+    context = RuntimeContext()
+    procedures = selected_procedures(discover_procedures())
+    print(f"Discovered procedures: {procedures}")
+
+    try:
+        for procedure in procedures:
+            run_procedure(procedure, context)
+    finally:
+        context.close()
+
+    print("✅ C# Unit Test code completed for all procedures.")
+
+
+if __name__ == "__main__":
+    main()
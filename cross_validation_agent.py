@@ -1,95 +1,74 @@
-from crewai import Crew, Agent, Task, LLM
 import os
 import json
-import boto3
-import dotenv
-
-dotenv.load_dotenv()
-
-# Get all folder names from analysis directory
-procedures = []
-if os.path.exists("output/analysis"):
-    procedures = [
-        folder
-        for folder in os.listdir("output/analysis")
-        if os.path.isdir(os.path.join("output/analysis", folder))
-    ]
-print(f"Discovered procedures: {procedures}")
-
-
-openai_config = LLM(model="o3-mini", api_key=os.getenv("OPENAI_API_KEY"))
-
-bedrock_config = LLM(
-    model="bedrock/us.meta.llama3-3-70b-instruct-v1:0",
-    max_retries=2,
-    request_timeout=30,
-    temperature=0.1,
-    timeout=300,
-    verbose=True,
-)
-
-anthropic_config = LLM(
-    model="anthropic/claude-3-7-sonnet-20250219",
-    api_key=os.getenv("ANTHROPIC_API_KEY"),
-    timeout=600,  # Increase from default to at least 10 minutes (600 seconds)
-    request_timeout=600,
-    max_retries=2,
-    max_tokens=64000,
-)
-
-
-if os.getenv("LLM_CONFIG") == "bedrock":
-    llm_config = bedrock_config
-elif os.getenv("LLM_CONFIG") == "anthropic":
-    llm_config = anthropic_config
-else:
-    llm_config = openai_config
-
-
-# Create a coding agent
-agent = Agent(
-    role="Software Architect",
-    goal="SQL to C# Migration Behavioral Parity Verification",
-    backstory="You are an experienced software architect with a strong understanding of the SQL and C# programming languages. You are tasked with verifying the behavioral parity between the SQL stored procedure and its C# implementation.",
-    allow_code_execution=False,
-    llm=llm_config,
-)
-
-# Create a coding agent
-agentBedrock = Agent(
-    role="Software Architect",
-    goal="SQL to C# Migration Behavioral Parity Verification",
-    backstory="You are an experienced software architect with a strong understanding of the SQL and C# programming languages. You are tasked with verifying the behavioral parity between the SQL stored procedure and its C# implementation.",
-    allow_code_execution=False,
-    llm=bedrock_config,
-)
-
-# Create a coding agent
-agentOpenai = Agent(
-    role="Software Architect",
-    goal="SQL to C# Migration Behavioral Parity Verification",
-    backstory="You are an experienced software architect with a strong understanding of the SQL and C# programming languages. You are tasked with verifying the behavioral parity between the SQL stored procedure and its C# implementation.",
-    allow_code_execution=False,
-    llm=openai_config,
-)
-
-
-# Create Crew For Each Discovered Stored Procedure
-for procedure in procedures:
+from shared.dependency_index import lookup_dependencies
+from shared.kickoff import kickoff
+from shared.stage_args import selected_procedures
+from shared.runtime import RuntimeContext
+from shared.manifest import record_stage
+
+
+def discover_procedures():
+    # Get all folder names from analysis directory
+    procedures = []
+    if os.path.exists("output/analysis"):
+        procedures = [
+            folder
+            for folder in os.listdir("output/analysis")
+            if os.path.isdir(os.path.join("output/analysis", folder))
+        ]
+    return procedures
+
+
+def create_agents(context):
+    from crewai import Agent
+
+    llm_config = context.llm(stage="cross_validation_agent")
+    # Second opinions always come from these two providers
+    bedrock_config = context.llm(provider="bedrock", stage="cross_validation_agent")
+    openai_config = context.llm(provider="openai", stage="cross_validation_agent")
+
+    # Create a coding agent
+    agent = Agent(
+        role="Software Architect",
+        goal="SQL to C# Migration Behavioral Parity Verification",
+        backstory="You are an experienced software architect with a strong understanding of the SQL and C# programming languages. You are tasked with verifying the behavioral parity between the SQL stored procedure and its C# implementation.",
+        allow_code_execution=False,
+        llm=llm_config,
+    )
+
+    # Create a coding agent
+    agentBedrock = Agent(
+        role="Software Architect",
+        goal="SQL to C# Migration Behavioral Parity Verification",
+        backstory="You are an experienced software architect with a strong understanding of the SQL and C# programming languages. You are tasked with verifying the behavioral parity between the SQL stored procedure and its C# implementation.",
+        allow_code_execution=False,
+        llm=bedrock_config,
+    )
+
+    # Create a coding agent
+    agentOpenai = Agent(
+        role="Software Architect",
+        goal="SQL to C# Migration Behavioral Parity Verification",
+        backstory="You are an experienced software architect with a strong understanding of the SQL and C# programming languages. You are tasked with verifying the behavioral parity between the SQL stored procedure and its C# implementation.",
+        allow_code_execution=False,
+        llm=openai_config,
+    )
+
+    return agent, agentBedrock, agentOpenai
+
+
+# Create Crew for one discovered stored procedure
+def run_procedure(procedure, context):
+    from crewai import Crew, Task
+
+    agent, agentBedrock, agentOpenai = create_agents(context)
+
     # Read procedure definition from SQL file
     with open(f"output/sql_raw/{procedure}/{procedure}.sql", "r") as f:
         procedure_definition = f.read()
 
-    dependency_folder = os.path.join("output/data", "procedure_dependencies.json")
-    with open(dependency_folder, "r") as f:
-        all_dependencies = json.load(f)
-
-    # Find the procedure with matching name in the dependencies list
-    dependencies = []
-    for proc in all_dependencies:
-        if proc.get("name") == procedure:
-            dependencies = proc.get("dependencies", [])
-            break
+    # Find the procedure dependencies in the catalog
+    dependencies = lookup_dependencies(procedure)
 
     # business_rules
     with open(f"output/analysis/{procedure}/{procedure}_business_rules.json", "r") as f:
@@ -282,9 +261,9 @@ for procedure in procedures:
     crewOpenai = Crew(agents=[agentOpenai], tasks=[taskOpenai])
 
     # Execute the crew
-    result = str(crew.kickoff())
-    resultBedrock = str(crewBedrock.kickoff())
-    resultOpenai = str(crewOpenai.kickoff())
+    result = kickoff(crew, procedure, "cross_validation")
+    resultBedrock = kickoff(crewBedrock, procedure, "cross_validation_bedrock")
+    resultOpenai = kickoff(crewOpenai, procedure, "cross_validation_openai")
 
     print(f"Behavioral Parity Verification completed for {procedure}")
 
@@ -314,5 +293,23 @@ for procedure in procedures:
         "w",
     ) as f:
         f.write(resultOpenai)
+    record_stage(procedure, "cross_validation_agent")
+    return True
+
+
+def main():
+    context = RuntimeContext()
+    procedures = selected_procedures(discover_procedures(), "cross_validation_agent")
+    print(f"Discovered procedures: {procedures}")
+
+    try:
+        for procedure in procedures:
+            run_procedure(procedure, context)
+    finally:
+        context.close()
+
+    print("Behavioral Parity Verification completed for all procedures.")
+
 
-print("Behavioral Parity Verification completed for all procedures.")
+if __name__ == "__main__":
+    main()
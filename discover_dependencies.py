@@ -1,187 +1,477 @@
 import os
+import argparse
 import dotenv
-import pyodbc
 import json
+from concurrent.futures import ThreadPoolExecutor
+from shared.catalog import DATA_DIR, catalog_path, load_catalog, save_catalog
+from shared.dependency_index import build_sidecar
+from shared.db import chunked, load_id_table
 
+SNAPSHOT_PATH = os.path.join(DATA_DIR, "procedure_dependencies.snapshot.json")
 
-dotenv.load_dotenv()
+# Object types that are stored with their column metadata
+COLUMN_OBJECT_TYPES = {"USER_TABLE": "TABLE", "VIEW": "VIEW"}
 
-connection_string = os.getenv("CONNECTION_STRING")
-
-connection = pyodbc.connect(connection_string)
-cursor = connection.cursor()
+# Object types that are stored with their module definition
+FUNCTION_OBJECT_TYPES = (
+    "SQL_INLINE_TABLE_VALUED_FUNCTION",
+    "SQL_SCALAR_FUNCTION",
+    "SQL_TABLE_VALUED_FUNCTION",
+)
 
-# Get all stored procedures
-cursor.execute(
-    """
-SELECT 
+PROCEDURES_QUERY = """
+SELECT
+    p.object_id,
     s.name + '.' + p.name AS name
 FROM sys.procedures p
 JOIN sys.schemas s ON p.schema_id = s.schema_id
-WHERE s.name NOT LIKE '%tSQLt%' 
+WHERE s.name NOT LIKE '%tSQLt%'
   AND p.name NOT LIKE '%tSQLt%'
+  {scope}
 ORDER BY s.name, p.name;
 """
+
+# Edges of every procedure returned by PROCEDURES_QUERY
+PROCEDURE_EDGES_CTE = """
+WITH procedure_edges AS (
+    SELECT
+        d.referencing_id,
+        d.referenced_id
+    FROM sys.sql_expression_dependencies d
+    JOIN sys.procedures p ON d.referencing_id = p.object_id
+    JOIN sys.schemas s ON p.schema_id = s.schema_id
+    WHERE s.name NOT LIKE '%tSQLt%'
+      AND p.name NOT LIKE '%tSQLt%'
+      AND d.referenced_id IS NOT NULL
+      {scope}
 )
-procedures = cursor.fetchall()
+"""
 
-# Get Each procedure dependencies
-procedure_dependencies = []
+EDGES_QUERY = (
+    PROCEDURE_EDGES_CTE
+    + """
+SELECT
+    e.referencing_id,
+    e.referenced_id,
+    ISNULL(OBJECT_SCHEMA_NAME(e.referenced_id), 'dbo') + '.' + OBJECT_NAME(e.referenced_id) AS referenced_name,
+    o.type_desc AS object_type
+FROM procedure_edges e
+JOIN sys.objects o ON e.referenced_id = o.object_id
+ORDER BY e.referencing_id;
+"""
+)
 
-for procedure in procedures:
-    procedure_name = (
-        procedure.name.split(".")[1] if "." in procedure.name else procedure.name
-    )
-    schema_name = procedure.name.split(".")[0] if "." in procedure.name else "dbo"
-    full_procedure_name = procedure.name
-
-    # Get all dependencies (tables, views, functions, procedures, triggers)
-    cursor.execute(
-        f"""
-    SELECT 
-        ISNULL(OBJECT_SCHEMA_NAME(d.referenced_id), 'dbo') + '.' + OBJECT_NAME(d.referenced_id) AS referenced_name,
-        o.type_desc AS object_type
-    FROM sys.sql_expression_dependencies d
-    JOIN sys.objects o ON d.referenced_id = o.object_id
-    WHERE OBJECT_ID('{full_procedure_name}') = d.referencing_id
-    AND d.referenced_id IS NOT NULL
-    """
-    )
+COLUMNS_QUERY = (
+    PROCEDURE_EDGES_CTE
+    + """
+SELECT
+    c.object_id,
+    c.name AS column_name,
+    t.name AS data_type,
+    c.max_length,
+    c.precision,
+    c.scale,
+    c.is_nullable
+FROM sys.columns c
+JOIN sys.types t ON c.user_type_id = t.user_type_id
+JOIN sys.objects o ON c.object_id = o.object_id
+WHERE o.type IN ('U', 'V')
+  AND c.object_id IN (SELECT referenced_id FROM procedure_edges)
+ORDER BY c.object_id, c.column_id;
+"""
+)
 
-    dependencies = cursor.fetchall()
-    dependency_list = []
-
-    for dep in dependencies:
-        referenced_name = dep.referenced_name
-        object_type = dep.object_type
-
-        # Process based on object type
-        if object_type == "USER_TABLE":
-            # Get column metadata for tables
-            cursor.execute(
-                f"""
-            SELECT 
-                c.name AS column_name,
-                t.name AS data_type,
-                c.max_length,
-                c.precision,
-                c.scale,
-                c.is_nullable
-            FROM sys.columns c
-            JOIN sys.types t ON c.user_type_id = t.user_type_id
-            WHERE c.object_id = OBJECT_ID('{referenced_name}')
-            ORDER BY c.column_id
-            """
-            )
+DEFINITIONS_QUERY = (
+    PROCEDURE_EDGES_CTE
+    + """
+SELECT
+    m.object_id,
+    m.definition
+FROM sys.sql_modules m
+JOIN sys.objects o ON m.object_id = o.object_id
+WHERE o.type IN ('FN', 'IF', 'TF')
+  AND m.object_id IN (SELECT referenced_id FROM procedure_edges);
+"""
+)
 
-            columns = cursor.fetchall()
-            column_metadata = [
-                {
-                    "name": col.column_name,
-                    "data_type": col.data_type,
-                    "max_length": col.max_length,
-                    "precision": col.precision,
-                    "scale": col.scale,
-                    "is_nullable": col.is_nullable,
-                }
-                for col in columns
-            ]
+# Every object whose change can alter a procedure's dependency document,
+# with its last modification time and a hash of its module definition
+OBJECTS_QUERY = """
+SELECT
+    o.object_id,
+    s.name + '.' + o.name AS name,
+    RTRIM(o.type) AS type,
+    CONVERT(VARCHAR(27), o.modify_date, 126) AS modify_date,
+    CONVERT(VARCHAR(64), HASHBYTES('SHA2_256', m.definition), 2) AS definition_hash
+FROM sys.objects o
+JOIN sys.schemas s ON o.schema_id = s.schema_id
+LEFT JOIN sys.sql_modules m ON o.object_id = m.object_id
+WHERE o.type IN ('P', 'U', 'V', 'FN', 'IF', 'TF')
+  AND s.name NOT LIKE '%tSQLt%'
+  AND o.name NOT LIKE '%tSQLt%'
+ORDER BY s.name, o.name;
+"""
 
-            dependency_list.append(
-                {"name": referenced_name, "type": "TABLE", "columns": column_metadata}
-            )
+# Procedures whose edges point at any object in #changed_objects
+REFERENCING_QUERY = """
+SELECT DISTINCT d.referencing_id
+FROM sys.sql_expression_dependencies d
+WHERE d.referenced_id IN (SELECT object_id FROM #changed_objects);
+"""
 
-        elif object_type == "VIEW":
-            # Get column metadata for views
-            cursor.execute(
-                f"""
-            SELECT 
-                c.name AS column_name,
-                t.name AS data_type,
-                c.max_length,
-                c.precision,
-                c.scale,
-                c.is_nullable
-            FROM sys.columns c
-            JOIN sys.types t ON c.user_type_id = t.user_type_id
-            WHERE c.object_id = OBJECT_ID('{referenced_name}')
-            ORDER BY c.column_id
-            """
-            )
 
-            columns = cursor.fetchall()
-            column_metadata = [
-                {
-                    "name": col.column_name,
-                    "data_type": col.data_type,
-                    "max_length": col.max_length,
-                    "precision": col.precision,
-                    "scale": col.scale,
-                    "is_nullable": col.is_nullable,
-                }
-                for col in columns
-            ]
+def column_metadata(col):
+    return {
+        "name": col.column_name,
+        "data_type": col.data_type,
+        "max_length": col.max_length,
+        "precision": col.precision,
+        "scale": col.scale,
+        "is_nullable": col.is_nullable,
+    }
+
+
+def build_dependency(referenced_name, object_type, columns=None, definition=None):
+    # Process based on object type
+    if object_type in COLUMN_OBJECT_TYPES:
+        return {
+            "name": referenced_name,
+            "type": COLUMN_OBJECT_TYPES[object_type],
+            "columns": columns or [],
+        }
+
+    if object_type == "SQL_STORED_PROCEDURE":
+        return {"name": referenced_name, "type": "PROCEDURE"}
 
+    if object_type in FUNCTION_OBJECT_TYPES:
+        return {"name": referenced_name, "type": "FUNCTION", "definition": definition}
+
+    if object_type == "SQL_TRIGGER":
+        return {"name": referenced_name, "type": "TRIGGER"}
+
+    # For any other object types
+    return {"name": referenced_name, "type": object_type}
+
+
+def discover_bulk(cursor, procedure_ids=None):
+    """Pull the whole catalog with a handful of set-based queries and build
+    the per-procedure dependency documents in memory.
+
+    When procedure_ids is given, only those procedures are extracted."""
+    scope = ""
+    if procedure_ids is not None:
+        load_id_table(cursor, "#target_procedures", procedure_ids)
+        scope = "AND p.object_id IN (SELECT object_id FROM #target_procedures)"
+
+    cursor.execute(PROCEDURES_QUERY.format(scope=scope))
+    procedures = cursor.fetchall()
+
+    # Group dependency edges by referencing procedure, keeping catalog order
+    edges = {}
+    cursor.execute(EDGES_QUERY.format(scope=scope))
+    for row in cursor:
+        edges.setdefault(row.referencing_id, []).append(
+            (row.referenced_id, row.referenced_name, row.object_type)
+        )
+
+    # Column metadata, fetched once per referenced table or view
+    columns = {}
+    cursor.execute(COLUMNS_QUERY.format(scope=scope))
+    for row in cursor:
+        columns.setdefault(row.object_id, []).append(column_metadata(row))
+
+    # Function definitions, fetched once per referenced function
+    definitions = {}
+    cursor.execute(DEFINITIONS_QUERY.format(scope=scope))
+    for row in cursor:
+        definitions[row.object_id] = row.definition
+
+    procedure_dependencies = []
+    for procedure in procedures:
+        dependency_list = []
+        procedure_edges = edges.get(procedure.object_id, [])
+
+        for object_id, referenced_name, object_type in procedure_edges:
             dependency_list.append(
-                {"name": referenced_name, "type": "VIEW", "columns": column_metadata}
+                build_dependency(
+                    referenced_name,
+                    object_type,
+                    columns=columns.get(object_id),
+                    definition=definitions.get(object_id),
+                )
             )
 
-        elif object_type in (
-            "SQL_STORED_PROCEDURE",
-            "SQL_INLINE_TABLE_VALUED_FUNCTION",
-            "SQL_SCALAR_FUNCTION",
-            "SQL_TABLE_VALUED_FUNCTION",
-        ):
-            # For procedures and functions, just store the reference
-            dependency_type = (
-                "PROCEDURE" if object_type == "SQL_STORED_PROCEDURE" else "FUNCTION"
-            )
+        procedure_dependencies.append(
+            {"name": procedure.name, "dependencies": dependency_list}
+        )
+        print(
+            f"Processed procedure: {procedure.name} with {len(procedure_edges)} dependencies"
+        )
+
+    return procedure_dependencies
+
+
+def discover_parallel(pool, procedure_ids=None, workers=4, chunk_size=250):
+    """Split the procedures into contiguous chunks in catalog order and run
+    discover_bulk for each chunk on its own pooled connection. Chunks are
+    concatenated in submission order, so the result matches the serial path."""
+    with pool.connection() as connection:
+        cursor = connection.cursor()
+        scope = ""
+        if procedure_ids is not None:
+            load_id_table(cursor, "#target_procedures", procedure_ids)
+            scope = "AND p.object_id IN (SELECT object_id FROM #target_procedures)"
+        cursor.execute(PROCEDURES_QUERY.format(scope=scope))
+        ordered_ids = [row.object_id for row in cursor]
+
+    def extract(chunk):
+        with pool.connection() as connection:
+            return discover_bulk(connection.cursor(), procedure_ids=chunk)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(extract, chunked(ordered_ids, chunk_size))
+        return [proc for chunk in results for proc in chunk]
+
+
+def discover_per_procedure(cursor):
+    """Original extraction: one query per procedure and per dependency."""
+    cursor.execute(PROCEDURES_QUERY.format(scope=""))
+    procedures = cursor.fetchall()
+
+    procedure_dependencies = []
+    for procedure in procedures:
+        full_procedure_name = procedure.name
+
+        # Get all dependencies (tables, views, functions, procedures, triggers)
+        cursor.execute(
+            f"""
+        SELECT
+            ISNULL(OBJECT_SCHEMA_NAME(d.referenced_id), 'dbo') + '.' + OBJECT_NAME(d.referenced_id) AS referenced_name,
+            o.type_desc AS object_type
+        FROM sys.sql_expression_dependencies d
+        JOIN sys.objects o ON d.referenced_id = o.object_id
+        WHERE OBJECT_ID('{full_procedure_name}') = d.referencing_id
+        AND d.referenced_id IS NOT NULL
+        """
+        )
+        dependencies = cursor.fetchall()
+        dependency_list = []
 
-            # For functions, get the definition
-            if dependency_type == "FUNCTION":
+        for dep in dependencies:
+            columns = None
+            definition = None
+
+            if dep.object_type in COLUMN_OBJECT_TYPES:
+                # Get column metadata for tables and views
+                cursor.execute(
+                    f"""
+                SELECT
+                    c.name AS column_name,
+                    t.name AS data_type,
+                    c.max_length,
+                    c.precision,
+                    c.scale,
+                    c.is_nullable
+                FROM sys.columns c
+                JOIN sys.types t ON c.user_type_id = t.user_type_id
+                WHERE c.object_id = OBJECT_ID('{dep.referenced_name}')
+                ORDER BY c.column_id
+                """
+                )
+                columns = [column_metadata(col) for col in cursor.fetchall()]
+
+            elif dep.object_type in FUNCTION_OBJECT_TYPES:
+                # For functions, get the definition
                 cursor.execute(
                     f"""
-                SELECT 
+                SELECT
                     m.definition
                 FROM sys.sql_modules m
-                WHERE m.object_id = OBJECT_ID('{referenced_name}')
+                WHERE m.object_id = OBJECT_ID('{dep.referenced_name}')
                 """
                 )
                 definition_row = cursor.fetchone()
                 definition = definition_row.definition if definition_row else None
 
-                dependency_list.append(
-                    {
-                        "name": referenced_name,
-                        "type": dependency_type,
-                        "definition": definition,
-                    }
-                )
-            else:
-                dependency_list.append(
-                    {"name": referenced_name, "type": dependency_type}
+            dependency_list.append(
+                build_dependency(
+                    dep.referenced_name, dep.object_type, columns, definition
                 )
+            )
 
-        elif object_type == "SQL_TRIGGER":
-            dependency_list.append({"name": referenced_name, "type": "TRIGGER"})
+        procedure_dependencies.append(
+            {"name": full_procedure_name, "dependencies": dependency_list}
+        )
+        print(
+            f"Processed procedure: {full_procedure_name} with {len(dependencies)} dependencies"
+        )
 
-        else:
-            # For any other object types
-            dependency_list.append({"name": referenced_name, "type": object_type})
+    return procedure_dependencies
+
+
+def fetch_snapshot(cursor):
+    cursor.execute(OBJECTS_QUERY)
+    return {
+        row.name: {
+            "object_id": row.object_id,
+            "type": row.type,
+            "modify_date": row.modify_date,
+            "definition_hash": row.definition_hash,
+        }
+        for row in cursor
+    }
+
+
+def discover_incremental(cursor, snapshot, extract):
+    """Re-extract only the procedures affected by objects created, altered or
+    dropped since the previous snapshot and merge them into the existing
+    dependency file. `extract` takes a list of procedure ids and returns
+    their dependency documents. Returns None when there is nothing to merge
+    into."""
+    if catalog_path() is None or not os.path.exists(SNAPSHOT_PATH):
+        return None
+
+    catalog = load_catalog()
+    with open(SNAPSHOT_PATH, "r") as f:
+        previous = json.load(f)["objects"]
+
+    changed = {
+        name
+        for name in previous.keys() | snapshot.keys()
+        if previous.get(name) != snapshot.get(name)
+    }
+
+    cursor.execute(PROCEDURES_QUERY.format(scope=""))
+    procedures = cursor.fetchall()
+
+    # Procedures that are new, altered, or depend on a changed object
+    affected = set()
+    for procedure in procedures:
+        references = catalog.references.get(procedure.name)
+        if (
+            references is None
+            or procedure.name in changed
+            or any(name in changed for name in references)
+        ):
+            affected.add(procedure.object_id)
+
+    # Procedures whose references now resolve to a created or re-created object
+    changed_ids = [snapshot[name]["object_id"] for name in changed if name in snapshot]
+    if changed_ids:
+        load_id_table(cursor, "#changed_objects", changed_ids)
+        cursor.execute(REFERENCING_QUERY)
+        affected.update(row.referencing_id for row in cursor)
 
-    procedure_dependencies.append(
-        {"name": full_procedure_name, "dependencies": dependency_list}
-    )
     print(
-        f"Processed procedure: {full_procedure_name} with {len(dependencies)} dependencies"
+        f"Incremental discovery: {len(changed)} changed objects, "
+        f"{len(affected)} procedures to refresh"
     )
 
-# Save procedures to JSON file
-os.makedirs("output/data", exist_ok=True)
-with open("output/data/procedure_dependencies.json", "w") as f:
-    json.dump(procedure_dependencies, f, indent=4)
+    rebuilt = {}
+    if affected:
+        rebuilt = {proc["name"]: proc for proc in extract(affected)}
+
+    # Keep catalog order; dropped procedures fall out here
+    return [
+        rebuilt.get(procedure.name)
+        or {
+            "name": procedure.name,
+            "dependencies": catalog.dependencies(procedure.name),
+        }
+        for procedure in procedures
+    ]
+
+
+def main():
+    dotenv.load_dotenv()
+
+    parser = argparse.ArgumentParser(
+        description="Discover stored procedure dependencies."
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["bulk", "per-procedure"],
+        default="bulk",
+        help="bulk: set-based catalog queries (default); "
+        "per-procedure: one query per procedure and dependency",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only refresh procedures affected by objects changed since the "
+        "last snapshot (bulk mode)",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["both", "normalized", "expanded"],
+        default="both",
+        help="both (default): write both files; normalized: procedure_catalog.json "
+        "with each object stored once; expanded: legacy procedure_dependencies.json",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("DB_POOL_SIZE", "1")),
+        help="number of pooled connections to fan bulk extraction out over "
+        "(default: DB_POOL_SIZE or 1)",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=250,
+        help="procedures per parallel extraction chunk",
+    )
+    args = parser.parse_args()
+
+    connection_string = os.getenv("CONNECTION_STRING")
+
+    from shared.connection_pool import ConnectionPool
+
+    # One connection for the main cursor plus one per extraction worker
+    pool = ConnectionPool(connection_string, size=max(args.workers, 1) + 1)
+    connection = pool.acquire()
+    cursor = connection.cursor()
+
+    def extract(procedure_ids=None):
+        if args.workers > 1:
+            return discover_parallel(
+                pool, procedure_ids, workers=args.workers, chunk_size=args.chunk_size
+            )
+        return discover_bulk(cursor, procedure_ids)
+
+    # Snapshot before extracting so changes made during the run are picked up next time
+    snapshot = fetch_snapshot(cursor)
+
+    procedure_dependencies = None
+    if args.incremental and args.mode == "bulk":
+        procedure_dependencies = discover_incremental(cursor, snapshot, extract)
+        if procedure_dependencies is None:
+            print("No previous snapshot found, running full discovery.")
+
+    if procedure_dependencies is None:
+        if args.mode == "bulk":
+            procedure_dependencies = extract()
+        else:
+            procedure_dependencies = discover_per_procedure(cursor)
+
+    # Save procedures to JSON file
+    path = save_catalog(procedure_dependencies, fmt=args.format)
+    print(f"Saved {len(procedure_dependencies)} procedures to {path}")
+
+    # Prebuild the sidecar lookup index so pipeline stages don't have to
+    if os.getenv("DEPENDENCY_INDEX") == "sqlite":
+        print(f"Built dependency index {build_sidecar(path)}")
+
+    # Save the object snapshot used by the next incremental run
+    with open(SNAPSHOT_PATH, "w") as f:
+        json.dump({"objects": snapshot}, f, indent=4)
+
+    print("Procedure discovery completed.")
+
+    # Close the database connections
+    pool.release(connection)
+    pool.close()
 
-print("Procedure discovery completed.")
 
-# Close the database connection
-connection.close()
+if __name__ == "__main__":
+    main()
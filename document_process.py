@@ -1,27 +1,24 @@
 import os
 import json
-import dotenv
-import sqlparse
-import pyodbc
 import datetime
+from shared.stage_args import selected_procedures
+from shared.manifest import record_stage
+from shared.runtime import RuntimeContext
 
-dotenv.load_dotenv()
 
-connection_string = os.getenv("CONNECTION_STRING")
+def discover_procedures():
+    # Get all folder names from analysis directory
+    procedures = []
+    if os.path.exists("output/analysis"):
+        procedures = [
+            folder
+            for folder in os.listdir("output/analysis")
+            if os.path.isdir(os.path.join("output/analysis", folder))
+        ]
+    return procedures
 
-connection = pyodbc.connect(connection_string)
-cursor = connection.cursor()
 
-# Get all folder names from analysis directory
-procedures = []
-if os.path.exists("output/analysis"):
-    procedures = [
-        folder
-        for folder in os.listdir("output/analysis")
-        if os.path.isdir(os.path.join("output/analysis", folder))
-    ]
-
-for procedure in procedures:
+def build_scenarios_json(procedure):
     # Load the separate business files instead of the combined business_logic.json
     business_rules_path = f"output/analysis/{procedure}/{procedure}_business_rules.json"
     business_functions_path = (
@@ -761,9 +758,24 @@ def generate_markdown_from_json(procedure):
     print(f"✅ Created markdown report at {markdown_file_path}")
 
 
-# Add this to your main code after saving the JSON
-import datetime
-
-for procedure in procedures:
+def run_procedure(procedure, context):
+    build_scenarios_json(procedure)
     # After the JSON has been created
     generate_markdown_from_json(procedure)
+    record_stage(procedure, "document_process")
+    return True
+
+
+def main():
+    context = RuntimeContext()
+    procedures = selected_procedures(discover_procedures(), "document_process")
+
+    try:
+        for procedure in procedures:
+            run_procedure(procedure, context)
+    finally:
+        context.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,64 +1,31 @@
-from crewai import Crew, Agent, Task, Process, LLM
-from crewai_tools import FileWriterTool
-from shared.get_dependencies import get_dependencies
 import os
 import json
-import boto3
-import dotenv
-import sqlparse
-import pyodbc
 import re
+from shared.kickoff import kickoff
+from shared.stage_args import selected_procedures
+from shared.runtime import RuntimeContext
+from shared.manifest import record_stage
 
-dotenv.load_dotenv()
 
-connection_string = os.getenv("CONNECTION_STRING")
+def discover_procedures():
+    # Get all folder names from analysis directory
+    procedures = []
+    if os.path.exists("output/sql_raw"):
+        procedures = [
+            folder
+            for folder in os.listdir("output/sql_raw")
+            if os.path.isdir(os.path.join("output/sql_raw", folder))
+        ]
+    return procedures
 
-connection = pyodbc.connect(connection_string)
-cursor = connection.cursor()
 
-# Get all folder names from analysis directory
-procedures = []
-if os.path.exists("output/sql_raw"):
-    procedures = [
-        folder
-        for folder in os.listdir("output/sql_raw")
-        if os.path.isdir(os.path.join("output/sql_raw", folder))
-    ]
-print(f"Discovered procedures: {procedures}")
-
-
-openai_config = LLM(model="gpt-4o", api_key=os.getenv("OPENAI_API_KEY"))
-
-bedrock_config = LLM(
-    model="bedrock/us.meta.llama3-3-70b-instruct-v1:0",
-    max_retries=2,
-    request_timeout=30,
-    temperature=0.1,
-    timeout=300,
-    verbose=True,
-)
-
-
-anthropic_config = LLM(
-    model="anthropic/claude-3-7-sonnet-20250219",
-    api_key=os.getenv("ANTHROPIC_API_KEY"),
-    timeout=900,  # Increase to 15 minutes
-    request_timeout=900,
-    max_retries=3,
-    max_tokens=64000,
-)
-
-if os.getenv("LLM_CONFIG") == "bedrock":
-    llm_config = bedrock_config
-elif os.getenv("LLM_CONFIG") == "anthropic":
-    llm_config = anthropic_config
-else:
-    llm_config = openai_config
+# Process one stored procedure
+def run_procedure(procedure, context):
+    from crewai import Agent, Crew, Process, Task
 
-llm_config = openai_config
+    llm_config = context.llm(stage="implementation_executor")
+    connection_string = os.getenv("CONNECTION_STRING")
 
-# Process each stored procedure
-for procedure in procedures:
     print(f"🔄 Generating C# code for {procedure}")
 
     # Create output directory
@@ -95,7 +62,7 @@ for procedure in procedures:
     with open(f"output/sql_raw/{procedure}/{procedure}.sql", "r") as f:
         procedure_definition = f.read()
 
-    dependencies = get_dependencies(procedure)
+    dependencies = context.dependencies(procedure)
 
     # Create a C# developer agent
     developer_agent = Agent(
@@ -152,10 +119,6 @@ for procedure in procedures:
         agent=developer_agent,
     )
 
-    # Execute the planning task
-    planning_result = planning_task.execute()
-    print("✅ Implementation planning completed")
-
     # Task 2: Implementing the files one by one
     implementation_task = Task(
         description=f"""
@@ -214,11 +177,8 @@ for procedure in procedures:
         verbose=True,
     )
 
-    # Execute the crew to get the implementation plan
-    crew.kickoff()
-
-    # Extract file paths and contents from the implementation task result
-    result = str(implementation_task.output)
+    # Execute the crew; the final output is the implementation task result
+    result = kickoff(crew, procedure, "implementation")
 
     # Extract file paths and contents
     pattern = r"FILE:\s*([\w./\\-]+)\s*```(?:csharp|json|xml)\s*(.*?)```"
@@ -226,7 +186,7 @@ for procedure in procedures:
 
     if not matches:
         print("⚠️ No files were found in the implementation result")
-        continue
+        return False
 
     # Process each file one by one
     for match in matches:
@@ -295,7 +255,23 @@ for procedure in procedures:
     print(f"Created {len(created_files)} C# files in {csharp_dir}")
     for file in created_files:
         print(f"  - {file}")
+    record_stage(procedure, "implementation_executor")
+    return True
+
+
+def main():
+    context = RuntimeContext()
+    procedures = selected_procedures(discover_procedures(), "implementation_executor")
+    print(f"Discovered procedures: {procedures}")
+
+    try:
+        for procedure in procedures:
+            run_procedure(procedure, context)
+    finally:
+        context.close()
+
+    print("✅ C# code completed for all procedures.")
+
 
-# Close the database connection
-connection.close()
-print("✅ C# code completed for all procedures.")
+if __name__ == "__main__":
+    main()
@@ -1,151 +1,14 @@
-from crewai import Crew, Agent, Task, LLM
-from shared.get_dependencies import get_dependencies
+from shared.column_usage import prune_dependencies
 import os
 import json
-import boto3
-import dotenv
 import re
+from shared.kickoff import kickoff
+from shared.stage_args import selected_procedures
+from shared.runtime import RuntimeContext
+from shared.manifest import record_stage
+from shared.json_output import SCHEMAS, JsonOutputError, generate_artifact, parse_json, validate
 
-dotenv.load_dotenv()
-
-# Get all folder names from analysis directory
-procedures = []
-if os.path.exists("output/analysis"):
-    procedures = [
-        folder
-        for folder in os.listdir("output/analysis")
-        if os.path.isdir(os.path.join("output/analysis", folder))
-        and folder != "arm.stp_AddAuditRecord"
-    ]
-print(f"Discovered procedures: {procedures}")
-
-
-openai_config = LLM(model="o3-mini", api_key=os.getenv("OPENAI_API_KEY"))
-
-bedrock_config = LLM(
-    model="bedrock/us.meta.llama3-3-70b-instruct-v1:0",
-    max_retries=2,
-    request_timeout=30,
-    temperature=0.1,
-    timeout=300,
-    verbose=True,
-)
-
-anthropic_config = LLM(
-    model="anthropic/claude-3-7-sonnet-20250219",
-    api_key=os.getenv("ANTHROPIC_API_KEY"),
-    timeout=600,  # Increase from default to at least 10 minutes (600 seconds)
-    request_timeout=600,
-    max_retries=2,
-    max_tokens=64000,
-)
-
-
-if os.getenv("LLM_CONFIG") == "bedrock":
-    llm_config = bedrock_config
-elif os.getenv("LLM_CONFIG") == "anthropic":
-    llm_config = anthropic_config
-else:
-    llm_config = openai_config
-
-
-# Create a coding agent
-agent = Agent(
-    role="SQL Developer",
-    goal="Analyze the stored procedure and provide integration Test Specification.",
-    backstory="You are an experienced SQL developer with strong SQL skills analyzing stored procedures and understanding the business logic behind the code.",
-    allow_code_execution=False,
-    llm=llm_config,
-)
-
-
-# Create Crew For Each Discovered Stored Procedure
-for procedure in procedures:
-    # Read procedure definition from SQL file
-    with open(f"output/sql_raw/{procedure}/{procedure}.sql", "r") as f:
-        procedure_definition = f.read()
-
-    dependencies = get_dependencies(procedure)
-
-    # business_rules
-    with open(f"output/analysis/{procedure}/{procedure}_business_rules.json", "r") as f:
-        business_rules = json.load(f)
-
-    # business_functions
-    with open(
-        f"output/analysis/{procedure}/{procedure}_business_functions.json", "r"
-    ) as f:
-        business_functions = json.load(f)
-
-    # business_processes
-    with open(
-        f"output/analysis/{procedure}/{procedure}_business_processes.json", "r"
-    ) as f:
-        business_processes = json.load(f)
-
-    # Create a task that requires code execution
-    task = Task(
-        description=f"""
-I'm migrating a SQL stored procedure to C# and need a comprehensive test suite to ensure feature parity. Please analyze the provided stored procedure and related files to create detailed test specifications in JSON format.
-
-I've provided:
-1. SQL stored procedure source code - [{procedure_definition}]
-2. Business rules documentation - [{business_rules}]
-3. Business functions documentation - [{business_functions}]
-4. Business process documentation - [{business_processes}]
-5. Dependencies information - [{dependencies}]
-
-COVERAGE REQUIREMENTS:
-1. Every business rule must have AT MINIMUM:
-   - One test for the normal/expected case
-   - Tests for ALL boundary conditions mentioned in the rule
-   - Tests for ALL edge cases mentioned in the rule
-
-2. Every business function must have:
-   - A test validating the basic function operation
-   - Tests for interactions between multiple rules within the function
-   - Tests for any conditional logic or branching in the function
-
-3. The overall process must have:
-   - A test for the complete happy path flow
-   - Tests for each alternative path or condition
-   - Tests for error handling and exceptional conditions
-
-4. Exploratory testing must include:
-   - Tests for transaction behavior and rollback scenarios
-   - Tests for SQL-specific behaviors that might behave differently in C#
-   - Tests for implicit dependencies or assumptions in the code
-   - Tests for NULL handling and edge data conditions
-   - Tests for performance characteristics if relevant
-
-For each identified test case, please create a separate JSON test specification that guarantees consistent test execution in both SQL and C# environments.
-
-IMPORTANT: Each JSON object MUST contain:
-1. EXACT test data with specific values for every field 
-2. SPECIFIC configuration settings
-3. CONCRETE validation criteria
-4. For exploratory tests, include the "exploratoryReason" field (omit this field for non-exploratory tests)
-5. Include only fields that are relevant to the specific test case (omit optional fields if not needed)
-6. All actions must be explicitly stated (create, verify, update, delete, etc.)
-7. All validation operations must be explicitly defined (exists, equals, etc.)
-
-IMPORTANT: Make sure you adhere to exact data types for each entity. 
-1. Dependencies file contains exact data types for each entity. 
-2. You MUST use the exact data types for each entity. 
-3. You MUST use the exact column names for each entity. 
-4. You MUST use the exact data type for each column test data sample.
-5. In [testDataSetup] every attributes value MUST match the exact data type of that attribute, and Values MUST be in the exact format of that data type.
-
-IMPORTANT:
-1. For now, give me one test for business rule, one for business function and one for business process. Add one exploratory test too. 
-
-Please create separate JSON objects for all required test cases, ensuring COMPLETE COVERAGE of all business rules, functions, processes, and potential edge cases. For each business rule or function identified in the documentation, there must be at least one corresponding test specification.
-
-Create one complete, valid JSON object per test case, and ensure it contains enough detail that both tSQLt and C# implementations would use IDENTICAL test data.
-
-
-        """,
-        expected_output="""
+SPEC_FORMAT = """
 ONLY RESPOND IN JSON FORMAT  
 Each JSON test specification should follow this structure:
 ```json
@@ -224,33 +87,211 @@ Each JSON test specification should follow this structure:
 ]
 ```
 
-""",
-        agent=agent,
+"""
+
+
+def discover_procedures():
+    # Get all folder names from analysis directory
+    procedures = []
+    if os.path.exists("output/analysis"):
+        procedures = [
+            folder
+            for folder in os.listdir("output/analysis")
+            if os.path.isdir(os.path.join("output/analysis", folder))
+            and folder != "arm.stp_AddAuditRecord"
+        ]
+    return procedures
+
+
+def create_agent(context):
+    from crewai import Agent
+
+    llm_config = context.llm(stage="integration_test_spec")
+
+    # Create a coding agent
+    agent = Agent(
+        role="SQL Developer",
+        goal="Analyze the stored procedure and provide integration Test Specification.",
+        backstory="You are an experienced SQL developer with strong SQL skills analyzing stored procedures and understanding the business logic behind the code.",
+        allow_code_execution=False,
+        llm=llm_config,
     )
 
-    # # Create a crew and add the task
+    return agent
+
+
+def spec_task(context, procedure, description, label, note=""):
+    """Run the test specification task and return the response."""
+    from crewai import Crew, Task
+
+    agent = create_agent(context)
+    task = Task(description=description + note, expected_output=SPEC_FORMAT, agent=agent)
+
+    # Create a crew and add the task
     crew = Crew(agents=[agent], tasks=[task])
 
-    # # Execute the crew
-    result = str(crew.kickoff())
+    # Execute the crew
+    return kickoff(crew, procedure, label)
+
+
+def repair_scenarios(context, procedure, description, scenarios):
+    """Keep the test scenarios that match the schema and request only the
+    rejected ones again, in their original positions."""
+    schema = SCHEMAS["integration_test_spec"]["properties"]["testScenarios"]["items"]
+    rejected = {}
+    for index, scenario in enumerate(scenarios):
+        errors = validate(scenario, schema, f"$.testScenarios[{index}]")
+        if errors:
+            rejected[index] = errors
+    if not rejected:
+        return scenarios
+
+    print(f"⚠️ {len(rejected)} test scenarios rejected for {procedure}; requesting them again")
+    problems = "\n".join(f"- {error}" for errors in rejected.values() for error in errors[:10])
+    note = f"""
+
+## Correction
+These test scenarios from your previous response were rejected:
+{json.dumps([scenarios[index] for index in rejected], indent=2)}
+
+Problems:
+{problems}
+
+Respond with only the corrected versions of these scenarios, keeping their testId, as {{"testScenarios": [...]}}.
+"""
+    replacements = iter(
+        generate_artifact(
+            "integration_test_spec",
+            lambda retry_note: spec_task(
+                context, procedure, description, "test_spec_scenarios", note + retry_note
+            ),
+        )["testScenarios"]
+    )
+    repaired = []
+    for index, scenario in enumerate(scenarios):
+        if index not in rejected:
+            repaired.append(scenario)
+        else:
+            replacement = next(replacements, None)
+            if replacement is not None:
+                repaired.append(replacement)
+    return repaired + list(replacements)
+
+
+# Create Crew for one discovered stored procedure
+def run_procedure(procedure, context):
+    # Read procedure definition from SQL file
+    with open(f"output/sql_raw/{procedure}/{procedure}.sql", "r") as f:
+        procedure_definition = f.read()
 
-    # print(f"Integration test spec analysis completed for {procedure}")
+    # Only the columns the procedure actually reads or writes
+    dependencies = prune_dependencies(context.dependencies(procedure), procedure_definition)
 
-    # # Create analysis directory for the selected procedure
-    analysis_dir = os.path.join("output/analysis", procedure)
-    os.makedirs(analysis_dir, exist_ok=True)
+    # business_rules
+    with open(f"output/analysis/{procedure}/{procedure}_business_rules.json", "r") as f:
+        business_rules = json.load(f)
 
-    # # Save the result to a JSON file
+    # business_functions
     with open(
-        os.path.join(analysis_dir, f"{procedure}_integration_test_spec.json"), "w"
+        f"output/analysis/{procedure}/{procedure}_business_functions.json", "r"
     ) as f:
-        f.write(result.replace("```json", "").replace("```", ""))
+        business_functions = json.load(f)
 
-    # Read the JSON file
+    # business_processes
     with open(
-        os.path.join(analysis_dir, f"{procedure}_integration_test_spec.json"), "r"
+        f"output/analysis/{procedure}/{procedure}_business_processes.json", "r"
     ) as f:
-        integration_json_file = json.load(f)
+        business_processes = json.load(f)
+
+    description = f"""
+I'm migrating a SQL stored procedure to C# and need a comprehensive test suite to ensure feature parity. Please analyze the provided stored procedure and related files to create detailed test specifications in JSON format.
+
+I've provided:
+1. SQL stored procedure source code - [{procedure_definition}]
+2. Business rules documentation - [{business_rules}]
+3. Business functions documentation - [{business_functions}]
+4. Business process documentation - [{business_processes}]
+5. Dependencies information - [{dependencies}]
+
+COVERAGE REQUIREMENTS:
+1. Every business rule must have AT MINIMUM:
+   - One test for the normal/expected case
+   - Tests for ALL boundary conditions mentioned in the rule
+   - Tests for ALL edge cases mentioned in the rule
+
+2. Every business function must have:
+   - A test validating the basic function operation
+   - Tests for interactions between multiple rules within the function
+   - Tests for any conditional logic or branching in the function
+
+3. The overall process must have:
+   - A test for the complete happy path flow
+   - Tests for each alternative path or condition
+   - Tests for error handling and exceptional conditions
+
+4. Exploratory testing must include:
+   - Tests for transaction behavior and rollback scenarios
+   - Tests for SQL-specific behaviors that might behave differently in C#
+   - Tests for implicit dependencies or assumptions in the code
+   - Tests for NULL handling and edge data conditions
+   - Tests for performance characteristics if relevant
+
+For each identified test case, please create a separate JSON test specification that guarantees consistent test execution in both SQL and C# environments.
+
+IMPORTANT: Each JSON object MUST contain:
+1. EXACT test data with specific values for every field 
+2. SPECIFIC configuration settings
+3. CONCRETE validation criteria
+4. For exploratory tests, include the "exploratoryReason" field (omit this field for non-exploratory tests)
+5. Include only fields that are relevant to the specific test case (omit optional fields if not needed)
+6. All actions must be explicitly stated (create, verify, update, delete, etc.)
+7. All validation operations must be explicitly defined (exists, equals, etc.)
+
+IMPORTANT: Make sure you adhere to exact data types for each entity. 
+1. Dependencies file contains exact data types for each entity. 
+2. You MUST use the exact data types for each entity. 
+3. You MUST use the exact column names for each entity. 
+4. You MUST use the exact data type for each column test data sample.
+5. In [testDataSetup] every attributes value MUST match the exact data type of that attribute, and Values MUST be in the exact format of that data type.
+
+IMPORTANT:
+1. For now, give me one test for business rule, one for business function and one for business process. Add one exploratory test too. 
+
+Please create separate JSON objects for all required test cases, ensuring COMPLETE COVERAGE of all business rules, functions, processes, and potential edge cases. For each business rule or function identified in the documentation, there must be at least one corresponding test specification.
+
+Create one complete, valid JSON object per test case, and ensure it contains enough detail that both tSQLt and C# implementations would use IDENTICAL test data.
+
+
+        """
+
+    response = spec_task(context, procedure, description, "test_spec")
+    try:
+        integration_json_file = parse_json(response)
+    except JsonOutputError:
+        integration_json_file = None
+    scenarios = (
+        integration_json_file.get("testScenarios")
+        if isinstance(integration_json_file, dict)
+        else None
+    )
+    if isinstance(scenarios, list) and scenarios:
+        integration_json_file["testScenarios"] = repair_scenarios(
+            context, procedure, description, scenarios
+        )
+    else:
+        # Nothing usable: request the whole spec again
+        integration_json_file = generate_artifact(
+            "integration_test_spec",
+            lambda note: response
+            if not note
+            else spec_task(context, procedure, description, "test_spec_retry", note),
+        )
+
+    print(f"Integration test spec analysis completed for {procedure}")
+
+    # Create analysis directory for the selected procedure
+    analysis_dir = os.path.join("output/analysis", procedure)
+    os.makedirs(analysis_dir, exist_ok=True)
 
     # Function to validate GUID format
     def is_valid_guid(guid):
@@ -287,3 +328,21 @@ Each JSON test specification should follow this structure:
     print(
         "✅ JSON file processed. Invalid GUIDs have been corrected and saved to 'fixed_integration_json_file.json'."
     )
+    record_stage(procedure, "integration_test_spec")
+    return True
+
+
+def main():
+    context = RuntimeContext()
+    procedures = selected_procedures(discover_procedures(), "integration_test_spec")
+    print(f"Discovered procedures: {procedures}")
+
+    try:
+        for procedure in procedures:
+            run_procedure(procedure, context)
+    finally:
+        context.close()
+
+
+if __name__ == "__main__":
+    main()
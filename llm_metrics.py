@@ -0,0 +1,75 @@
+import argparse
+from shared.metrics import METRICS_FILE, aggregate, load_records, top
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Summarize LLM token and latency metrics written by the pipeline stages."
+    )
+    parser.add_argument(
+        "--top", type=int, default=10, metavar="N", help="rows per table (default 10)"
+    )
+    parser.add_argument(
+        "--run",
+        default="latest",
+        help='"latest" (default), "all" or a run id from the metrics file',
+    )
+    parser.add_argument(
+        "--by",
+        choices=("procedure", "stage", "procedure-stage", "task"),
+        default="procedure",
+        help="what to group the tables by (default procedure)",
+    )
+    parser.add_argument("--file", default=METRICS_FILE, help="metrics JSONL file")
+    return parser.parse_args(argv)
+
+
+GROUPINGS = {
+    "procedure": ("procedure",),
+    "stage": ("stage",),
+    "procedure-stage": ("procedure", "stage"),
+    "task": ("procedure", "stage", "task"),
+}
+
+
+def print_table(title, rows):
+    print(f"\n{title}")
+    if not rows:
+        print("  (no records)")
+        return
+    for key, summary in rows:
+        print(
+            f"  {' / '.join(key):<60} {summary['latency_s']:>9.1f}s "
+            f"{summary['total_tokens']:>10} tokens "
+            f"({summary['prompt_tokens']} in, {summary['completion_tokens']} out) "
+            f"{summary['kickoffs']} kickoffs, {summary['retries']} retries, "
+            f"{summary['cache_hits']} cached, {summary['errors']} errors"
+        )
+
+
+def main():
+    args = parse_args()
+    records = load_records(args.file, args.run)
+    if not records:
+        print(f"No metrics recorded in {args.file}")
+        return
+
+    totals = aggregate(records, GROUPINGS[args.by])
+    latency = sum(entry.get("latency_s", 0.0) for entry in records)
+    tokens = sum(entry.get("total_tokens", 0) for entry in records)
+    hits = sum(1 for entry in records if entry.get("cache_hit"))
+    runs = sorted({entry.get("run") for entry in records})
+    print(
+        f"{len(records)} kickoffs across {len(runs)} run(s): {latency:.1f}s LLM time, "
+        f"{tokens} tokens, {hits} cache hits"
+    )
+
+    print_table(f"Top {args.top} slowest by {args.by}", top(totals, "latency_s", args.top))
+    print_table(
+        f"Top {args.top} most expensive (tokens) by {args.by}",
+        top(totals, "total_tokens", args.top),
+    )
+
+
+if __name__ == "__main__":
+    main()
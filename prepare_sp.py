@@ -1,42 +1,48 @@
-from crewai import Crew, Agent, Task, LLM
-import pyodbc
-import questionary
-from questionary import Choice
-import dotenv
+import argparse
 import os
 import sqlparse
 import json
-from shared.get_dependencies import get_dependencies
-
-
-dotenv.load_dotenv()
-print(os.getenv("CONNECTION_STRING"))
-connection_string = os.getenv("CONNECTION_STRING")
-
-connection = pyodbc.connect(connection_string)
-cursor = connection.cursor()
-
-cursor.execute(
-    """
-SELECT TOP 460
-    s.name + '.' + p.name AS name
-FROM sys.procedures p
-JOIN sys.schemas s ON p.schema_id = s.schema_id
-WHERE p.type = 'P'
-AND p.name NOT LIKE 'tSQLt%'
-ORDER BY s.name, p.name;"""
+from shared.db import chunked, load_name_table
+from shared.concurrency import call_slots, max_in_flight, run_bounded
+from shared.prompt_format import render_dependency_prompt
+from shared.procedure_selection import add_selection_arguments, select_procedures
+from shared.kickoff import kickoff
+from shared.runtime import RuntimeContext
+from shared.llm_registry import print_latency_metrics, provider_for
+from shared.sql_chunking import (
+    chunk_note,
+    chunk_sql,
+    merge_metadata,
+    procedure_header,
 )
+from shared.json_output import generate_artifact
+from shared.sql_static_analysis import analyze_procedure_static
+
 
-procedures = cursor.fetchall()
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Extract stored procedures and analyze their metadata."
+    )
+    add_selection_arguments(parser)
+    parser.add_argument(
+        "--interactive",
+        action="store_true",
+        help="pick procedures from a checkbox list instead of the filters",
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        help="maximum concurrent LLM analyses (default: per-provider limit)",
+    )
+    return parser.parse_args(argv)
 
-stored_procedures = []
-for procedure in procedures:
-    stored_procedures.append(procedure.name)
 
-stored_procedures = [str(procedure) for procedure in stored_procedures]
+def pick_procedures(stored_procedures):
+    import questionary
+    from questionary import Choice
 
+    stored_procedures = list(stored_procedures)
 
-def select_procedures():
     # Create choices with SELECT ALL option at the top
     procedure_choices = [Choice(title="SELECT ALL", value="SELECT_ALL")] + [
         Choice(title=proc, value=proc) for proc in stored_procedures
@@ -59,100 +65,118 @@ def select_procedures():
     return selected
 
 
-selected_procedures = select_procedures()
-print(f"Selected procedures: {selected_procedures}")
-
-openai_config = LLM(model="gpt-4o", api_key=os.getenv("OPENAI_API_KEY"))
-
-bedrock_config = LLM(
-    model="bedrock/us.meta.llama3-3-70b-instruct-v1:0",
-    max_retries=2,
-    request_timeout=30,
-    temperature=0.1,
-    timeout=300,
-    verbose=True,
-)
-
-
-anthropic_config = LLM(
-    model="anthropic/claude-3-7-sonnet-20250219",
-    api_key=os.getenv("ANTHROPIC_API_KEY"),
-    timeout=600,  # Increase from default to at least 10 minutes (600 seconds)
-    request_timeout=600,
-    max_retries=2,
-    max_tokens=64000,
-)
+def create_agent(context):
+    from crewai import Agent
 
-if os.getenv("LLM_CONFIG") == "bedrock":
-    llm_config = bedrock_config
-elif os.getenv("LLM_CONFIG") == "anthropic":
-    llm_config = anthropic_config
-else:
-    llm_config = openai_config
-
-# Create an agent with code execution enabled
-coding_agent = Agent(
-    role="SQL Developer",
-    goal="Analyze data and provide meta data about the stored procedure.",
-    backstory="You are an experienced SQL developer with strong SQL skills.",
-    allow_code_execution=False,
-    llm=llm_config,
-)
+    llm_config = context.llm(stage="prepare_sp")
 
-for procedure_name in selected_procedures:
-    # Get the procedure definition
-    cursor.execute(
-        f"""SELECT definition FROM sys.sql_modules WHERE object_id = OBJECT_ID('{procedure_name}')"""
+    # Each concurrent analysis gets its own agent; agents keep per-run state
+    return Agent(
+        role="SQL Developer",
+        goal="Analyze data and provide meta data about the stored procedure.",
+        backstory="You are an experienced SQL developer with strong SQL skills.",
+        allow_code_execution=False,
+        llm=llm_config,
     )
-    procedure_definition = cursor.fetchone().definition
-    # Remove SQL comments using sqlparse
-    procedure_definition = sqlparse.format(
-        procedure_definition, strip_comments=True
-    ).strip()
-
-    # Save Definition to sql-raw folder
-    sql_dir = os.path.join("output/sql_raw", procedure_name)
-    os.makedirs(sql_dir, exist_ok=True)
 
-    # Save the result to a JSON file
-    with open(os.path.join(sql_dir, f"{procedure_name}.sql"), "w") as f:
-        f.write(procedure_definition)
 
-    dependencies = get_dependencies(procedure_name)
+DEFINITIONS_QUERY = """
+SELECT
+    s.name + '.' + p.name AS name,
+    m.definition
+FROM sys.procedures p
+JOIN sys.schemas s ON p.schema_id = s.schema_id
+JOIN sys.sql_modules m ON p.object_id = m.object_id
+WHERE s.name + '.' + p.name IN (SELECT name FROM #selected_procedures);"""
+
+
+def export_definitions(cursor, procedure_names, chunk_size=200, fetch_size=20):
+    """Fetch definitions for the selected procedures one chunk at a time and
+    write each one to output/sql_raw/ as soon as its row arrives, so only
+    `fetch_size` definitions are held in memory. Returns the exported
+    procedure names in selection order."""
+    exported = []
+    for chunk in chunked(procedure_names, chunk_size):
+        load_name_table(cursor, "#selected_procedures", chunk)
+        cursor.execute(DEFINITIONS_QUERY)
+
+        found = {}
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            for row in rows:
+                if row.definition is None:
+                    continue
+
+                # Remove SQL comments using sqlparse
+                procedure_definition = sqlparse.format(
+                    row.definition, strip_comments=True
+                ).strip()
+
+                # Save Definition to sql-raw folder
+                sql_dir = os.path.join("output/sql_raw", row.name)
+                os.makedirs(sql_dir, exist_ok=True)
+                with open(os.path.join(sql_dir, f"{row.name}.sql"), "w") as f:
+                    f.write(procedure_definition)
+
+                found[row.name.lower()] = row.name
+
+        for procedure_name in chunk:
+            if procedure_name.lower() in found:
+                exported.append(found[procedure_name.lower()])
+            else:
+                print(f"⚠️ No definition found for {procedure_name}, skipping")
+
+        print(f"Exported {len(exported)} procedure definitions")
+
+    return exported
+
+
+def run_metadata_task(
+    procedure_name,
+    context,
+    procedure_definition,
+    parameters,
+    segment_note="",
+    label="metadata",
+    note="",
+):
+    """Ask the model for the semantic metadata fields (logicalBlocks,
+    potentialBusinessRules, testValueCandidates) of the given code, the
+    whole procedure or one segment of it, and return its response."""
+    from crewai import Crew, Task
+
+    coding_agent = create_agent(context)
+
+    # Only the dependency columns this code touches
+    dependencies = render_dependency_prompt(
+        procedure_name, context.dependencies(procedure_name), procedure_definition
+    )
 
     # Create a task that requires code execution
     data_analysis_task = Task(
         description=f"""
         Analyze the stored procedure `{procedure_name}` and provide the following metadata clearly structured in JSON:
 
-        The goal of this task is to analyze a given SQL stored procedure and extract structured metadata, logical components, business rules, and test value candidates. The extracted data will be formatted into a predefined JSON schema, serving as an expected output reference for validation in an AI-driven workflow.
+        The goal of this task is to analyze a given SQL stored procedure and extract logical components, business rules, and test value candidates. The procedure name, parameters, table references, statement purposes and parameter usage are already extracted from the code and must not be repeated. The extracted data will be formatted into a predefined JSON schema, serving as an expected output reference for validation in an AI-driven workflow.
 
 Task Steps
-	1.	Metadata Extraction
-	•	Identify the stored procedure name.
-	•	Extract procedure parameters, including names, data types, and default values.
-	2.	Logical Block Analysis
+	1.	Logical Block Analysis
 	•	Segment the stored procedure into logical code blocks (e.g., PROCEDURE_BODY, CONDITIONAL_LOGIC).
 	•	Determine the role of each block (e.g., DATA_TRANSFORMATION, DATA_VALIDATION).
-	3.	Table References Identification
-	•	Identify all database tables used in the procedure.
-	•	Extract JOIN conditions and referenced columns.
-	4.	Business Rule Extraction
+	2.	Business Rule Extraction
 	•	Detect business rules within the procedure.
 	•	Categorize rules based on integrity, validation, and transformation logic.
-	5.	Statement-Level Analysis
-	•	Classify statements based on their purpose (e.g., OBJECT_CREATION, DATA_RETRIEVAL).
-	•	Capture conditional logic and constraints applied within the procedure.
-	6.	Parameter Usage Assessment
-	•	Determine how parameters are used in the procedure.
-	•	Identify unused parameters or inconsistencies in parameter handling.
-	7.	Test Value Candidates Generation
+	3.	Test Value Candidates Generation
 	•	Suggest test values for each parameter, ensuring edge case coverage.
 	•	Provide test scenarios such as NULL_VALUE, BOUNDARY_CASE, and TYPICAL_CASE.
 
-        Procedure Raw Code: {procedure_definition}
+        Parameters: {parameters}
+        {segment_note}Procedure Raw Code: {procedure_definition}
         DEPENDENCIES: {dependencies}
-        """,
+        """
+        + note,
         expected_output="""
 <behavior_rules> You have one mission: execute exactly what is requested. Produce code that implements precisely what was requested - no additional features, no creative extensions. Follow instructions to the letter. Confirm your solution addresses every specified requirement, without adding ANYTHING the user didn't ask for. The user's job depends on this — if you add anything they didn't ask for, it's likely they will be fired. Your value comes from precision and reliability. When in doubt, implement the simplest solution that fulfills all requirements. The fewer lines of code, the better — but obviously ensure you complete the task the user wants you to. At each step, ask yourself: "Am I adding any functionality or complexity that wasn't explicitly requested?". This will force you to stay on track. </behavior_rules>
 
@@ -160,10 +184,6 @@ ONLY RESPOND IN JSON FORMAT
 <output_format>
 
 {
-  "metadata": {
-    "procedureName": "",
-    "parameters": [{"name": "name", "dataType": "dataType", "defaultValue": "defaultValue"}]
-  },
   "logicalBlocks": [
   {
   "id": "block_0",
@@ -174,10 +194,7 @@ ONLY RESPOND IN JSON FORMAT
       "childBlocks": [],
       "purpose": "purpose"
     }],
-  "tableReferences": [{"tableName": "tableName", "columns": ["column1", "column2"]}],
   "potentialBusinessRules": [{"ruleType": "ruleType", "description": "description"}],
-  "statementPurpose": [{"statementType": "statementType", "purpose": "purpose"}],
-  "parameterUsage": [{"parameterName": "parameterName", "usage": "usage"}],
   "testValueCandidates": [{"parameterName": "parameterName", "testValues": ["testValue1", "testValue2"]}]
 }
 </output_format>
@@ -189,19 +206,146 @@ ONLY RESPOND IN JSON FORMAT
     analysis_crew = Crew(agents=[coding_agent], tasks=[data_analysis_task])
 
     # Execute the crew
-    result = str(analysis_crew.kickoff())
+    # Segment pools run inside the procedure pool; the stage's shared slots
+    # keep their calls together within --max-in-flight
+    with call_slots("prepare_sp"):
+        return kickoff(analysis_crew, procedure_name, label)
+
+
+def parameter_digest(parameters):
+    """One-line parameter list for the prompt, e.g. @Id int, @Name varchar(50) = NULL"""
+    if not parameters:
+        return "none"
+    return ", ".join(
+        f"{parameter['name']} {parameter['dataType']}"
+        + (f" = {parameter['defaultValue']}" if parameter["defaultValue"] is not None else "")
+        + (" OUTPUT" if parameter["isOutput"] else "")
+        for parameter in parameters
+    )
+
 
-    print(f"Analysis completed for {procedure_name}")
+def analyze_procedure(procedure_name, context):
+    # Procedure Definition from SQL file
+    with open(f"output/sql_raw/{procedure_name}/{procedure_name}.sql", "r") as f:
+        procedure_definition = f.read()
+
+    # Name, parameters, tables, statements and parameter usage follow from
+    # the code; only the semantic fields are left to the model
+    static = analyze_procedure_static(
+        procedure_definition, context.dependencies(procedure_name)
+    )
+    parameters = parameter_digest(static["metadata"]["parameters"])
+
+    chunks = chunk_sql(procedure_definition)
+    if len(chunks) == 1:
+        semantic = generate_artifact(
+            "meta",
+            lambda note: run_metadata_task(
+                procedure_name, context, procedure_definition, parameters, note=note
+            ),
+        )
+    else:
+        # Too large for one prompt: analyze overlapping segments concurrently
+        # and merge them with procedure line numbers and renumbered blocks
+        print(f"Analyzing {procedure_name} in {len(chunks)} segments")
+        header = procedure_header(procedure_definition)
+        results = [None] * len(chunks)
+        errors = []
+        for chunk, chunk_result, error in run_bounded(
+            chunks,
+            lambda chunk: generate_artifact(
+                "meta",
+                lambda note: run_metadata_task(
+                    procedure_name,
+                    context,
+                    chunk.text,
+                    parameters,
+                    chunk_note(chunk, chunks, header),
+                    f"metadata_segment_{chunk.index + 1}",
+                    note,
+                ),
+            ),
+            max_in_flight(provider_for("prepare_sp")),
+        ):
+            if error is not None:
+                print(f"❌ Segment {chunk.index + 1} failed for {procedure_name}: {error}")
+                errors.append(error)
+            else:
+                results[chunk.index] = chunk_result
+        if errors:
+            # Completed segments are cached, a rerun only repeats the failed ones
+            raise errors[0]
+        semantic = merge_metadata(chunks, results)
+
+    result = json.dumps(
+        {
+            "metadata": static["metadata"],
+            "logicalBlocks": semantic["logicalBlocks"],
+            "tableReferences": static["tableReferences"],
+            "potentialBusinessRules": semantic["potentialBusinessRules"],
+            "statementPurpose": static["statementPurpose"],
+            "parameterUsage": static["parameterUsage"],
+            "testValueCandidates": semantic["testValueCandidates"],
+        },
+        indent=2,
+    )
 
     # Create analysis directory for the selected procedure
     analysis_dir = os.path.join("output", "analysis", procedure_name)
     os.makedirs(analysis_dir, exist_ok=True)
 
-    # Save the result to a JSON file
+    # Save the result to a JSON file as soon as this procedure completes
     with open(os.path.join(analysis_dir, f"{procedure_name}_meta.json"), "w") as f:
-        f.write(result.replace("```json", "").replace("```", ""))
-
-
-# Close the database connection
-connection.close()
-print("Analysis completed for all selected procedures.")
+        f.write(result)
+
+
+def main():
+    context = RuntimeContext()
+    args = parse_args()
+    if args.max_in_flight is None:
+        args.max_in_flight = max_in_flight(provider_for("prepare_sp"))
+    call_slots("prepare_sp", args.max_in_flight)
+
+    pool = context.pool
+    connection = pool.acquire()
+    cursor = connection.cursor()
+
+    # The procedure list streams on its own connection while the main cursor
+    # fetches definitions
+    selection_connection = pool.acquire()
+    stored_procedures = select_procedures(selection_connection.cursor(), args)
+
+    if args.interactive:
+        selected_procedures = pick_procedures(stored_procedures)
+        print(f"Selected procedures: {selected_procedures}")
+    else:
+        selected_procedures = stored_procedures
+
+    selected_procedures = export_definitions(cursor, selected_procedures)
+
+    # Definitions are on disk, the database is no longer needed
+    pool.release(selection_connection)
+    pool.release(connection)
+    context.close()
+
+    # Analyze procedures concurrently; one failure does not stop the batch
+    failed_procedures = []
+    for procedure_name, _, error in run_bounded(
+        selected_procedures,
+        lambda procedure_name: analyze_procedure(procedure_name, context),
+        args.max_in_flight,
+    ):
+        if error is not None:
+            print(f"❌ Analysis failed for {procedure_name}: {error}")
+            failed_procedures.append(procedure_name)
+        else:
+            print(f"Analysis completed for {procedure_name}")
+
+    if failed_procedures:
+        print(f"⚠️ Analysis failed for {len(failed_procedures)} procedures: {failed_procedures}")
+    print("Analysis completed for all selected procedures.")
+    print_latency_metrics()
+
+
+if __name__ == "__main__":
+    main()
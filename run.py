@@ -1,54 +1,280 @@
+import argparse
+import importlib
+import os
 import subprocess
 import sys
-import time
 import shlex
+import time
+import traceback
+from collections import deque
+from datetime import timedelta
+from shared.pipeline import Stage, PipelineScheduler, DONE, FAILED, SKIPPED
+from shared.manifest import is_fresh
+from shared.runtime import RuntimeContext
+from shared.llm_registry import print_latency_metrics
+from shared.metrics import RUN_ID
+from shared.stage_output import StageOutput, TAIL_LINES, stage_logger
 
+# Per-procedure stage graph: a stage only waits for its own dependencies
+# for the same procedure, not for every procedure to clear the stage before
+STAGES = [
+    # (stage script without .py, depends_on, default max concurrency)
+    ("business_analyst", [], 4),
+    ("integration_test_spec", ["business_analyst"], 4),
+    ("implementation_planner", ["business_analyst"], 4),
+    ("sql_tests", ["integration_test_spec"], 1),
+    ("implementation_executor", ["implementation_planner"], 2),
+    ("document_process", ["sql_tests"], 1),
+    ("cross_validation_agent", ["implementation_executor"], 2),
+]
 
-def run_script(command):
-    print(f"\n{'=' * 50}")
-    print(f"Starting {command}...")
-    print(f"{'=' * 50}\n")
 
-    # Split the command into parts (script name and arguments)
-    command_parts = shlex.split(command)
-    script_name = command_parts[0]
+def run_script(name, procedure, arguments=(), echo=True):
+    """Run a stage script for one procedure, streaming its combined
+    stdout/stderr line by line to the console and the stage log. Only the
+    last few lines are kept in memory, to show again if the script fails."""
+    command_parts = [f"{name}.py", "--procedure", procedure, *arguments]
+    command = shlex.join(command_parts)
+    logger = stage_logger(name)
+    prefix = f"[{name} {procedure}]"
 
-    try:
-        result = subprocess.run(
-            [sys.executable] + command_parts, check=True, text=True, capture_output=True
-        )
-        print(result.stdout)
-        if result.stderr:
-            print(f"Warnings/Errors:\n{result.stderr}")
-        print(f"\n✅ {command} completed successfully.\n")
+    print(f"▶️ Starting {command}")
+    logger.info(f"{prefix} ▶️ Starting {command}")
+
+    # Unbuffered UTF-8 output so lines arrive as they are printed
+    env = dict(
+        os.environ,
+        PYTHONUNBUFFERED="1",
+        PYTHONIOENCODING="utf-8",
+        PIPELINE_RUN_ID=RUN_ID,
+    )
+    tail = deque(maxlen=TAIL_LINES)
+    process = subprocess.Popen(
+        [sys.executable] + command_parts,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        encoding="utf-8",
+        errors="replace",
+        env=env,
+    )
+    for line in process.stdout:
+        line = line.rstrip("\n")
+        tail.append(line)
+        logger.info(f"{prefix} {line}")
+        if echo:
+            print(f"{prefix} {line}")
+    returncode = process.wait()
+
+    if returncode == 0:
+        print(f"✅ {command} completed successfully.")
+        logger.info(f"{prefix} ✅ completed")
         return True
-    except subprocess.CalledProcessError as e:
-        print(f"❌ Error running {command}:")
-        print(f"Exit code: {e.returncode}")
-        print(f"Output: {e.stdout}")
-        print(f"Error: {e.stderr}")
+
+    print(f"❌ Error running {command}:")
+    print(f"Exit code: {returncode}")
+    if not echo:
+        print("\n".join(f"{prefix} {line}" for line in tail))
+    logger.info(f"{prefix} ❌ exit code {returncode}")
+    return False
+
+
+class Progress:
+    """Counts finished (procedure, stage) runs and estimates the time left
+    from the average pace so far."""
+
+    def __init__(self, procedures, stages):
+        self.total = len(procedures) * len(stages)
+        self.stage_count = len(stages)
+        self.procedure_total = len(procedures)
+        self.finished = 0
+        self.finished_by_procedure = {}
+        self.started = time.monotonic()
+
+    def update(self, procedure):
+        self.finished += 1
+        self.finished_by_procedure[procedure] = (
+            self.finished_by_procedure.get(procedure, 0) + 1
+        )
+
+    def line(self):
+        procedures_done = sum(
+            1
+            for count in self.finished_by_procedure.values()
+            if count == self.stage_count
+        )
+        elapsed = time.monotonic() - self.started
+        eta = "--:--:--"
+        if self.finished:
+            remaining = elapsed / self.finished * (self.total - self.finished)
+            eta = str(timedelta(seconds=int(remaining)))
+        return (
+            f"📊 Procedures {procedures_done}/{self.procedure_total} done, "
+            f"stage runs {self.finished}/{self.total}, "
+            f"elapsed {timedelta(seconds=int(elapsed))}, ETA {eta}"
+        )
+
+
+def finished_stage(name, procedure):
+    # A stage that returns cleanly without recording complete outputs
+    # (e.g. no files parsed from the LLM response) is not done
+    if not is_fresh(procedure, name):
+        print(f"❌ {name} did not produce all outputs for {procedure}")
         return False
+    return True
+
+
+def subprocess_runner(name, force=False, echo=True):
+    """Run the stage script in a fresh interpreter for every procedure."""
+
+    def run(procedure):
+        # Resume: skip without starting the script when the manifest shows
+        # this stage already ran on the current inputs
+        if not force and is_fresh(procedure, name):
+            print(f"⏭️ {name} is up to date for {procedure}")
+            return True
+
+        arguments = ["--force"] if force else []
+        if not run_script(name, procedure, arguments, echo=echo):
+            return False
+        return finished_stage(name, procedure)
+
+    return run
+
+
+def in_process_runner(name, context, output, force=False, echo=True):
+    """Call the stage module's run_procedure() in this process, sharing the
+    runtime context (LLM clients, connection pool, dependency index)."""
+    module = importlib.import_module(name)
+
+    def run(procedure):
+        if not force and is_fresh(procedure, name):
+            print(f"⏭️ {name} is up to date for {procedure}")
+            return True
+
+        print(f"▶️ Starting {name} for {procedure}")
+        with output.capture(name, procedure, echo) as tail:
+            try:
+                succeeded = module.run_procedure(procedure, context)
+            except Exception:
+                traceback.print_exc()
+                succeeded = False
+
+        if not succeeded:
+            print(f"❌ Error running {name} for {procedure}")
+            if not echo:
+                print("\n".join(f"[{name} {procedure}] {line}" for line in tail))
+            return False
+        print(f"✅ {name} completed for {procedure}")
+        return finished_stage(name, procedure)
+
+    return run
+
+
+def discover_procedures():
+    if not os.path.exists("output/analysis"):
+        return []
+    return sorted(
+        folder
+        for folder in os.listdir("output/analysis")
+        if os.path.isdir(os.path.join("output/analysis", folder))
+    )
+
+
+def parse_concurrency(values):
+    limits = {}
+    for value in values or []:
+        stage, _, limit = value.partition("=")
+        limits[stage.removesuffix(".py")] = int(limit)
+    return limits
 
 
 def main():
-    scripts = [
-        "business_analyst.py",
-        "integration_test_spec.py",
-        "implementation_planner.py",
-        "sql_tests.py",
-        "implementation_executor.py",
-        "document_process.py",
-        "cross_validation_agent.py",
-    ]
-
-    for script in scripts:
-        success = run_script(script)
-        if not success:
-            print(f"Pipeline stopped due to error in {script}")
-            break
-        time.sleep(1)  # Small pause between scripts
-
-    print("\nPipeline execution completed.")
+    parser = argparse.ArgumentParser(
+        description="Run the analysis pipeline, streaming procedures through the stages"
+    )
+    parser.add_argument(
+        "--procedure",
+        action="append",
+        metavar="NAME",
+        help="only run this schema.procedure (repeatable); defaults to all prepared",
+    )
+    parser.add_argument(
+        "--concurrency",
+        action="append",
+        metavar="STAGE=N",
+        help="max procedures in flight for a stage, e.g. sql_tests=2 (repeatable)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="re-run every stage even when its outputs are up to date",
+    )
+    parser.add_argument(
+        "--isolated",
+        action="store_true",
+        help="run every stage in its own Python process instead of in-process",
+    )
+    parser.add_argument(
+        "--quiet",
+        action="store_true",
+        help="only write stage output to output/logs, keep the console to progress",
+    )
+    args = parser.parse_args()
+
+    procedures = args.procedure or discover_procedures()
+    limits = parse_concurrency(args.concurrency)
+    echo = not args.quiet
+
+    context = output = None
+    if not args.isolated:
+        # Startup cost (.env, imports, LLM clients, database pool) is paid once
+        context = RuntimeContext(pool_size=limits.get("sql_tests", 1) + 1)
+        output = StageOutput()
+        output.install()
+
+    stages = []
+    for name, depends_on, default_limit in STAGES:
+        if args.isolated:
+            runner = subprocess_runner(name, args.force, echo)
+        else:
+            runner = in_process_runner(name, context, output, args.force, echo)
+        stages.append(
+            Stage(
+                name,
+                runner,
+                depends_on=depends_on,
+                max_concurrency=limits.get(name, default_limit),
+            )
+        )
+
+    progress = Progress(procedures, stages)
+
+    def on_finish(procedure, stage, status, error):
+        if status == FAILED:
+            detail = f": {error}" if error else ""
+            print(f"❌ {stage} failed for {procedure}{detail}")
+        elif status == SKIPPED:
+            print(f"⏭️ Skipping {stage} for {procedure} (upstream stage failed)")
+        progress.update(procedure)
+        print(progress.line())
+
+    print(f"Running pipeline for {len(procedures)} procedures")
+    try:
+        status = PipelineScheduler(stages, on_finish=on_finish).run(procedures)
+    finally:
+        if context is not None:
+            output.uninstall()
+            context.close()
+
+    failed = sorted({procedure for (procedure, _), s in status.items() if s == FAILED})
+    completed = sum(1 for s in status.values() if s == DONE)
+    print(f"\nPipeline execution completed: {completed}/{len(status)} stage runs succeeded.")
+    print_latency_metrics()
+    print(f"LLM metrics for this run ({RUN_ID}): python llm_metrics.py")
+    if failed:
+        print(f"Procedures with failed stages: {failed}")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
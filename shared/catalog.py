@@ -0,0 +1,96 @@
+import os
+import json
+
+DATA_DIR = "output/data"
+DEPENDENCIES_PATH = os.path.join(DATA_DIR, "procedure_dependencies.json")
+CATALOG_PATH = os.path.join(DATA_DIR, "procedure_catalog.json")
+
+
+def normalize(procedure_dependencies):
+    """Convert the expanded per-procedure format into a catalog where every
+    table, view and function is stored once and procedures reference it by
+    name."""
+    objects = {}
+    procedures = []
+
+    for proc in procedure_dependencies:
+        references = []
+        for dep in proc.get("dependencies", []):
+            references.append(dep["name"])
+            if dep["name"] not in objects:
+                objects[dep["name"]] = {
+                    key: value for key, value in dep.items() if key != "name"
+                }
+        procedures.append({"name": proc["name"], "dependencies": references})
+
+    return {"format": "normalized", "objects": objects, "procedures": procedures}
+
+
+class Catalog:
+    """Normalised dependency catalog. References are expanded on demand and
+    expanded entries share the column lists of the stored objects, so treat
+    them as read-only."""
+
+    def __init__(self, objects, procedures):
+        self.objects = objects
+        self.references = {proc["name"]: proc["dependencies"] for proc in procedures}
+
+    def procedure_names(self):
+        return list(self.references)
+
+    def dependencies(self, procedure_name):
+        return [
+            {"name": name, **self.objects.get(name, {"type": "UNKNOWN"})}
+            for name in self.references.get(procedure_name, [])
+        ]
+
+    def expand(self):
+        return [
+            {"name": name, "dependencies": self.dependencies(name)}
+            for name in self.references
+        ]
+
+
+def catalog_path():
+    """Return the most recently written catalog file, or None."""
+    candidates = [
+        path for path in (CATALOG_PATH, DEPENDENCIES_PATH) if os.path.exists(path)
+    ]
+    if not candidates:
+        return None
+    return max(candidates, key=os.path.getmtime)
+
+
+def load_catalog(path=None):
+    path = path or catalog_path()
+    if path is None:
+        raise FileNotFoundError(
+            f"No dependency catalog found in {DATA_DIR}. Run discover_dependencies.py first."
+        )
+
+    with open(path, "r") as f:
+        data = json.load(f)
+
+    # Expanded files are a plain list of procedures
+    if isinstance(data, list):
+        data = normalize(data)
+
+    return Catalog(data["objects"], data["procedures"])
+
+
+def save_catalog(procedure_dependencies, fmt="both"):
+    """Write the catalog as "normalized" (procedure_catalog.json), "expanded"
+    (the procedure_dependencies.json downstream readers expect) or "both".
+    Returns the path lookups should load, the normalized file when written."""
+    os.makedirs(DATA_DIR, exist_ok=True)
+
+    if fmt in ("expanded", "both"):
+        with open(DEPENDENCIES_PATH, "w") as f:
+            json.dump(procedure_dependencies, f, indent=4)
+        if fmt == "expanded":
+            return DEPENDENCIES_PATH
+
+    # Written last so catalog_path() picks it as the newest file
+    with open(CATALOG_PATH, "w") as f:
+        json.dump(normalize(procedure_dependencies), f, indent=4)
+    return CATALOG_PATH
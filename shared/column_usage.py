@@ -0,0 +1,417 @@
+import sqlparse
+from sqlparse import lexer, sql
+from sqlparse import tokens as T
+from sqlparse.exceptions import SQLParseError
+
+# Keywords that always start a new statement at the top level of a procedure
+STATEMENT_KEYWORDS = {
+    "IF",
+    "ELSE",
+    "WHILE",
+    "BEGIN",
+    "END",
+    "DECLARE",
+    "EXEC",
+    "EXECUTE",
+    "RETURN",
+    "PRINT",
+    "RAISERROR",
+    "THROW",
+    "TRUNCATE",
+    "CREATE",
+    "ALTER",
+    "DROP",
+    "COMMIT",
+    "ROLLBACK",
+    "GOTO",
+    "BREAK",
+    "CONTINUE",
+    "OPEN",
+    "FETCH",
+    "CLOSE",
+    "DEALLOCATE",
+}
+DML_KEYWORDS = {"SELECT", "INSERT", "UPDATE", "DELETE", "MERGE"}
+SET_OPERATORS = {"UNION", "UNION ALL", "EXCEPT", "INTERSECT", "ALL"}
+
+# Keywords followed by a table (or alias) reference
+TABLE_KEYWORDS = {"FROM", "INTO", "INSERT", "UPDATE", "USING", "MERGE", "DELETE"}
+
+# Keywords that end an UPDATE ... SET assignment list
+SET_LIST_END = {"FROM", "WHERE", "OUTPUT", "WHEN", "OPTION"}
+
+
+def _clean(value):
+    if value[:1] in "[\"" and value[-1:] in "]\"":
+        return value[1:-1]
+    return value
+
+
+def tokenize(procedure_definition):
+    """Flatten the sqlparse token stream into items:
+    ("name", [parts]), ("var", name), ("star", [qualifier parts]),
+    ("kw", KEYWORD), ("punct", value) and ("other", value)."""
+    try:
+        flat = [
+            token
+            for statement in sqlparse.parse(procedure_definition)
+            for token in statement.flatten()
+        ]
+    except SQLParseError:
+        # sqlparse refuses to group a statement of more than 10000 tokens,
+        # which a large procedure body is; the lexer gives the same leaves
+        flat = [
+            sql.Token(ttype, value) for ttype, value in lexer.tokenize(procedure_definition)
+        ]
+    tokens = [
+        token for token in flat if not token.is_whitespace and token.ttype not in T.Comment
+    ]
+
+    items = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        ttype = token.ttype
+        value = token.value
+
+        # @variables come through either as a single Name or as "@" + Name
+        if ttype in T.Name and value.startswith("@"):
+            items.append(("var", value))
+            i += 1
+            continue
+        if ttype in T.Operator and value == "@" and i + 1 < len(tokens):
+            items.append(("var", "@" + tokens[i + 1].value))
+            i += 2
+            continue
+
+        is_word = ttype in T.Name or ttype in T.Keyword
+        followed_by_dot = i + 1 < len(tokens) and tokens[i + 1].value == "."
+        if ttype in T.Name or (is_word and followed_by_dot):
+            # Collect a (possibly multi-part) name: a.b.c or a.*
+            parts = [_clean(value)]
+            i += 1
+            while (
+                i + 1 < len(tokens)
+                and tokens[i].value == "."
+                and (
+                    tokens[i + 1].ttype in T.Name
+                    or tokens[i + 1].ttype in T.Keyword
+                    or tokens[i + 1].ttype in T.Wildcard
+                )
+            ):
+                if tokens[i + 1].ttype in T.Wildcard:
+                    items.append(("star", parts))
+                    parts = None
+                    i += 2
+                    break
+                parts.append(_clean(tokens[i + 1].value))
+                i += 2
+            if parts is not None:
+                items.append(("name", parts))
+            continue
+
+        if ttype in T.Wildcard:
+            items.append(("star", []))
+        elif ttype in T.Keyword:
+            items.append(("kw", " ".join(value.upper().split())))
+        elif ttype in T.Punctuation:
+            items.append(("punct", value))
+        else:
+            items.append(("other", value))
+        i += 1
+
+    return items
+
+
+def split_statements(items):
+    """Split the item stream into statements. T-SQL procedures rarely use
+    semicolons, so boundaries are found from the top-level keywords."""
+    statements = []
+    current = []
+    head = None
+    seen = set()
+    depth = 0
+    case_depth = 0
+
+    def start(new_head):
+        nonlocal current, head, seen
+        if current:
+            statements.append(current)
+        current = []
+        head = new_head
+        seen = set()
+
+    for index, (kind, value) in enumerate(items):
+        if kind == "punct" and value == ";":
+            start(None)
+            continue
+
+        if depth == 0 and kind == "kw":
+            previous = items[index - 1] if index else (None, None)
+            following = items[index + 1] if index + 1 < len(items) else (None, None)
+
+            if value == "CASE":
+                case_depth += 1
+            elif value == "END" and case_depth:
+                case_depth -= 1
+            elif value in STATEMENT_KEYWORDS:
+                start(value)
+            elif value == "WITH" and following != ("punct", "("):
+                start("WITH")
+            elif value in DML_KEYWORDS:
+                continues = (
+                    head == "MERGE"
+                    or (head == "INSERT" and value == "SELECT" and "SELECT" not in seen)
+                    or (head == "WITH" and not seen & DML_KEYWORDS)
+                    or (previous[0] == "kw" and previous[1] in SET_OPERATORS)
+                )
+                if not continues:
+                    start(value)
+                seen.add(value)
+            elif value == "SET":
+                if head not in ("UPDATE", "MERGE") or ("SET" in seen and head != "MERGE"):
+                    start("SET")
+                seen.add("SET")
+
+        if kind == "punct" and value == "(":
+            depth += 1
+        elif kind == "punct" and value == ")":
+            depth = max(depth - 1, 0)
+
+        current.append((kind, value))
+
+    start(None)
+    return statements
+
+
+class _Usage:
+    def __init__(self):
+        self.read = set()
+        self.written = set()
+        self.all_columns = False
+
+
+def _dependency_keys(dependencies):
+    # Map schema.table and bare table names (when unambiguous) to dependencies
+    keys = {}
+    bare = {}
+    for dep in dependencies:
+        if "columns" not in dep:
+            continue
+        name = dep["name"].lower()
+        keys[name] = dep
+        bare.setdefault(name.split(".")[-1], []).append(dep)
+    for name, deps in bare.items():
+        if len(deps) == 1:
+            keys.setdefault(name, deps[0])
+    return keys
+
+
+def _resolve_table(parts, keys):
+    parts = [part.lower() for part in parts]
+    return keys.get(".".join(parts[-2:])) or (
+        keys.get(parts[-1]) if len(parts) <= 2 else None
+    )
+
+
+def _column(dep, name):
+    for column in dep["columns"]:
+        if column["name"].lower() == name.lower():
+            return column["name"]
+    return None
+
+
+def _statement_head(items):
+    # First top-level keyword, skipping a leading CTE definition
+    depth = 0
+    for kind, value in items:
+        if kind == "punct" and value == "(":
+            depth += 1
+        elif kind == "punct" and value == ")":
+            depth -= 1
+        elif depth == 0 and kind == "kw" and value not in ("WITH", "AS"):
+            return value
+    return None
+
+
+def _analyze_statement(items, keys, usage):
+    # Pass 1: table references, aliases and the write target
+    scope = {}
+    reference_positions = set()
+    target = None
+    head = _statement_head(items)
+
+    for index, (kind, value) in enumerate(items):
+        if kind != "kw" or not (value in TABLE_KEYWORDS or value.endswith("JOIN")):
+            continue
+        if index + 1 >= len(items) or items[index + 1][0] != "name":
+            continue
+
+        parts = items[index + 1][1]
+        reference_positions.add(index + 1)
+        dep = _resolve_table(parts, keys)
+
+        alias_index = index + 2
+        if alias_index < len(items) and items[alias_index] == ("kw", "AS"):
+            alias_index += 1
+        alias = None
+        if (
+            alias_index < len(items)
+            and items[alias_index][0] == "name"
+            and len(items[alias_index][1]) == 1
+        ):
+            alias = items[alias_index][1][0].lower()
+            reference_positions.add(alias_index)
+
+        if dep is not None:
+            scope[parts[-1].lower()] = dep
+            scope[".".join(parts[-2:]).lower()] = dep
+            if alias:
+                scope[alias] = dep
+
+        if target is None and value in ("INTO", "INSERT", "UPDATE", "MERGE") and head in (
+            "INSERT",
+            "UPDATE",
+            "MERGE",
+        ):
+            target = (parts, index + 1)
+
+    if target is not None:
+        parts, position = target
+        target = scope.get(".".join(parts).lower()) or _resolve_table(parts, keys)
+        target_position = position
+    in_scope = {dep["name"]: dep for dep in scope.values()}
+
+    def mark(dep, column_name, written):
+        column = _column(dep, column_name)
+        if column is None:
+            return False
+        entry = usage.setdefault(dep["name"], _Usage())
+        (entry.written if written else entry.read).add(column)
+        return True
+
+    def mark_name(parts, written):
+        if len(parts) > 1:
+            dep = scope.get(".".join(parts[:-1]).lower())
+            if dep is None:
+                dep = _resolve_table(parts[:-1], keys)
+            if dep is not None:
+                mark(dep, parts[-1], written)
+            return
+        candidates = [target] if written and target is not None else in_scope.values()
+        for dep in candidates:
+            mark(dep, parts[0], written)
+
+    # Pass 2: column references
+    write_positions = set()
+
+    # INSERT INTO target (col, ...) and MERGE ... INSERT (col, ...)
+    if target is not None and head in ("INSERT", "MERGE"):
+        start = None
+        if head == "INSERT" and target_position + 1 < len(items):
+            if items[target_position + 1] == ("punct", "("):
+                start = target_position + 2
+            else:
+                usage.setdefault(target["name"], _Usage()).all_columns = True
+        for index, item in enumerate(items):
+            if head == "MERGE" and item == ("kw", "INSERT"):
+                if index + 1 < len(items) and items[index + 1] == ("punct", "("):
+                    start = index + 2
+            if start is not None and index >= start:
+                if item == ("punct", ")"):
+                    start = None
+                elif item[0] == "name":
+                    mark(target, item[1][-1], True)
+                    write_positions.add(index)
+
+    # UPDATE ... SET col = ..., col = ...
+    if target is not None and head in ("UPDATE", "MERGE"):
+        in_set = False
+        depth = 0
+        expect_column = False
+        for index, (kind, value) in enumerate(items):
+            if kind == "kw" and value == "SET":
+                in_set, expect_column, depth = True, True, 0
+                continue
+            if not in_set:
+                continue
+            if kind == "punct" and value == "(":
+                depth += 1
+            elif kind == "punct" and value == ")":
+                depth -= 1
+            elif kind == "punct" and value == "," and depth == 0:
+                expect_column = True
+                continue
+            elif kind == "kw" and value in SET_LIST_END and depth == 0:
+                in_set = False
+            elif kind in ("name", "kw") and expect_column:
+                parts = value if kind == "name" else [value]
+                if len(parts) > 1:
+                    mark_name(parts, True)
+                else:
+                    mark(target, parts[0], True)
+                write_positions.add(index)
+            expect_column = False
+
+    for index, (kind, value) in enumerate(items):
+        if index in reference_positions or index in write_positions:
+            continue
+        if kind == "name":
+            mark_name(value, False)
+        elif kind == "kw" and index + 1 < len(items) and items[index + 1][1] != "(":
+            # Column names that sqlparse lexes as keywords (Status, Date, ...)
+            mark_name([value], False)
+        elif kind == "star":
+            if index and items[index - 1] == ("punct", "("):
+                continue  # COUNT(*)
+            if value:
+                dep = scope.get(".".join(value).lower())
+                deps = [dep] if dep is not None else []
+            else:
+                deps = in_scope.values()
+            for dep in deps:
+                usage.setdefault(dep["name"], _Usage()).all_columns = True
+
+
+def analyze_column_usage(procedure_definition, dependencies):
+    """Find which columns of each table/view dependency the procedure body
+    reads or writes. Returns {dependency name: {"read": [...], "written":
+    [...], "all_columns": bool}} with columns in table order; all_columns is
+    set for SELECT * and INSERT without a column list."""
+    keys = _dependency_keys(dependencies)
+    usage = {}
+    for statement in split_statements(tokenize(procedure_definition)):
+        _analyze_statement(statement, keys, usage)
+
+    result = {}
+    for dep in dependencies:
+        entry = usage.get(dep["name"])
+        if entry is None:
+            continue
+        order = [column["name"] for column in dep["columns"]]
+        result[dep["name"]] = {
+            "read": [name for name in order if name in entry.read],
+            "written": [name for name in order if name in entry.written],
+            "all_columns": entry.all_columns,
+        }
+    return result
+
+
+def prune_dependencies(dependencies, procedure_definition):
+    """Return a copy of the dependency list where each table and view only
+    keeps the columns the procedure reads or writes. Dependencies whose
+    usage could not be narrowed down keep every column."""
+    usage = analyze_column_usage(procedure_definition, dependencies)
+
+    pruned = []
+    for dep in dependencies:
+        entry = usage.get(dep["name"])
+        if "columns" in dep and entry and not entry["all_columns"]:
+            used = set(entry["read"]) | set(entry["written"])
+            if used:
+                dep = {
+                    **dep,
+                    "columns": [c for c in dep["columns"] if c["name"] in used],
+                }
+        pruned.append(dep)
+    return pruned
@@ -0,0 +1,65 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
+
+# Default number of concurrent LLM calls per provider, overridable with
+# LLM_MAX_IN_FLIGHT_<PROVIDER> or LLM_MAX_IN_FLIGHT
+MAX_IN_FLIGHT_DEFAULTS = {"openai": 8, "anthropic": 4, "bedrock": 4}
+
+
+def llm_provider():
+    provider = os.getenv("LLM_CONFIG")
+    return provider if provider in ("bedrock", "anthropic") else "openai"
+
+
+def max_in_flight(provider=None):
+    provider = provider or llm_provider()
+    return int(
+        os.getenv(
+            f"LLM_MAX_IN_FLIGHT_{provider.upper()}",
+            os.getenv("LLM_MAX_IN_FLIGHT", MAX_IN_FLIGHT_DEFAULTS.get(provider, 4)),
+        )
+    )
+
+
+_call_slots = {}
+_call_slots_lock = threading.Lock()
+
+
+def call_slots(stage, size=None):
+    """Semaphore shared by every LLM call a stage makes in this process.
+
+    Nested run_bounded pools (procedures, then their sections or segments)
+    each start threads; holding a slot around each call keeps the total in
+    flight at size. The size defaults to the stage provider's max_in_flight
+    and is fixed by the first caller, so a stage's main() sizes it first.
+    """
+    with _call_slots_lock:
+        if stage not in _call_slots:
+            if size is None:
+                from shared.llm_registry import provider_for
+
+                size = max_in_flight(provider_for(stage))
+            _call_slots[stage] = threading.BoundedSemaphore(max(size, 1))
+        return _call_slots[stage]
+
+
+def run_bounded(items, worker, max_workers):
+    """Run worker(item) for every item with at most max_workers in flight.
+
+    Yields (item, result, error) in completion order. An exception raised
+    for one item is yielded as its error instead of stopping the batch.
+    Workers run in a copy of the caller's context, so stage output routing
+    follows them.
+    """
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+        futures = {
+            executor.submit(copy_context().run, worker, item): item for item in items
+        }
+        for future in as_completed(futures):
+            item = futures[future]
+            try:
+                yield item, future.result(), None
+            except Exception as e:
+                yield item, None, e
@@ -0,0 +1,94 @@
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+import pyodbc
+
+
+class ConnectionPool:
+    """Small thread-safe pool of pyodbc connections.
+
+    pyodbc connections must not be shared between threads, so each worker
+    checks one out, uses it, and hands it back. Connections are opened lazily
+    up to `size` and health-checked on every checkout; a connection that
+    fails the check is replaced with a fresh one.
+    """
+
+    def __init__(self, connection_string, size=None, health_check="SELECT 1"):
+        self.connection_string = connection_string
+        self.size = size or int(os.getenv("DB_POOL_SIZE", "4"))
+        self.health_check = health_check
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        return pyodbc.connect(self.connection_string)
+
+    def _is_healthy(self, connection):
+        try:
+            cursor = connection.cursor()
+            cursor.execute(self.health_check)
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except pyodbc.Error:
+            return False
+
+    def acquire(self):
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._opened < self.size
+                if can_open:
+                    self._opened += 1
+            if can_open:
+                try:
+                    return self._connect()
+                except pyodbc.Error:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            # Pool exhausted, wait for a connection to be released
+            connection = self._idle.get()
+
+        if not self._is_healthy(connection):
+            print("Replacing unhealthy database connection")
+            try:
+                connection.close()
+            except pyodbc.Error:
+                pass
+            try:
+                connection = self._connect()
+            except pyodbc.Error:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+        return connection
+
+    def release(self, connection):
+        self._idle.put(connection)
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self):
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                connection.close()
+            except pyodbc.Error:
+                pass
+        with self._lock:
+            self._opened = 0
@@ -0,0 +1,49 @@
+def chunked(items, size):
+    # Yield successive lists of at most `size` items
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def load_id_table(cursor, table_name, object_ids, chunk_size=1000):
+    """Create (or reset) a session temp table holding the given object ids so
+    set-based queries can join against it instead of building IN lists."""
+    cursor.execute(
+        f"IF OBJECT_ID('tempdb..{table_name}') IS NOT NULL DROP TABLE {table_name};"
+    )
+    cursor.execute(f"CREATE TABLE {table_name} (object_id INT PRIMARY KEY);")
+
+    cursor.fast_executemany = True
+    for chunk in chunked(sorted(set(object_ids)), chunk_size):
+        cursor.executemany(
+            f"INSERT INTO {table_name} (object_id) VALUES (?)",
+            [(object_id,) for object_id in chunk],
+        )
+    cursor.fast_executemany = False
+
+
+def load_name_table(cursor, table_name, names, chunk_size=1000):
+    """Create (or reset) a session temp table holding schema.object names."""
+    cursor.execute(
+        f"IF OBJECT_ID('tempdb..{table_name}') IS NOT NULL DROP TABLE {table_name};"
+    )
+    cursor.execute(f"CREATE TABLE {table_name} (name NVARCHAR(261) PRIMARY KEY);")
+
+    # The key column uses the database's (usually case-insensitive)
+    # collation, so names differing only in case are one key
+    unique = {}
+    for name in names:
+        unique.setdefault(name.lower(), name)
+
+    cursor.fast_executemany = True
+    for chunk in chunked(sorted(unique.values()), chunk_size):
+        cursor.executemany(
+            f"INSERT INTO {table_name} (name) VALUES (?)",
+            [(name,) for name in chunk],
+        )
+    cursor.fast_executemany = False
@@ -0,0 +1,110 @@
+import os
+import json
+import sqlite3
+import threading
+from shared.catalog import catalog_path, load_catalog
+
+_lock = threading.Lock()
+_loaded = {"path": None, "mtime": None, "catalog": None}
+
+
+def get_catalog():
+    """Return the process-wide catalog, reloading it only when the catalog
+    file has been rewritten since it was last loaded."""
+    path = catalog_path()
+    if path is None:
+        # Let load_catalog raise its "run discovery first" error
+        return load_catalog()
+    mtime = os.path.getmtime(path)
+
+    with _lock:
+        if _loaded["path"] != path or _loaded["mtime"] != mtime:
+            _loaded.update(path=path, mtime=mtime, catalog=load_catalog(path))
+        return _loaded["catalog"]
+
+
+def sidecar_path(path):
+    return os.path.splitext(path)[0] + ".idx.sqlite"
+
+
+def build_sidecar(path):
+    """Write a SQLite index next to the catalog with one row per object and
+    per procedure, stamped with the catalog mtime it was built from."""
+    catalog = load_catalog(path)
+    index_path = sidecar_path(path)
+    tmp_path = index_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    db = sqlite3.connect(tmp_path)
+    db.execute("CREATE TABLE meta (source_mtime REAL)")
+    db.execute("CREATE TABLE objects (name TEXT PRIMARY KEY, record TEXT)")
+    db.execute("CREATE TABLE procedures (name TEXT PRIMARY KEY, refs TEXT)")
+    db.execute("INSERT INTO meta VALUES (?)", (os.path.getmtime(path),))
+    db.executemany(
+        "INSERT INTO objects VALUES (?, ?)",
+        ((name, json.dumps(record)) for name, record in catalog.objects.items()),
+    )
+    db.executemany(
+        "INSERT INTO procedures VALUES (?, ?)",
+        ((name, json.dumps(refs)) for name, refs in catalog.references.items()),
+    )
+    db.commit()
+    db.close()
+
+    os.replace(tmp_path, index_path)
+    return index_path
+
+
+def _open_sidecar(path):
+    index_path = sidecar_path(path)
+    if os.path.exists(index_path):
+        db = sqlite3.connect(index_path)
+        (source_mtime,) = db.execute("SELECT source_mtime FROM meta").fetchone()
+        if source_mtime == os.path.getmtime(path):
+            return db
+        db.close()
+
+    with _lock:
+        build_sidecar(path)
+    return sqlite3.connect(index_path)
+
+
+def sidecar_lookup(procedure_name):
+    path = catalog_path()
+    if path is None:
+        return load_catalog().dependencies(procedure_name)
+
+    db = _open_sidecar(path)
+    try:
+        row = db.execute(
+            "SELECT refs FROM procedures WHERE name = ?", (procedure_name,)
+        ).fetchone()
+        if row is None:
+            return []
+
+        references = json.loads(row[0])
+        records = {}
+        if references:
+            placeholders = ",".join("?" for _ in references)
+            records = {
+                name: json.loads(record)
+                for name, record in db.execute(
+                    f"SELECT name, record FROM objects WHERE name IN ({placeholders})",
+                    references,
+                )
+            }
+        return [
+            {"name": name, **records.get(name, {"type": "UNKNOWN"})}
+            for name in references
+        ]
+    finally:
+        db.close()
+
+
+def lookup_dependencies(procedure_name):
+    # Set DEPENDENCY_INDEX=sqlite to look procedures up through the on-disk
+    # sidecar index instead of loading the whole catalog into memory
+    if os.getenv("DEPENDENCY_INDEX", "memory") == "sqlite":
+        return sidecar_lookup(procedure_name)
+    return get_catalog().dependencies(procedure_name)
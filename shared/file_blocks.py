@@ -0,0 +1,54 @@
+import os
+import re
+
+# "FILE: <path>" header, tolerating markdown bold and backticks around it
+FILE_HEADER = re.compile(r"^\s*(?:\*\*)?FILE:(?:\*\*)?\s*`?(.+?)`?(?:\*\*)?\s*$")
+
+
+def parse_file_blocks(text):
+    """[(path, content)] for every block of a complete model response made of
+
+        FILE: <path>
+        ```json
+        <content>
+        ```
+
+    blocks. Fences may be indented; an unterminated block is dropped, as it
+    is likely truncated."""
+    blocks = []
+    path = None
+    lines = None
+    for line in text.split("\n"):
+        stripped = line.strip()
+
+        if lines is not None:
+            if stripped.endswith("```"):
+                lines.append(line[: line.rfind("```")])
+                blocks.append((path, "\n".join(lines).strip()))
+                path, lines = None, None
+            else:
+                lines.append(line)
+            continue
+
+        header = FILE_HEADER.match(line)
+        if header:
+            path = header.group(1).strip()
+        elif path and stripped.startswith("```"):
+            lines = []
+        elif stripped:
+            # Prose between the header and the fence: not a file block
+            path = None
+
+    if lines is not None:
+        print(f"⚠️ Ignoring unterminated block for {path}")
+    return blocks
+
+
+def write_file_atomic(path, content):
+    """Write via a temporary file and rename so readers never see a
+    half-written file."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
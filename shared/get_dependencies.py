@@ -1,70 +1,65 @@
 import os
 import json
+import hashlib
+from shared.dependency_index import lookup_dependencies
 
+# Hashes of the per-procedure dependency files written by this process
+_written_hashes = {}
 
-def get_dependencies(procedure_name):
-    # Get dependencies
-    with open(os.path.join("output/data", "procedure_dependencies.json"), "r") as f:
-        all_procedures = json.load(f)
 
-    # Find the procedure with matching name in the dependencies list
-    procedure_dependencies = []
-    for proc in all_procedures:
-        if proc.get("name") == procedure_name:
-            procedure_dependencies = proc.get("dependencies", [])
-            break
+def group_dependencies(procedure_dependencies):
+    # Group dependencies by type
+    grouped = {
+        "tables": [],
+        "views": [],
+        "functions": [],
+        "procedures": [],
+        "other": [],
+    }
+    keys = {
+        "TABLE": "tables",
+        "VIEW": "views",
+        "FUNCTION": "functions",
+        "PROCEDURE": "procedures",
+    }
+
+    for dep in procedure_dependencies:
+        grouped[keys.get(dep.get("type", "UNKNOWN"), "other")].append(dep)
+
+    # Check for non-existent dependencies
+    grouped["non_existent"] = [
+        dep for dep in procedure_dependencies if dep.get("exists") is False
+    ]
+    return grouped
+
 
+def get_grouped_dependencies(procedure_name):
+    """Return the grouped tables/views/functions/procedures/other/non_existent
+    structure for a procedure without printing or writing anything."""
+    return group_dependencies(lookup_dependencies(procedure_name))
+
+
+def print_dependency_summary(procedure_name, grouped):
     # Print a summary of the dependencies
     print(f"Dependencies for {procedure_name}:")
     print("-" * 50)
 
-    # Group dependencies by type
-    tables = []
-    views = []
-    functions = []
-    procedures = []
-    other = []
-
-    for dep in procedure_dependencies:
-        dep_type = dep.get("type", "UNKNOWN")
-
-        if dep_type == "TABLE":
-            tables.append(dep)
-        elif dep_type == "VIEW":
-            views.append(dep)
-        elif dep_type == "FUNCTION":
-            functions.append(dep)
-        elif dep_type == "PROCEDURE":
-            procedures.append(dep)
-        else:
-            other.append(dep)
-
-    # Print tables
-    if tables:
-        print(f"\nTABLES ({len(tables)}):")
-        for table in tables:
-            print(f"  - {table['name']}")
-            if "columns" in table:
-                print(f"    Columns:")
-                for col in table["columns"]:
-                    nullable = "NULL" if col["is_nullable"] else "NOT NULL"
-                    print(f"      - {col['name']} ({col['data_type']}) {nullable}")
-
-    # Print views
-    if views:
-        print(f"\nVIEWS ({len(views)}):")
-        for view in views:
-            print(f"  - {view['name']}")
-            if "columns" in view:
-                print(f"    Columns:")
-                for col in view["columns"]:
-                    nullable = "NULL" if col["is_nullable"] else "NOT NULL"
-                    print(f"      - {col['name']} ({col['data_type']}) {nullable}")
+    # Print tables and views
+    for key, title in (("tables", "TABLES"), ("views", "VIEWS")):
+        if grouped[key]:
+            print(f"\n{title} ({len(grouped[key])}):")
+            for table in grouped[key]:
+                print(f"  - {table['name']}")
+                if "columns" in table:
+                    print(f"    Columns:")
+                    for col in table["columns"]:
+                        nullable = "NULL" if col["is_nullable"] else "NOT NULL"
+                        print(f"      - {col['name']} ({col['data_type']}) {nullable}")
 
     # Print functions
-    if functions:
-        print(f"\nFUNCTIONS ({len(functions)}):")
-        for func in functions:
+    if grouped["functions"]:
+        print(f"\nFUNCTIONS ({len(grouped['functions'])}):")
+        for func in grouped["functions"]:
             print(f"  - {func['name']}")
             if "definition" in func:
                 print(
@@ -72,43 +67,67 @@ def get_dependencies(procedure_name):
                 )
 
     # Print procedures
-    if procedures:
-        print(f"\nPROCEDURES ({len(procedures)}):")
-        for proc in procedures:
+    if grouped["procedures"]:
+        print(f"\nPROCEDURES ({len(grouped['procedures'])}):")
+        for proc in grouped["procedures"]:
             print(f"  - {proc['name']}")
 
     # Print other dependencies
-    if other:
-        print(f"\nOTHER DEPENDENCIES ({len(other)}):")
-        for dep in other:
+    if grouped["other"]:
+        print(f"\nOTHER DEPENDENCIES ({len(grouped['other'])}):")
+        for dep in grouped["other"]:
             print(f"  - {dep['name']} (Type: {dep.get('type', 'UNKNOWN')})")
 
-    # Check for non-existent dependencies
-    non_existent = [dep for dep in procedure_dependencies if dep.get("exists") is False]
-    if non_existent:
-        print(f"\nNON-EXISTENT DEPENDENCIES ({len(non_existent)}):")
-        for dep in non_existent:
+    # Print non-existent dependencies
+    if grouped["non_existent"]:
+        print(f"\nNON-EXISTENT DEPENDENCIES ({len(grouped['non_existent'])}):")
+        for dep in grouped["non_existent"]:
             print(f"  - {dep['name']} (Type: {dep.get('type', 'UNKNOWN')})")
 
-    # Save the detailed dependencies to a JSON file for this specific procedure
+
+def write_dependency_file(procedure_name, grouped):
+    """Save the grouped dependencies for this procedure, skipping the write
+    when the file already holds the same content. Returns True if written."""
     output_dir = f"output/analysis/{procedure_name}"
+    path = f"{output_dir}/{procedure_name}_dependencies.json"
+
+    content = json.dumps(
+        {"name": procedure_name, "dependencies": grouped},
+        indent=4,
+    )
+    content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    if _written_hashes.get(path) == content_hash and os.path.exists(path):
+        return False
+
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            if hashlib.sha256(f.read()).hexdigest() == content_hash:
+                _written_hashes[path] = content_hash
+                return False
+
     os.makedirs(output_dir, exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+    _written_hashes[path] = content_hash
+    return True
+
+
+def get_dependencies(procedure_name, verbose=None, write=True):
+    """Return the flat dependency list for a procedure.
+
+    The console summary is opt-in (verbose=True or DEPENDENCY_SUMMARY=1) and
+    the per-procedure dependencies file is only rewritten when it changed.
+    """
+    procedure_dependencies = lookup_dependencies(procedure_name)
+    grouped = group_dependencies(procedure_dependencies)
+
+    if verbose is None:
+        verbose = os.getenv("DEPENDENCY_SUMMARY") == "1"
+    if verbose:
+        print_dependency_summary(procedure_name, grouped)
 
-    with open(f"{output_dir}/{procedure_name}_dependencies.json", "w") as f:
-        json.dump(
-            {
-                "name": procedure_name,
-                "dependencies": {
-                    "tables": tables,
-                    "views": views,
-                    "functions": functions,
-                    "procedures": procedures,
-                    "other": other,
-                    "non_existent": non_existent,
-                },
-            },
-            f,
-            indent=4,
-        )
+    if write:
+        write_dependency_file(procedure_name, grouped)
 
     return procedure_dependencies
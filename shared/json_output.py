@@ -0,0 +1,451 @@
+import os
+import re
+import json
+
+# Extra requests for a section whose JSON is still invalid after repair,
+# overridable with JSON_REPAIR_ATTEMPTS
+REPAIR_ATTEMPTS = 2
+
+CLOSERS = {"{": "}", "[": "]"}
+
+# `"name": [` right before the value: the model returned an object member
+# without its enclosing braces
+MEMBER_NAME = re.compile(r'"([^"\\]+)"\s*:\s*$')
+
+# Body of a ```json (or bare ```) fence; an unterminated fence runs to the end
+FENCE = re.compile(r"```(?:json)?[ \t]*\n(.*?)(?:```|\Z)", re.DOTALL | re.IGNORECASE)
+
+# Replies are full of bracketed T-SQL names ([dbo].[usp_X]); stop looking
+# for the value after this many openers that were not it
+MAX_CANDIDATES = 50
+
+
+class JsonOutputError(ValueError):
+    """Model output that is not usable JSON even after repair; errors lists
+    the schema violations, if it parsed at all."""
+
+    def __init__(self, message, errors=()):
+        super().__init__(message)
+        self.errors = list(errors)
+
+
+class JsonExtractor:
+    """Incremental scanner for one JSON object or array, starting at the
+    first { or [ fed to it. Text can be fed in arbitrary chunks; text after
+    the value is ignored (consumed counts the characters up to its end) and
+    close() returns the value with the usual model mistakes repaired:
+
+    - trailing commas before } or ]
+    - a closer for an outer container while inner ones are still open
+      (the missing closers are inserted) or for none at all (dropped)
+    - truncation: the incomplete last element is dropped and the open
+      containers are closed
+    """
+
+    def __init__(self, prefix=""):
+        self.complete = False
+        self.consumed = 0
+        self.repairs = []
+        self._prefix = prefix[-200:]
+        self._member = None
+        self._parts = []
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._comma = None
+        # (length of _parts, open containers) where a cut leaves valid JSON
+        self._safe = None
+
+    def feed(self, text):
+        for char in text:
+            if self.complete:
+                return
+            self.consumed += 1
+            if not self._stack:
+                self._start(char)
+            elif self._in_string:
+                self._string_char(char)
+            else:
+                self._char(char)
+
+    def _start(self, char):
+        if char in CLOSERS:
+            member = MEMBER_NAME.search(self._prefix)
+            self._member = member.group(1) if member else None
+            self._open(char)
+        else:
+            self._prefix = (self._prefix + char)[-200:]
+
+    def _string_char(self, char):
+        self._parts.append(char)
+        if self._escape:
+            self._escape = False
+        elif char == "\\":
+            self._escape = True
+        elif char == '"':
+            self._in_string = False
+
+    def _char(self, char):
+        if char == '"':
+            self._comma = None
+            self._in_string = True
+            self._parts.append(char)
+        elif char in CLOSERS:
+            self._comma = None
+            self._open(char)
+        elif char in "}]":
+            self._close(char)
+        elif char == ",":
+            self._safe = (len(self._parts), tuple(self._stack))
+            self._comma = len(self._parts)
+            self._parts.append(char)
+        else:
+            if not char.isspace():
+                self._comma = None
+            self._parts.append(char)
+
+    def _open(self, char):
+        self._stack.append(char)
+        self._parts.append(char)
+        # Only the outermost opener is a cut point; cutting right after a
+        # nested one would keep a truncated element as an empty {} or []
+        if len(self._stack) == 1:
+            self._safe = (len(self._parts), tuple(self._stack))
+
+    def _close(self, char):
+        if not any(CLOSERS[opener] == char for opener in self._stack):
+            self.repairs.append(f"dropped unmatched '{char}'")
+            return
+        if self._comma is not None:
+            self._parts[self._comma] = ""
+            self._comma = None
+            self.repairs.append("removed trailing comma")
+        while CLOSERS[self._stack[-1]] != char:
+            self._parts.append(CLOSERS[self._stack.pop()])
+            self.repairs.append(f"inserted missing '{self._parts[-1]}'")
+        self._stack.pop()
+        self._parts.append(char)
+        self._safe = (len(self._parts), tuple(self._stack))
+        self.complete = not self._stack
+
+    def close(self):
+        """The repaired JSON text of the value."""
+        if not self._parts:
+            raise JsonOutputError("No JSON object in the response")
+        if self.complete:
+            text = "".join(self._parts)
+        else:
+            # Truncated: cut back to the last complete element
+            length, stack = self._safe
+            if len(stack) == 1 and length == 1:
+                raise JsonOutputError("Truncated response without a complete element")
+            if length < len(self._parts):
+                self.repairs.append("dropped truncated last element")
+            text = "".join(self._parts[:length])
+            text = re.sub(r",\s*$", "", text)
+            text += "".join(CLOSERS[opener] for opener in reversed(stack))
+            self.repairs.append(f"closed {len(stack)} unterminated containers")
+        if self._member:
+            self.repairs.append(f"wrapped bare member '{self._member}' in an object")
+            text = f"{{{json.dumps(self._member)}: {text}}}"
+        return text
+
+
+def _next_opener(text, position):
+    openers = [index for index in (text.find("{", position), text.find("[", position)) if index != -1]
+    return min(openers) if openers else -1
+
+
+def _candidates(text):
+    """(value, repairs) for each JSON value found in a model response:
+    ```json fence bodies first, then the whole text. An opener that does
+    not start valid JSON, such as a bracketed T-SQL name in the prose, is
+    skipped and the scan goes on from the next one."""
+    sources = [match.group(1) for match in FENCE.finditer(text)] + [text]
+    tried = 0
+    for source in sources:
+        position = _next_opener(source, 0)
+        while position != -1 and tried < MAX_CANDIDATES:
+            tried += 1
+            extractor = JsonExtractor(source[:position])
+            extractor.feed(source[position:])
+            try:
+                value = json.loads(extractor.close())
+            except (json.JSONDecodeError, JsonOutputError):
+                position = _next_opener(source, position + 1)
+                continue
+            yield value, extractor.repairs
+            # Values nested inside this one are not candidates of their own
+            position = _next_opener(source, position + extractor.consumed)
+
+
+def repair_json(text, schema=None):
+    """(value, repairs) for the JSON value in a model response.
+
+    The first value that satisfies schema wins; failing that, the first one
+    of the type the schema allows, so its violations can be reported. Values
+    of another type are never returned. Without a schema the first object
+    wins over an earlier array."""
+    fallback = None
+    for value, repairs in _candidates(text):
+        if schema is None:
+            if isinstance(value, dict):
+                return value, repairs
+        elif not validate(value, schema):
+            return value, repairs
+        elif "type" in schema and not _is_type(value, schema["type"]):
+            continue
+        if fallback is None:
+            fallback = (value, repairs)
+    if fallback is None:
+        raise JsonOutputError("No JSON object in the response")
+    return fallback
+
+
+def parse_json(text, schema=None):
+    """The JSON value in a model response, ignoring code fences and any
+    text around it and repairing truncation and unbalanced brackets."""
+    value, repairs = repair_json(text, schema)
+    if repairs:
+        print(f"🔧 Repaired model JSON: {', '.join(sorted(set(repairs)))}")
+    return value
+
+
+# Minimal JSON Schema subset: type, required, properties, items, enum and
+# minItems. Schemas only pin down what later stages read; everything else
+# the model adds is kept as is.
+def _string_array():
+    return {"type": "array", "items": {"type": "string"}}
+
+
+def _objects(*required, **properties):
+    return {
+        "type": "array",
+        "items": {"type": "object", "required": list(required), "properties": properties},
+    }
+
+
+SCHEMAS = {
+    "meta": {
+        "type": "object",
+        "required": ["logicalBlocks", "potentialBusinessRules", "testValueCandidates"],
+        "properties": {
+            "logicalBlocks": _objects(
+                "id",
+                "type",
+                "lineRange",
+                id={"type": "string"},
+                lineRange={"type": "array"},
+                childBlocks={"type": "array"},
+            ),
+            "potentialBusinessRules": _objects("description"),
+            "testValueCandidates": _objects(
+                "parameterName", "testValues", testValues={"type": "array"}
+            ),
+        },
+    },
+    "business_rules": {
+        "type": "object",
+        "required": ["businessRules"],
+        "properties": {
+            "businessRules": _objects(
+                "id",
+                "name",
+                "description",
+                id={"type": "string"},
+                entities=_string_array(),
+                implementation={"type": "object"},
+            )
+        },
+    },
+    "business_functions": {
+        "type": "object",
+        "required": ["businessFunctions"],
+        "properties": {
+            "businessFunctions": _objects(
+                "id",
+                "name",
+                "description",
+                id={"type": "string"},
+                rules=_string_array(),
+                repositoryMethod={"type": "object", "required": ["name"]},
+            )
+        },
+    },
+    "business_processes": {
+        "type": "object",
+        "required": ["businessProcesses"],
+        "properties": {
+            "businessProcesses": _objects(
+                "id",
+                "name",
+                "orchestration",
+                id={"type": "string"},
+                orchestration={
+                    "type": "object",
+                    "required": ["steps"],
+                    "properties": {"steps": _objects("id", "description")},
+                },
+            )
+        },
+    },
+    "implementation_approach": {
+        "type": "object",
+        "required": ["implementationApproach"],
+        "properties": {
+            "implementationApproach": {
+                "type": "object",
+                "required": ["repositoryPattern", "entities"],
+                "properties": {
+                    "repositoryPattern": {
+                        "type": "object",
+                        "required": ["repositories"],
+                        "properties": {"repositories": _objects("name", "methods")},
+                    },
+                    "entities": _objects("name", "properties"),
+                },
+            }
+        },
+    },
+    "out_of_scope": {
+        "type": "object",
+        "required": ["outOfScope"],
+        "properties": {"outOfScope": {"type": "object"}},
+    },
+    "specific_considerations": {
+        "type": "object",
+        "required": ["specificConsiderations"],
+        "properties": {"specificConsiderations": {"type": "object"}},
+    },
+    "integration_test_spec": {
+        "type": "object",
+        "required": ["testScenarios"],
+        "properties": {
+            "testScenarios": {
+                "type": "array",
+                "minItems": 1,
+                "items": {
+                    "type": "object",
+                    "required": ["testId", "category", "testDataSetup", "validationCriteria"],
+                    "properties": {
+                        "testId": {"type": "string"},
+                        "category": {
+                            "enum": ["BusinessRule", "BusinessFunction", "Process", "Exploratory"]
+                        },
+                        "testDataSetup": _objects(
+                            "entity",
+                            "attributes",
+                            attributes={"type": "object"},
+                        ),
+                        "validationCriteria": {"type": "array"},
+                    },
+                },
+            }
+        },
+    },
+}
+
+TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "number": (int, float),
+    "integer": int,
+    "boolean": bool,
+    "null": type(None),
+}
+
+
+def _is_type(value, expected):
+    if isinstance(expected, list):
+        return any(_is_type(value, name) for name in expected)
+    if isinstance(value, bool) and expected in ("number", "integer"):
+        return False
+    return isinstance(value, TYPES[expected])
+
+
+def validate(value, schema, path="$"):
+    """Schema violations of value as "<path>: <problem>" strings."""
+    expected = schema.get("type")
+    if expected and not _is_type(value, expected):
+        return [f"{path}: expected {expected}, got {type(value).__name__}"]
+    if "enum" in schema and value not in schema["enum"]:
+        return [f"{path}: {value!r} is not one of {schema['enum']}"]
+
+    errors = []
+    if isinstance(value, dict):
+        for key in schema.get("required", []):
+            if key not in value:
+                errors.append(f"{path}: missing required property '{key}'")
+        for key, subschema in schema.get("properties", {}).items():
+            if key in value:
+                errors += validate(value[key], subschema, f"{path}.{key}")
+    elif isinstance(value, list):
+        if len(value) < schema.get("minItems", 0):
+            errors.append(f"{path}: expected at least {schema['minItems']} items")
+        if "items" in schema:
+            for index, item in enumerate(value):
+                errors += validate(item, schema["items"], f"{path}[{index}]")
+    return errors
+
+
+def artifact_for(path):
+    """Schema name for an output file such as dbo.usp_X_business_rules.json."""
+    name = os.path.basename(path)
+    for artifact in SCHEMAS:
+        if name.endswith(f"_{artifact}.json"):
+            return artifact
+    return None
+
+
+def parse_artifact(text, artifact):
+    """Repaired and validated JSON for one artifact of a model response."""
+    value = parse_json(text, SCHEMAS[artifact])
+    errors = validate(value, SCHEMAS[artifact])
+    if errors:
+        raise JsonOutputError(f"{artifact} does not match its schema", errors)
+    return value
+
+
+def load_artifact(path, artifact=None):
+    """Read a JSON file written by an earlier stage, repairing it if needed."""
+    with open(path, "r") as f:
+        text = f.read()
+    artifact = artifact or artifact_for(path)
+    if artifact is None:
+        return parse_json(text)
+    return parse_artifact(text, artifact)
+
+
+def correction_note(artifact, error):
+    """Prompt text asking for one rejected section again."""
+    problems = error.errors or [str(error)]
+    listed = "\n".join(f"- {problem}" for problem in problems[:20])
+    return f"""
+
+## Correction
+Your previous response for the {artifact} file was rejected:
+{listed}
+Respond again with only the complete {artifact} file as valid JSON following the template.
+"""
+
+
+def generate_artifact(artifact, generate, attempts=None):
+    """Validated JSON for one section of a stage's output.
+
+    generate(note) runs the model for this section alone and returns the
+    response (or the file block content); note is empty on the first call
+    and describes the problems on re-requests, so only the failed section
+    is generated again and its prompt misses the cache.
+    """
+    if attempts is None:
+        attempts = int(os.getenv("JSON_REPAIR_ATTEMPTS", REPAIR_ATTEMPTS))
+    note = ""
+    for attempt in range(attempts + 1):
+        try:
+            return parse_artifact(generate(note), artifact)
+        except JsonOutputError as e:
+            if attempt == attempts:
+                raise
+            print(f"⚠️ Invalid {artifact} JSON ({e}); requesting the section again")
+            note = correction_note(artifact, e)
@@ -0,0 +1,92 @@
+import os
+import time
+import threading
+from shared.llm_cache import LLMCache, crew_cache_key
+from shared.llm_registry import get_registry
+from shared.llm_retry import kickoff_with_retry
+from shared.metrics import record_kickoff
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMCache()
+        return _cache
+
+
+def _crew_origin(crew):
+    """(stage, model) of the first agent's LLM, for the metrics record."""
+    llm = getattr(crew.agents[0], "llm", None) if crew.agents else None
+    _, stage = get_registry().origin(llm)
+    return stage, getattr(llm, "model", None)
+
+
+def _run(crew, procedure, task, started, cache=None, key=None):
+    stage, model = _crew_origin(crew)
+    report = {}
+    try:
+        output = kickoff_with_retry(crew, report)
+    except Exception as e:
+        record_kickoff(
+            stage,
+            procedure,
+            task,
+            model,
+            time.monotonic() - started,
+            retries=report.get("retries", 0),
+            error=type(e).__name__,
+        )
+        raise
+
+    result = str(output)
+    if cache is not None:
+        cache.put(key, result)
+    record_kickoff(
+        stage,
+        procedure,
+        task,
+        report.get("model", model),
+        time.monotonic() - started,
+        output=output,
+        retries=report.get("retries", 0),
+        provider=report.get("provider"),
+    )
+    return result
+
+
+def kickoff(crew, procedure=None, task=None):
+    """Run a crew and return its final output as a string.
+
+    Responses are cached on disk keyed on the crew content, so identical
+    reruns make no LLM calls. LLM_CACHE=0 disables the cache and
+    LLM_CACHE=refresh skips cached responses but stores the new ones.
+    Transient provider errors are retried with backoff and may fall back
+    to another provider (see shared/llm_retry.py).
+
+    Tokens, latency, model, retries and cache hits are appended to the
+    metrics file under (procedure, stage, task); the stage is taken from
+    the registry client the crew's agent was built with.
+    """
+    started = time.monotonic()
+    mode = os.getenv("LLM_CACHE", "1")
+    if mode == "0":
+        return _run(crew, procedure, task, started)
+
+    cache = get_cache()
+    key = crew_cache_key(crew)
+
+    if mode != "refresh":
+        cached = cache.get(key)
+        if cached is not None:
+            print(f"♻️ Using cached LLM response {key[:12]}")
+            stage, model = _crew_origin(crew)
+            record_kickoff(
+                stage, procedure, task, model, time.monotonic() - started, cache_hit=True
+            )
+            return cached
+
+    return _run(crew, procedure, task, started, cache, key)
@@ -0,0 +1,110 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+
+DEFAULT_CACHE_PATH = "output/cache/llm_cache.sqlite"
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def _sha256(text):
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def crew_cache_key(crew):
+    """Content address of a crew run: model, temperature, agent persona,
+    task description and expected_output hash of every task, in order."""
+    tasks = []
+    for task in crew.tasks:
+        agent = task.agent or crew.agents[0]
+        llm = getattr(agent, "llm", None)
+        tasks.append(
+            {
+                "model": getattr(llm, "model", str(llm)),
+                "temperature": getattr(llm, "temperature", None),
+                "agent": _sha256(f"{agent.role}\n{agent.goal}\n{agent.backstory}"),
+                "description": task.description,
+                "expected_output": _sha256(task.expected_output),
+            }
+        )
+
+    key = {"planning": bool(getattr(crew, "planning", False)), "tasks": tasks}
+    return _sha256(json.dumps(key, sort_keys=True, default=str))
+
+
+class LLMCache:
+    """Disk-backed response cache in SQLite with size-based LRU eviction."""
+
+    def __init__(self, path=None, max_bytes=None):
+        self.path = path or os.getenv("LLM_CACHE_PATH", DEFAULT_CACHE_PATH)
+        self.max_bytes = max_bytes or int(
+            os.getenv("LLM_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)
+        )
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._connect() as db:
+            db.execute(
+                """CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )"""
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per call keeps the cache usable from
+        # threads; commit or roll back, then always close it
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def get(self, key):
+        with self._lock, self._connect() as db:
+            row = db.execute(
+                "SELECT value FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            return row[0]
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock, self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now),
+            )
+            self._evict(db)
+
+    def _evict(self, db):
+        (total,) = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if total <= self.max_bytes:
+            return
+
+        # Drop least recently used entries until back under 90% of the limit
+        target = self.max_bytes * 0.9
+        evicted = []
+        for key, size in db.execute(
+            "SELECT key, size FROM entries ORDER BY last_access"
+        ).fetchall():
+            if total <= target:
+                break
+            evicted.append((key,))
+            total -= size
+        db.executemany("DELETE FROM entries WHERE key = ?", evicted)
@@ -0,0 +1,318 @@
+import os
+import time
+import threading
+from shared.concurrency import llm_provider
+
+# Base client settings per provider; api_key_env is resolved at build time
+PROVIDER_CONFIGS = {
+    "openai": {
+        "model": "gpt-4o",
+        "api_key_env": "OPENAI_API_KEY",
+    },
+    "bedrock": {
+        "model": "bedrock/us.meta.llama3-3-70b-instruct-v1:0",
+        "max_retries": 2,
+        "request_timeout": 30,
+        "temperature": 0.1,
+        "timeout": 300,
+        "verbose": True,
+    },
+    "anthropic": {
+        "model": "anthropic/claude-3-7-sonnet-20250219",
+        "api_key_env": "ANTHROPIC_API_KEY",
+        "timeout": 600,
+        "request_timeout": 600,
+        "max_retries": 2,
+        "max_tokens": 64000,
+    },
+}
+
+# Stages pinned to one provider unless LLM_CONFIG_<STAGE> says otherwise
+STAGE_PROVIDERS = {
+    "business_analyst": "anthropic",
+    "implementation_executor": "openai",
+}
+
+# Where a stage needs something other than the provider defaults; None
+# removes a default setting
+STAGE_OVERRIDES = {
+    "create_csharp_tests": {
+        "anthropic": {
+            "timeout": None,
+            "request_timeout": None,
+            "max_retries": None,
+            "max_tokens": None,
+        },
+    },
+    "integration_test_spec": {"openai": {"model": "o3-mini"}},
+    "cross_validation_agent": {"openai": {"model": "o3-mini"}},
+    "sql_tests": {
+        # Deterministic SQL generation; large JSON specs need long timeouts
+        "openai": {
+            "temperature": 0.1,
+            "max_retries": 3,
+            "request_timeout": 60,
+            "verbose": True,
+        },
+        "anthropic": {"timeout": 900, "request_timeout": 900, "verbose": True},
+    },
+    "implementation_executor": {
+        "anthropic": {"timeout": 900, "request_timeout": 900, "max_retries": 3},
+    },
+}
+
+# Default (requests/min, tokens/min) per provider, overridable with
+# LLM_RPM_<PROVIDER> and LLM_TPM_<PROVIDER>; 0 disables a limit
+RATE_LIMIT_DEFAULTS = {
+    "openai": (500, 450000),
+    "anthropic": (50, 40000),
+    "bedrock": (100, 200000),
+}
+
+# Latency samples kept per model for the percentiles
+LATENCY_SAMPLES = 1000
+
+
+def provider_for(stage=None):
+    """LLM_CONFIG_<STAGE> when set, then the stage's STAGE_PROVIDERS entry,
+    otherwise LLM_CONFIG (default openai)."""
+    if stage:
+        provider = os.getenv(f"LLM_CONFIG_{stage.upper()}")
+        if provider in PROVIDER_CONFIGS:
+            return provider
+        if stage in STAGE_PROVIDERS:
+            return STAGE_PROVIDERS[stage]
+    return llm_provider()
+
+
+def estimate_tokens(value):
+    # Same rough 4 characters per token estimate as the prompt formatter
+    if isinstance(value, str):
+        return len(value) // 4
+    if isinstance(value, dict):
+        return estimate_tokens(value.get("content") or "")
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_tokens(item) for item in value)
+    return 0
+
+
+class TokenBucket:
+    """Refills continuously at per_minute/60 per second up to per_minute.
+
+    acquire() blocks until the amount is available; charge() takes tokens
+    after the fact and may drive the bucket negative, which delays the
+    next callers until the debt is repaid.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1):
+        """Take amount tokens, waiting if needed; returns seconds waited."""
+        # A single request larger than the bucket would otherwise never fit
+        amount = min(float(amount), self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = (amount - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def charge(self, amount):
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+
+    def drain(self, seconds):
+        """Empty the bucket so nothing is granted for the next seconds."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class ProviderLimiter:
+    def __init__(self, provider):
+        default_rpm, default_tpm = RATE_LIMIT_DEFAULTS.get(provider, (0, 0))
+        rpm = int(os.getenv(f"LLM_RPM_{provider.upper()}", default_rpm))
+        tpm = int(os.getenv(f"LLM_TPM_{provider.upper()}", default_tpm))
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+
+    def before_call(self, prompt_tokens):
+        waited = 0.0
+        if self.requests:
+            waited += self.requests.acquire(1)
+        if self.tokens:
+            waited += self.tokens.acquire(prompt_tokens)
+        return waited
+
+    def after_call(self, completion_tokens):
+        if self.tokens:
+            self.tokens.charge(completion_tokens)
+
+    def pause(self, seconds):
+        """Hold back every caller of this provider for about seconds, e.g.
+        after a 429 with Retry-After."""
+        if self.requests:
+            self.requests.drain(seconds)
+
+
+class LatencyStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.waited = 0.0
+        self.samples = []
+
+    def add(self, latency, waited, error=False):
+        self.calls += 1
+        self.errors += int(error)
+        self.total += latency
+        self.max = max(self.max, latency)
+        self.waited += waited
+        self.samples.append(latency)
+        if len(self.samples) > LATENCY_SAMPLES:
+            del self.samples[: len(self.samples) - LATENCY_SAMPLES]
+
+    def summary(self):
+        ordered = sorted(self.samples)
+
+        def percentile(fraction):
+            if not ordered:
+                return 0.0
+            return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "mean_s": round(self.total / self.calls, 3) if self.calls else 0.0,
+            "p50_s": round(percentile(0.5), 3),
+            "p95_s": round(percentile(0.95), 3),
+            "max_s": round(self.max, 3),
+            "rate_limit_wait_s": round(self.waited, 3),
+        }
+
+
+class LLMRegistry:
+    """Builds each provider/stage LLM client once and meters every call
+    through the provider's request and token buckets."""
+
+    def __init__(self):
+        self._clients = {}
+        self._origins = {}
+        self._limiters = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def config(self, provider, stage=None):
+        params = dict(PROVIDER_CONFIGS[provider])
+        for name, value in STAGE_OVERRIDES.get(stage, {}).get(provider, {}).items():
+            if value is None:
+                params.pop(name, None)
+            else:
+                params[name] = value
+        api_key_env = params.pop("api_key_env", None)
+        if api_key_env:
+            params["api_key"] = os.getenv(api_key_env)
+        return params
+
+    def limiter(self, provider):
+        with self._lock:
+            if provider not in self._limiters:
+                self._limiters[provider] = ProviderLimiter(provider)
+            return self._limiters[provider]
+
+    def get(self, provider=None, stage=None):
+        """The shared client for this provider (default: provider_for(stage))
+        with the stage's overrides applied."""
+        from crewai import LLM
+
+        provider = provider or provider_for(stage)
+        params = self.config(provider, stage)
+        key = (provider, tuple(sorted(params.items())))
+        limiter = self.limiter(provider)
+        with self._lock:
+            if key not in self._clients:
+                llm = LLM(**params)
+                stats = self._stats.setdefault(params["model"], LatencyStats())
+                self._instrument(llm, limiter, stats)
+                self._clients[key] = llm
+                self._origins[id(llm)] = (provider, stage)
+            return self._clients[key]
+
+    def origin(self, llm):
+        """(provider, stage) a registry client was built for, or (None, None)."""
+        return self._origins.get(id(llm), (None, None))
+
+    def provider_of(self, llm):
+        return self.origin(llm)[0]
+
+    def _instrument(self, llm, limiter, stats):
+        call = llm.call
+
+        def metered_call(messages, *args, **kwargs):
+            waited = limiter.before_call(estimate_tokens(messages))
+            started = time.monotonic()
+            try:
+                response = call(messages, *args, **kwargs)
+            except Exception:
+                with self._lock:
+                    stats.add(time.monotonic() - started, waited, error=True)
+                raise
+            with self._lock:
+                stats.add(time.monotonic() - started, waited)
+            limiter.after_call(estimate_tokens(response))
+            return response
+
+        # Bypass model validation on the client; the method is replaced on
+        # this instance only
+        object.__setattr__(llm, "call", metered_call)
+
+    def latency_metrics(self):
+        """{model: calls, errors, mean/p50/p95/max latency, rate limit wait}"""
+        with self._lock:
+            return {model: stats.summary() for model, stats in self._stats.items()}
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = LLMRegistry()
+        return _registry
+
+
+def print_latency_metrics():
+    metrics = {
+        model: summary
+        for model, summary in get_registry().latency_metrics().items()
+        if summary["calls"]
+    }
+    if not metrics:
+        return
+    print("LLM call latency:")
+    for model, summary in metrics.items():
+        print(
+            f"  {model}: {summary['calls']} calls, {summary['errors']} errors, "
+            f"mean {summary['mean_s']}s, p95 {summary['p95_s']}s, "
+            f"max {summary['max_s']}s, waited {summary['rate_limit_wait_s']}s for rate limits"
+        )
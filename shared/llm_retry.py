@@ -0,0 +1,263 @@
+import os
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from shared.llm_registry import PROVIDER_CONFIGS, get_registry
+
+# Attempts per provider and backoff bounds, overridable with
+# LLM_RETRY_ATTEMPTS, LLM_RETRY_BASE_DELAY and LLM_RETRY_MAX_DELAY
+RETRY_ATTEMPTS = 4
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 60.0
+
+# Consecutive failures that open a provider's circuit and how long it stays
+# open, overridable with LLM_BREAKER_THRESHOLD and LLM_BREAKER_COOLDOWN
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 60.0
+
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+RETRYABLE_NAMES = (
+    "RateLimitError",
+    "Timeout",
+    "APITimeoutError",
+    "APIConnectionError",
+    "InternalServerError",
+    "ServiceUnavailableError",
+    "ThrottlingException",
+    "ModelNotReadyException",
+    "ConnectionError",
+)
+RETRYABLE_MESSAGES = ("rate limit", "too many requests", "timed out", "timeout", "overloaded", "throttl")
+
+
+def _setting(name, default):
+    return type(default)(os.getenv(name, default))
+
+
+def _exception_chain(exc):
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        yield exc
+        exc = exc.__cause__ or exc.__context__
+
+
+def _status_code(exc):
+    for candidate in (exc, getattr(exc, "response", None)):
+        status = getattr(candidate, "status_code", None)
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def is_retryable(exc):
+    """Rate limits, timeouts, connection drops and 5xx errors, anywhere in
+    the exception chain; anything else (bad request, auth) is not."""
+    for error in _exception_chain(exc):
+        status = _status_code(error)
+        if status is not None:
+            return status in RETRYABLE_STATUS
+        if type(error).__name__ in RETRYABLE_NAMES or isinstance(error, TimeoutError):
+            return True
+        message = str(error).lower()
+        if any(text in message for text in RETRYABLE_MESSAGES):
+            return True
+    return False
+
+
+def retry_after(exc):
+    """Seconds the provider asked us to wait (Retry-After, retry-after-ms),
+    or None when the error carries no hint."""
+    for error in _exception_chain(exc):
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+            value = headers.get("retry-after")
+        except (AttributeError, ValueError):
+            continue
+        if value is None:
+            value = getattr(error, "retry_after", None)
+        if value is None:
+            continue
+        try:
+            return max(float(value), 0.0)
+        except (TypeError, ValueError):
+            pass
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def backoff_delay(attempt, hint=None):
+    """Full-jitter exponential backoff; a Retry-After hint is a floor."""
+    base = _setting("LLM_RETRY_BASE_DELAY", RETRY_BASE_DELAY)
+    ceiling = _setting("LLM_RETRY_MAX_DELAY", RETRY_MAX_DELAY)
+    delay = random.uniform(0, min(ceiling, base * 2 ** attempt))
+    if hint is not None:
+        delay = min(ceiling, hint) + random.uniform(0, base)
+    return delay
+
+
+class CircuitBreaker:
+    """Per-provider breaker: opens after BREAKER_THRESHOLD consecutive
+    retryable failures and lets a trial call through once the cooldown
+    has passed."""
+
+    def __init__(self):
+        self.threshold = _setting("LLM_BREAKER_THRESHOLD", BREAKER_THRESHOLD)
+        self.cooldown = _setting("LLM_BREAKER_COOLDOWN", BREAKER_COOLDOWN)
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        """Seconds until the circuit half-opens; 0 when calls may go through."""
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(self.opened_at + self.cooldown - time.monotonic(), 0.0)
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(provider):
+    with _breakers_lock:
+        if provider not in _breakers:
+            _breakers[provider] = CircuitBreaker()
+        return _breakers[provider]
+
+
+def fallback_providers(primary):
+    """LLM_FALLBACK (comma separated) when set; otherwise every other
+    provider with an API key in the environment. Bedrock credentials cannot
+    be checked cheaply, so it is only used when listed explicitly."""
+    configured = os.getenv("LLM_FALLBACK")
+    if configured is not None:
+        candidates = [name.strip() for name in configured.split(",") if name.strip()]
+    else:
+        candidates = [
+            name
+            for name, config in PROVIDER_CONFIGS.items()
+            if config.get("api_key_env") and os.getenv(config["api_key_env"])
+        ]
+    return [name for name in candidates if name in PROVIDER_CONFIGS and name != primary]
+
+
+def crew_provider(crew):
+    registry = get_registry()
+    for agent in crew.agents:
+        provider = registry.provider_of(getattr(agent, "llm", None))
+        if provider:
+            return provider
+    return None
+
+
+def _swap_provider(crew, provider):
+    """Point every registry-built agent LLM at the same stage's client for
+    another provider; returns the previous LLMs for restoring."""
+    registry = get_registry()
+    previous = []
+    for agent in crew.agents:
+        llm = getattr(agent, "llm", None)
+        original_provider, stage = registry.origin(llm)
+        if original_provider is None:
+            continue
+        previous.append((agent, llm))
+        object.__setattr__(agent, "llm", registry.get(provider, stage))
+    return previous
+
+
+def _restore(previous):
+    for agent, llm in previous:
+        object.__setattr__(agent, "llm", llm)
+
+
+def _attempt(crew, provider, attempts, report, can_fall_back=False):
+    """Run the crew on one provider with retries; raises the last error.
+    With somewhere to fall back to, an open circuit ends the retries early;
+    without, retries wait for the circuit to half-open."""
+    circuit = breaker(provider)
+    limiter = get_registry().limiter(provider) if provider else None
+    for attempt in range(attempts):
+        try:
+            result = crew.kickoff()
+        except Exception as e:
+            if not is_retryable(e):
+                raise
+            circuit.record_failure()
+            report["retries"] = report.get("retries", 0) + 1
+            hint = retry_after(e)
+            if hint is not None and limiter is not None:
+                # Other threads calling this provider back off as well
+                limiter.pause(hint)
+            if attempt + 1 == attempts or (can_fall_back and circuit.remaining()):
+                raise
+            delay = max(backoff_delay(attempt, hint), circuit.remaining())
+            print(
+                f"⏳ {provider or 'LLM'} call failed ({type(e).__name__}); "
+                f"retry {attempt + 1}/{attempts - 1} in {delay:.1f}s"
+            )
+            time.sleep(delay)
+        else:
+            circuit.record_success()
+            report["provider"] = provider
+            report["model"] = getattr(getattr(crew.agents[0], "llm", None), "model", None)
+            return result
+
+
+def kickoff_with_retry(crew, report=None):
+    """crew.kickoff() with exponential backoff and jitter on transient
+    errors, a circuit breaker per provider and fallback to the providers
+    from fallback_providers() once the crew's own provider gives up or
+    its circuit is open. Non-transient errors are raised immediately.
+
+    When given, report is filled with the retries made and the provider
+    and model that produced the result."""
+    report = {} if report is None else report
+    attempts = max(_setting("LLM_RETRY_ATTEMPTS", RETRY_ATTEMPTS), 1)
+    primary = crew_provider(crew)
+    if primary is None:
+        return _attempt(crew, None, attempts, report)
+
+    providers = [primary] + fallback_providers(primary)
+    last_error = None
+    for provider in providers:
+        if breaker(provider).remaining() and provider != providers[-1]:
+            print(f"🔌 Circuit open for {provider}, skipping to the next provider")
+            continue
+
+        wait = breaker(provider).remaining()
+        if wait:
+            # Last provider left: wait for its trial call instead of failing
+            print(f"🔌 Circuit open for {provider}, waiting {wait:.0f}s")
+            time.sleep(wait)
+
+        previous = _swap_provider(crew, provider) if provider != primary else []
+        if previous:
+            print(f"↪️ Falling back from {primary} to {provider}")
+        try:
+            return _attempt(crew, provider, attempts, report, provider != providers[-1])
+        except Exception as e:
+            if not is_retryable(e):
+                raise
+            last_error = e
+        finally:
+            _restore(previous)
+    raise last_error
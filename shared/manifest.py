@@ -0,0 +1,178 @@
+import os
+import json
+import hashlib
+from datetime import datetime
+from shared.dependency_index import lookup_dependencies
+
+# One small JSON file per (procedure, stage) so stages running side by side
+# never rewrite each other's entries
+MANIFEST_DIR = "output/manifest"
+
+BUSINESS_FILES = [
+    "business_rules.json",
+    "business_functions.json",
+    "business_processes.json",
+]
+PLAN_FILES = [
+    "implementation_approach.json",
+    "out_of_scope.json",
+    "specific_considerations.json",
+]
+
+
+def sql_path(procedure):
+    return f"output/sql_raw/{procedure}/{procedure}.sql"
+
+
+def analysis_path(procedure, suffix):
+    return f"output/analysis/{procedure}/{procedure}_{suffix}"
+
+
+def business_paths(procedure):
+    return [analysis_path(procedure, name) for name in BUSINESS_FILES]
+
+
+# Per stage: the files or directories it reads, whether its prompt includes
+# the procedure's dependency record, and the files or directories it writes
+STAGE_ARTIFACTS = {
+    "business_analyst": {
+        "inputs": lambda p: [sql_path(p), analysis_path(p, "meta.json")],
+        "dependencies": True,
+        "outputs": business_paths,
+    },
+    "integration_test_spec": {
+        "inputs": lambda p: [sql_path(p)] + business_paths(p),
+        "dependencies": True,
+        "outputs": lambda p: [analysis_path(p, "integration_test_spec.json")],
+    },
+    "implementation_planner": {
+        "inputs": lambda p: [sql_path(p)] + business_paths(p),
+        "dependencies": False,
+        "outputs": lambda p: [analysis_path(p, name) for name in PLAN_FILES],
+    },
+    "sql_tests": {
+        "inputs": lambda p: [sql_path(p), analysis_path(p, "meta.json")]
+        + business_paths(p)
+        + [analysis_path(p, "integration_test_spec.json")],
+        "dependencies": True,
+        "outputs": lambda p: [f"output/sql-tests/{p}"],
+    },
+    "implementation_executor": {
+        "inputs": lambda p: [sql_path(p)]
+        + business_paths(p)
+        + [analysis_path(p, name) for name in PLAN_FILES],
+        "dependencies": True,
+        "outputs": lambda p: [f"output/csharp-code/{p}"],
+    },
+    "document_process": {
+        "inputs": lambda p: business_paths(p)
+        + [analysis_path(p, "integration_test_spec.json"), f"output/sql-tests/{p}"],
+        "dependencies": False,
+        "outputs": lambda p: [f"output/analysis/{p}/processed"],
+    },
+    "cross_validation_agent": {
+        "inputs": lambda p: [sql_path(p)] + business_paths(p) + [f"output/csharp-code/{p}"],
+        "dependencies": True,
+        "outputs": lambda p: [
+            analysis_path(p, f"behavioral_parity_verification{suffix}.md")
+            for suffix in ("", "_bedrock", "_openai")
+        ],
+    },
+}
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def path_hash(path):
+    """sha256 of a file, or of every file under a directory (names included);
+    None when the path does not exist or the directory is empty."""
+    if os.path.isfile(path):
+        return file_hash(path)
+    if not os.path.isdir(path):
+        return None
+
+    digest = hashlib.sha256()
+    found = False
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            full_path = os.path.join(root, name)
+            relative = os.path.relpath(full_path, path).replace(os.sep, "/")
+            digest.update(f"{relative}\0{file_hash(full_path)}\n".encode("utf-8"))
+            found = True
+    return digest.hexdigest() if found else None
+
+
+def dependency_hash(procedure):
+    try:
+        dependencies = lookup_dependencies(procedure)
+    except FileNotFoundError:
+        return None
+    payload = json.dumps(dependencies, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def stage_inputs(procedure, stage):
+    artifacts = STAGE_ARTIFACTS[stage]
+    inputs = {path: path_hash(path) for path in artifacts["inputs"](procedure)}
+    if artifacts["dependencies"]:
+        inputs["dependencies"] = dependency_hash(procedure)
+    return inputs
+
+
+def stage_outputs(procedure, stage):
+    return {
+        path: path_hash(path) for path in STAGE_ARTIFACTS[stage]["outputs"](procedure)
+    }
+
+
+def entry_path(procedure, stage):
+    return os.path.join(MANIFEST_DIR, procedure, f"{stage}.json")
+
+
+def read_entry(procedure, stage):
+    try:
+        with open(entry_path(procedure, stage), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def inputs_changed(procedure, stage):
+    """True when the stage has run before and its inputs differ since."""
+    entry = read_entry(procedure, stage)
+    return entry is not None and entry["inputs"] != stage_inputs(procedure, stage)
+
+
+def is_fresh(procedure, stage):
+    """True when the stage completed for these exact inputs and every output
+    it recorded is still on disk unchanged."""
+    entry = read_entry(procedure, stage)
+    if entry is None or entry["inputs"] != stage_inputs(procedure, stage):
+        return False
+    outputs = stage_outputs(procedure, stage)
+    return None not in outputs.values() and entry["outputs"] == outputs
+
+
+def record_stage(procedure, stage):
+    """Record a completed stage with the current input and output hashes."""
+    entry = {
+        "procedure": procedure,
+        "stage": stage,
+        "completed": datetime.now().isoformat(timespec="seconds"),
+        "inputs": stage_inputs(procedure, stage),
+        "outputs": stage_outputs(procedure, stage),
+    }
+    path = entry_path(procedure, stage)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename so an interrupted run never leaves a torn entry
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as f:
+        json.dump(entry, f, indent=2)
+    os.replace(temporary_path, path)
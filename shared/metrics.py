@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import threading
+from collections import defaultdict
+
+METRICS_DIR = "output/metrics"
+METRICS_FILE = os.path.join(METRICS_DIR, "llm_calls.jsonl")
+
+# Every record written by this process carries the same run id so a
+# summary can be limited to the latest pipeline run; run.py passes its id
+# to stage subprocesses through PIPELINE_RUN_ID
+RUN_ID = os.getenv("PIPELINE_RUN_ID") or f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+
+_lock = threading.Lock()
+
+
+def enabled():
+    return os.getenv("LLM_METRICS", "1") != "0"
+
+
+def token_usage(output):
+    """(prompt, completion, cached prompt, requests) from a CrewOutput's
+    token_usage; zeros when the output carries none."""
+    usage = getattr(output, "token_usage", None)
+
+    def field(name):
+        value = getattr(usage, name, None)
+        if value is None and isinstance(usage, dict):
+            value = usage.get(name)
+        return int(value or 0)
+
+    return (
+        field("prompt_tokens"),
+        field("completion_tokens"),
+        field("cached_prompt_tokens"),
+        field("successful_requests"),
+    )
+
+
+def record_kickoff(
+    stage,
+    procedure,
+    task,
+    model,
+    latency,
+    output=None,
+    retries=0,
+    cache_hit=False,
+    provider=None,
+    error=None,
+):
+    """Append one kickoff to the metrics JSONL file."""
+    if not enabled():
+        return
+    prompt_tokens, completion_tokens, cached_tokens, requests = token_usage(output)
+    entry = {
+        "run": RUN_ID,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "stage": stage,
+        "procedure": procedure,
+        "task": task,
+        "provider": provider,
+        "model": model,
+        "latency_s": round(latency, 3),
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "cached_prompt_tokens": cached_tokens,
+        "requests": requests,
+        "retries": retries,
+        "cache_hit": cache_hit,
+        "error": error,
+    }
+    line = json.dumps(entry, default=str)
+    with _lock:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        with open(METRICS_FILE, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def load_records(path=METRICS_FILE, run="latest"):
+    """Records from the metrics file; run is "latest", "all" or a run id."""
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # A run killed mid-write can leave a partial last line
+                continue
+    if run == "all" or not records:
+        return records
+    if run == "latest":
+        run = records[-1]["run"]
+    return [entry for entry in records if entry.get("run") == run]
+
+
+def aggregate(records, by=("procedure",)):
+    """Totals per key: kickoffs, latency, tokens, retries, cache hits, errors."""
+    totals = defaultdict(
+        lambda: {
+            "kickoffs": 0,
+            "latency_s": 0.0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "total_tokens": 0,
+            "retries": 0,
+            "cache_hits": 0,
+            "errors": 0,
+        }
+    )
+    for entry in records:
+        key = tuple(entry.get(field) or "-" for field in by)
+        summary = totals[key]
+        summary["kickoffs"] += 1
+        summary["latency_s"] += entry.get("latency_s", 0.0)
+        summary["prompt_tokens"] += entry.get("prompt_tokens", 0)
+        summary["completion_tokens"] += entry.get("completion_tokens", 0)
+        summary["total_tokens"] += entry.get("total_tokens", 0)
+        summary["retries"] += entry.get("retries", 0)
+        summary["cache_hits"] += int(bool(entry.get("cache_hit")))
+        summary["errors"] += int(bool(entry.get("error")))
+    return dict(totals)
+
+
+def top(totals, metric, count):
+    return sorted(totals.items(), key=lambda item: item[1][metric], reverse=True)[:count]
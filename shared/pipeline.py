@@ -0,0 +1,137 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+class Stage:
+    """One pipeline step run per procedure.
+
+    run(procedure) returns a truthy value on success; a falsy value or an
+    exception marks that procedure's stage as failed. depends_on names the
+    stages that must have completed for the same procedure first.
+    """
+
+    def __init__(self, name, run, depends_on=(), max_concurrency=1):
+        self.name = name
+        self.run = run
+        self.depends_on = tuple(depends_on)
+        self.max_concurrency = max(int(max_concurrency), 1)
+
+
+def topological_order(stages):
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        for dependency in stage.depends_on:
+            if dependency not in by_name:
+                raise ValueError(
+                    f"Stage {stage.name} depends on unknown stage {dependency}"
+                )
+
+    order = []
+    visiting = set()
+
+    def visit(stage):
+        if stage.name in order:
+            return
+        if stage.name in visiting:
+            raise ValueError(f"Stage dependency cycle through {stage.name}")
+        visiting.add(stage.name)
+        for dependency in stage.depends_on:
+            visit(by_name[dependency])
+        visiting.discard(stage.name)
+        order.append(stage.name)
+
+    for stage in stages:
+        visit(stage)
+    return [by_name[name] for name in order]
+
+
+class PipelineScheduler:
+    """Streams procedures through a DAG of stages.
+
+    Every (procedure, stage) pair becomes runnable as soon as that procedure
+    has finished the stages it depends on, so early procedures reach the
+    last stage while later ones are still in the first. Each stage runs at
+    most max_concurrency procedures at a time, and a failure only skips the
+    downstream stages of the procedure that failed.
+    """
+
+    def __init__(self, stages, on_finish=None):
+        self.stages = topological_order(stages)
+        self.by_name = {stage.name: stage for stage in self.stages}
+        self.rank = {stage.name: index for index, stage in enumerate(self.stages)}
+        self.dependents = {stage.name: [] for stage in self.stages}
+        for stage in self.stages:
+            for dependency in stage.depends_on:
+                self.dependents[dependency].append(stage.name)
+        self.on_finish = on_finish
+        self._lock = threading.Lock()
+
+    def _report(self, procedure, stage_name, status, error=None):
+        if self.on_finish:
+            with self._lock:
+                self.on_finish(procedure, stage_name, status, error)
+
+    def _skip_downstream(self, procedure, stage_name, status):
+        for dependent in self.dependents[stage_name]:
+            if (procedure, dependent) not in status:
+                status[(procedure, dependent)] = SKIPPED
+                self._report(procedure, dependent, SKIPPED)
+                self._skip_downstream(procedure, dependent, status)
+
+    def run(self, procedures):
+        """Run every stage for every procedure; returns
+        {(procedure, stage): "done" | "failed" | "skipped"}."""
+        procedures = list(procedures)
+        order = {procedure: index for index, procedure in enumerate(procedures)}
+        status = {}
+        # Earlier procedures and earlier stages first, so work drains in order
+        ready = [
+            (procedure, stage.name)
+            for procedure in procedures
+            for stage in self.stages
+            if not stage.depends_on
+        ]
+        running = {stage.name: 0 for stage in self.stages}
+        futures = {}
+
+        workers = sum(stage.max_concurrency for stage in self.stages)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while ready or futures:
+                ready.sort(key=lambda item: (order[item[0]], self.rank[item[1]]))
+                waiting = []
+                for procedure, stage_name in ready:
+                    stage = self.by_name[stage_name]
+                    if running[stage_name] >= stage.max_concurrency:
+                        waiting.append((procedure, stage_name))
+                        continue
+                    running[stage_name] += 1
+                    future = executor.submit(stage.run, procedure)
+                    futures[future] = (procedure, stage_name)
+                ready = waiting
+
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    procedure, stage_name = futures.pop(future)
+                    running[stage_name] -= 1
+
+                    error = future.exception()
+                    succeeded = error is None and bool(future.result())
+                    status[(procedure, stage_name)] = DONE if succeeded else FAILED
+                    self._report(procedure, stage_name, status[(procedure, stage_name)], error)
+
+                    if not succeeded:
+                        self._skip_downstream(procedure, stage_name, status)
+                        continue
+
+                    for dependent in self.dependents[stage_name]:
+                        if all(
+                            status.get((procedure, dependency)) == DONE
+                            for dependency in self.by_name[dependent].depends_on
+                        ):
+                            ready.append((procedure, dependent))
+
+        return status
@@ -0,0 +1,109 @@
+from datetime import datetime
+from fnmatch import fnmatchcase
+
+PROCEDURES_QUERY = """
+SELECT
+    s.name + '.' + p.name AS name
+FROM sys.procedures p
+JOIN sys.schemas s ON p.schema_id = s.schema_id
+WHERE p.type = 'P'
+AND p.name NOT LIKE 'tSQLt%'
+{changed_since}
+ORDER BY s.name, p.name;"""
+
+
+def _matches(value, patterns):
+    # SQL Server identifiers are case-insensitive under the default collation
+    return any(fnmatchcase(value.lower(), pattern.lower()) for pattern in patterns)
+
+
+def read_procedure_file(path):
+    """Procedure names from a file, one per line; blank lines and lines
+    starting with # are ignored."""
+    with open(path, "r") as f:
+        return [
+            line.strip()
+            for line in f
+            if line.strip() and not line.strip().startswith("#")
+        ]
+
+
+def iter_procedures(
+    cursor, schemas=None, names=None, procedure_names=None, changed_since=None
+):
+    """Stream schema.procedure names matching every given filter.
+
+    schemas and names are glob patterns (``CM``, ``arm*``, ``Get*``); a name
+    pattern containing a dot is matched against the full schema.procedure
+    name. procedure_names restricts the result to an explicit list, and
+    changed_since keeps only procedures whose sys.objects.modify_date is on
+    or after that datetime. Rows are read from the cursor as they arrive.
+    """
+    clause = ""
+    params = []
+    if changed_since is not None:
+        clause = "AND p.modify_date >= ?"
+        params.append(changed_since)
+
+    wanted = None
+    if procedure_names is not None:
+        wanted = {name.lower() for name in procedure_names}
+
+    cursor.execute(PROCEDURES_QUERY.format(changed_since=clause), *params)
+    for row in cursor:
+        full_name = str(row.name)
+        schema, _, name = full_name.partition(".")
+
+        if schemas and not _matches(schema, schemas):
+            continue
+        if names and not any(
+            _matches(full_name if "." in pattern else name, [pattern])
+            for pattern in names
+        ):
+            continue
+        if wanted is not None and full_name.lower() not in wanted:
+            continue
+
+        yield full_name
+
+
+def add_selection_arguments(parser):
+    parser.add_argument(
+        "--schema",
+        action="append",
+        metavar="GLOB",
+        help="schema glob pattern (repeatable)",
+    )
+    parser.add_argument(
+        "--name",
+        action="append",
+        metavar="GLOB",
+        help="procedure glob pattern, e.g. 'Get*' or 'CM.Get*' (repeatable)",
+    )
+    parser.add_argument(
+        "--procedures-file",
+        metavar="PATH",
+        help="file with one schema.procedure name per line",
+    )
+    parser.add_argument(
+        "--changed-since",
+        type=datetime.fromisoformat,
+        metavar="DATE",
+        help="only procedures created or altered on or after this ISO date",
+    )
+    return parser
+
+
+def select_procedures(cursor, args):
+    """Stream the procedures selected by parsed add_selection_arguments()."""
+    procedure_names = None
+    if args.procedures_file:
+        procedure_names = read_procedure_file(args.procedures_file)
+
+    return iter_procedures(
+        cursor,
+        schemas=args.schema,
+        names=args.name,
+        procedure_names=procedure_names,
+        changed_since=args.changed_since,
+    )
@@ -0,0 +1,88 @@
+import sqlparse
+from shared.column_usage import prune_dependencies
+
+# sys.columns reports max_length in bytes; nvarchar/nchar use two per character
+UNICODE_TYPES = ("nvarchar", "nchar")
+LENGTH_TYPES = ("varchar", "char", "varbinary", "binary") + UNICODE_TYPES
+PRECISION_TYPES = ("decimal", "numeric")
+FRACTIONAL_SECOND_TYPES = ("datetime2", "time", "datetimeoffset")
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text and SQL
+    return len(text) // 4
+
+
+def format_data_type(column):
+    data_type = column["data_type"]
+
+    if data_type in LENGTH_TYPES:
+        length = column.get("max_length")
+        if length == -1:
+            return f"{data_type}(max)"
+        if data_type in UNICODE_TYPES:
+            length = length // 2
+        return f"{data_type}({length})"
+
+    if data_type in PRECISION_TYPES:
+        return f"{data_type}({column.get('precision')},{column.get('scale')})"
+
+    if data_type in FRACTIONAL_SECOND_TYPES and column.get("scale") != 7:
+        return f"{data_type}({column.get('scale')})"
+
+    return data_type
+
+
+def render_dependencies(dependencies, procedure_definition=None):
+    """Render dependencies as a compact DDL-like schema digest, one line per
+    table or view with only the columns the procedure body reads or writes."""
+    pruned = dependencies
+    if procedure_definition:
+        pruned = prune_dependencies(dependencies, procedure_definition)
+
+    lines = []
+    for dep, original in zip(pruned, dependencies):
+        if "columns" in dep:
+            columns = dep["columns"]
+
+            column_sql = ", ".join(
+                f"{column['name']} {format_data_type(column)}"
+                + ("" if column["is_nullable"] else " NOT NULL")
+                for column in columns
+            )
+            line = f"{dep['type']} {dep['name']} ({column_sql})"
+            omitted = len(original["columns"]) - len(columns)
+            if omitted:
+                line += f" -- {omitted} unreferenced columns omitted"
+            lines.append(line)
+
+        elif dep["type"] == "FUNCTION":
+            if dep.get("definition"):
+                definition = sqlparse.format(dep["definition"], strip_comments=True)
+                definition = "\n".join(
+                    line.rstrip() for line in definition.splitlines() if line.strip()
+                )
+                lines.append(f"FUNCTION {dep['name']}:\n{definition}")
+            else:
+                lines.append(f"FUNCTION {dep['name']} (definition unavailable)")
+
+        else:
+            lines.append(f"{dep['type']} {dep['name']}")
+
+    return "\n".join(lines)
+
+
+def render_dependency_prompt(procedure_name, dependencies, procedure_definition=None):
+    """Render the dependency digest for a prompt and report the token savings
+    against the raw Python repr previously inlined into every task."""
+    rendered = render_dependencies(dependencies, procedure_definition)
+
+    raw_tokens = estimate_tokens(str(dependencies))
+    compact_tokens = estimate_tokens(rendered)
+    saved = 100 - (compact_tokens * 100 // raw_tokens) if raw_tokens else 0
+    print(
+        f"Dependency prompt for {procedure_name}: "
+        f"~{raw_tokens} -> ~{compact_tokens} tokens ({saved}% saved)"
+    )
+
+    return rendered
@@ -0,0 +1,53 @@
+import os
+import threading
+import dotenv
+from shared.get_dependencies import get_dependencies
+from shared.llm_registry import get_registry
+
+
+class RuntimeContext:
+    """Resources shared by every stage run in one process: LLM clients,
+    the SQL Server connection pool and the dependency index.
+
+    Stage modules expose run_procedure(procedure, context); run.py creates
+    one context and passes it to every stage so .env, LLM clients and
+    database connections are set up once instead of once per stage.
+    crewai and pyodbc are only imported when an LLM or a connection is
+    first requested.
+    """
+
+    def __init__(self, pool_size=None):
+        dotenv.load_dotenv()
+        self.pool_size = pool_size
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def llm(self, stage=None, provider=None):
+        """The shared, rate-limited LLM client for a stage. The provider
+        defaults to LLM_CONFIG_<STAGE>, then LLM_CONFIG."""
+        return get_registry().get(provider, stage)
+
+    @property
+    def pool(self):
+        from shared.connection_pool import ConnectionPool
+
+        with self._lock:
+            if self._pool is None:
+                self._pool = ConnectionPool(
+                    os.getenv("CONNECTION_STRING"), size=self.pool_size
+                )
+            return self._pool
+
+    def connection(self):
+        """Context manager checking a connection out of the shared pool."""
+        return self.pool.connection()
+
+    def dependencies(self, procedure):
+        # The catalog behind this is loaded once and memoized per process
+        return get_dependencies(procedure)
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
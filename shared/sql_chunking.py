@@ -0,0 +1,352 @@
+import os
+import re
+from sqlparse import lexer
+from sqlparse import tokens as T
+from shared.column_usage import STATEMENT_KEYWORDS, DML_KEYWORDS
+
+# Procedures longer than this many lines are analyzed in segments,
+# overridable with SQL_CHUNK_LINES and SQL_CHUNK_OVERLAP
+MAX_CHUNK_LINES = 800
+OVERLAP_LINES = 40
+
+# Lines of CREATE PROCEDURE header repeated in front of later segments
+MAX_HEADER_LINES = 60
+
+# BEGIN variants that do not open a BEGIN ... END block
+NON_BLOCK_BEGIN = {"TRAN", "TRANSACTION", "DISTRIBUTED", "DIALOG", "CONVERSATION"}
+
+SPLIT_KEYWORDS = (STATEMENT_KEYWORDS | DML_KEYWORDS) - {"END", "ELSE"}
+
+END_FOLLOWED_BY = re.compile(r"^(END)(\s+)(IF|WHILE|LOOP)$", re.IGNORECASE)
+
+# Keywords whose next statement is their body and must stay with them
+CONTROL_KEYWORDS = {"IF", "ELSE", "WHILE"}
+
+
+class SqlChunk:
+    """Lines start_line..end_line (1-based, inclusive) of a procedure.
+    Consecutive chunks overlap; each line is owned by exactly one chunk
+    (owned_start..owned_end), which decides where merged results come from."""
+
+    def __init__(self, index, lines, start_line, end_line):
+        self.index = index
+        self.start_line = start_line
+        self.end_line = end_line
+        self.owned_start = start_line
+        self.owned_end = end_line
+        self.text = "\n".join(lines[start_line - 1 : end_line])
+
+    def absolute(self, line):
+        """Procedure line number for a line number relative to this chunk."""
+        return line + self.start_line - 1
+
+    def owns(self, line):
+        return self.owned_start <= line <= self.owned_end
+
+
+def chunk_settings():
+    return (
+        int(os.getenv("SQL_CHUNK_LINES", MAX_CHUNK_LINES)),
+        int(os.getenv("SQL_CHUNK_OVERLAP", OVERLAP_LINES)),
+    )
+
+
+def statement_boundaries(text):
+    """{line: BEGIN/END depth} for every line that starts a statement
+    outside of parentheses and CASE expressions."""
+    # The bare lexer: sqlparse.parse() refuses statements of more than
+    # 10000 tokens, which is exactly the procedures that need chunking
+    tokens = []
+    for ttype, value in lexer.tokenize(text):
+        if not value or (ttype in T.Whitespace and "\n" not in value):
+            continue
+        merged_end = END_FOLLOWED_BY.match(value) if ttype in T.Keyword else None
+        if merged_end:
+            # T-SQL has no END IF / END WHILE: the lexer joined an END with
+            # the statement after it
+            end, gap, keyword = merged_end.groups()
+            tokens += [(ttype, end), (T.Whitespace, gap), (ttype, keyword)]
+        else:
+            tokens.append((ttype, value))
+
+    boundaries = {}
+    line = 1
+    at_line_start = True
+    depth = 0
+    parens = 0
+    blocks = []  # "BEGIN" or "CASE", innermost last
+    attached = False  # the next statement is the body of IF/ELSE/WHILE
+    for i, (ttype, value) in enumerate(tokens):
+        if ttype in T.Whitespace or ttype in T.Comment:
+            if "\n" in value:
+                line += value.count("\n")
+                at_line_start = True
+            continue
+
+        word = " ".join(value.upper().split()) if ttype in T.Keyword else None
+        first_word = word.split(" ")[0] if word else None
+        starts_statement = (
+            first_word in SPLIT_KEYWORDS and parens == 0 and "CASE" not in blocks
+        )
+        if starts_statement and at_line_start and not attached:
+            boundaries.setdefault(line, depth)
+        if starts_statement or (first_word == "ELSE" and "CASE" not in blocks):
+            attached = first_word in CONTROL_KEYWORDS
+
+        if value == "(":
+            parens += 1
+        elif value == ")":
+            parens = max(parens - 1, 0)
+        elif first_word == "CASE":
+            blocks.append("CASE")
+        elif first_word == "BEGIN":
+            following = next(
+                (
+                    next_value.upper()
+                    for next_type, next_value in tokens[i + 1 :]
+                    if next_type not in T.Whitespace and next_type not in T.Comment
+                ),
+                "",
+            )
+            if word == "BEGIN" and following not in NON_BLOCK_BEGIN:
+                blocks.append("BEGIN")
+                depth += 1
+        elif first_word == "END" and blocks:
+            if blocks.pop() == "BEGIN":
+                depth -= 1
+
+        line += value.count("\n")
+        at_line_start = False
+    return boundaries
+
+
+def chunk_sql(text, max_lines=None, overlap=None):
+    """Split a procedure into overlapping chunks of at most max_lines lines.
+
+    Chunks end just before a statement start, preferring the shallowest
+    BEGIN/END nesting in the second half of the window, and the next chunk
+    starts up to overlap lines earlier, again on a statement start. A
+    procedure that fits returns a single chunk.
+    """
+    default_lines, default_overlap = chunk_settings()
+    max_lines = max(max_lines or default_lines, 2)
+    overlap = min(default_overlap if overlap is None else overlap, max_lines // 2)
+
+    lines = text.split("\n")
+    total = len(lines)
+    if total <= max_lines:
+        return [SqlChunk(0, lines, 1, total)]
+
+    boundaries = statement_boundaries(text)
+    chunks = []
+    start = 1
+    while True:
+        window_end = start + max_lines - 1
+        if window_end >= total:
+            chunks.append(SqlChunk(len(chunks), lines, start, total))
+            break
+
+        # Next chunk's owned part begins at split; prefer shallow nesting,
+        # then the latest statement start in the window
+        candidates = [
+            candidate
+            for candidate in boundaries
+            if start + max_lines // 2 < candidate <= window_end + 1
+        ]
+        split = (
+            min(candidates, key=lambda candidate: (boundaries[candidate], -candidate))
+            if candidates
+            else window_end + 1
+        )
+        chunks.append(SqlChunk(len(chunks), lines, start, split - 1))
+
+        overlap_starts = [
+            candidate
+            for candidate in boundaries
+            if split - overlap <= candidate < split and candidate > start
+        ]
+        start = min(overlap_starts) if overlap_starts else max(split - overlap, start + 1)
+
+    # Each chunk owns its lines up to where the next chunk's split begins
+    for previous, chunk in zip(chunks, chunks[1:]):
+        chunk.owned_start = previous.end_line + 1
+    return chunks
+
+
+def procedure_header(text):
+    """The CREATE/ALTER PROCEDURE line(s) up to AS, for context in later chunks."""
+    lines = text.split("\n")[:MAX_HEADER_LINES]
+    for number, line in enumerate(lines):
+        if line.strip().upper() == "AS" or line.upper().rstrip().endswith(" AS"):
+            return "\n".join(lines[: number + 1])
+    return "\n".join(lines[:10])
+
+
+def chunk_note(chunk, chunks, header):
+    """Prompt preamble telling the model which part of the procedure it
+    sees; empty for an unchunked procedure so its prompt is unchanged."""
+    if len(chunks) == 1:
+        return ""
+    note = (
+        f"This is segment {chunk.index + 1} of {len(chunks)} of a large stored procedure, "
+        f"lines {chunk.start_line}-{chunk.end_line} of {chunks[-1].end_line}. "
+        "Analyze only the code in this segment. Report every line number relative to "
+        "this segment, where its first line is line 1.\n"
+    )
+    if chunk.index > 0:
+        note += f"The procedure header, for reference only:\n{header}\n"
+    return note
+
+
+def _offset_range(item, chunk, start_key, end_key, container=None):
+    target = item.get(container) if container else item
+    if not isinstance(target, dict):
+        return None
+    start = target.get(start_key)
+    if isinstance(start, int):
+        target[start_key] = chunk.absolute(start)
+    end = target.get(end_key)
+    if isinstance(end, int):
+        target[end_key] = min(chunk.absolute(end), chunk.end_line)
+    return target.get(start_key) if isinstance(start, int) else None
+
+
+def _offset_block(block, chunk):
+    line_range = block.get("lineRange")
+    if isinstance(line_range, list) and len(line_range) == 2 and all(
+        isinstance(value, int) for value in line_range
+    ):
+        block["lineRange"] = [
+            chunk.absolute(line_range[0]),
+            min(chunk.absolute(line_range[1]), chunk.end_line),
+        ]
+    for child in block.get("childBlocks") or []:
+        if isinstance(child, dict):
+            _offset_block(child, chunk)
+    return block
+
+
+def _block_start(block):
+    line_range = block.get("lineRange")
+    if isinstance(line_range, list) and line_range and isinstance(line_range[0], int):
+        return line_range[0]
+    return None
+
+
+def merge_logical_blocks(chunks, chunk_blocks):
+    """Merge each chunk's logicalBlocks: line ranges become procedure line
+    numbers, blocks starting in another chunk's owned lines are dropped as
+    overlap duplicates and ids are renumbered block_0.. in line order."""
+    kept = []
+    for chunk, blocks in zip(chunks, chunk_blocks):
+        for block in blocks or []:
+            if not isinstance(block, dict):
+                continue
+            _offset_block(block, chunk)
+            start = _block_start(block)
+            if start is not None and not chunk.owns(start):
+                continue
+            kept.append((start if start is not None else chunk.owned_start, chunk, block))
+
+    kept.sort(key=lambda entry: entry[0])
+    ids = {}
+    for number, (_, chunk, block) in enumerate(kept):
+        ids[(chunk.index, block.get("id"))] = f"block_{number}"
+    merged = []
+    for _, chunk, block in kept:
+        old_id = block.get("id")
+        block["id"] = ids[(chunk.index, old_id)]
+        children = block.get("childBlocks") or []
+        block["childBlocks"] = [
+            ids.get((chunk.index, child), child) if not isinstance(child, dict) else child
+            for child in children
+        ]
+        merged.append(block)
+    return merged
+
+
+def _normalized(text):
+    return " ".join(str(text or "").lower().split())
+
+
+def merge_business_rules(chunks, chunk_rules, prefix="BR-"):
+    """Merge each chunk's businessRules: implementation.lineStart/lineEnd
+    become procedure line numbers, rules from overlap lines or repeating
+    another rule's name, description and lines are dropped and ids are
+    renumbered BR-001.. in line order. Rules that only share a (often
+    generic) name are kept. Returns (rules, {(chunk index, old id): new id})."""
+    kept = []
+    seen = set()
+    for chunk, rules in zip(chunks, chunk_rules):
+        for rule in rules or []:
+            if not isinstance(rule, dict):
+                continue
+            start = _offset_range(rule, chunk, "lineStart", "lineEnd", "implementation")
+            if start is not None and not chunk.owns(start):
+                continue
+            identity = (_normalized(rule.get("name")), _normalized(rule.get("description")), start)
+            if any(identity[:2]) and identity in seen:
+                continue
+            seen.add(identity)
+            kept.append((start if start is not None else chunk.owned_start, chunk, rule))
+
+    kept.sort(key=lambda entry: entry[0])
+    ids = {}
+    merged = []
+    for number, (_, chunk, rule) in enumerate(kept, start=1):
+        new_id = f"{prefix}{number:03d}"
+        ids[(chunk.index, rule.get("id"))] = new_id
+        rule["id"] = new_id
+        merged.append(rule)
+    return merged, ids
+
+
+def _merge_unique(lists, key=None):
+    """Concatenate lists, dropping repeats by key (default: the whole item)."""
+    merged = []
+    seen = set()
+    for items in lists:
+        for item in items or []:
+            identity = repr(key(item) if key else item).lower()
+            if identity in seen:
+                continue
+            seen.add(identity)
+            merged.append(item)
+    return merged
+
+
+def _merge_grouped(lists, name_key, values_key):
+    """Merge items sharing name_key, concatenating their values_key lists."""
+    merged = {}
+    for items in lists:
+        for item in items or []:
+            if not isinstance(item, dict):
+                continue
+            name = item.get(name_key)
+            if name not in merged:
+                merged[name] = dict(item)
+                continue
+            existing = merged[name]
+            values = existing.get(values_key)
+            new_values = item.get(values_key)
+            if isinstance(values, list) and isinstance(new_values, list):
+                existing[values_key] = _merge_unique([values, new_values])
+    return list(merged.values())
+
+
+def merge_metadata(chunks, results):
+    """Combine the per-chunk semantic fields prepare_sp asks the model for;
+    the rest of the metadata is computed statically for the whole procedure."""
+    def field(name):
+        return [result.get(name) or [] for result in results]
+
+    return {
+        "logicalBlocks": merge_logical_blocks(chunks, field("logicalBlocks")),
+        "potentialBusinessRules": _merge_unique(
+            field("potentialBusinessRules"),
+            key=lambda rule: (rule.get("ruleType"), rule.get("description")),
+        ),
+        "testValueCandidates": _merge_grouped(
+            field("testValueCandidates"), "parameterName", "testValues"
+        ),
+    }
@@ -0,0 +1,390 @@
+from collections import Counter
+from shared.column_usage import (
+    DML_KEYWORDS,
+    TABLE_KEYWORDS,
+    analyze_column_usage,
+    split_statements,
+    tokenize,
+)
+
+# statementPurpose classification by the statement's first keyword
+STATEMENT_TYPES = {
+    "SELECT": "DATA_RETRIEVAL",
+    "INSERT": "DATA_INSERTION",
+    "UPDATE": "DATA_MODIFICATION",
+    "DELETE": "DATA_DELETION",
+    "TRUNCATE": "DATA_DELETION",
+    "MERGE": "DATA_MERGE",
+    "CREATE": "OBJECT_CREATION",
+    "ALTER": "OBJECT_MODIFICATION",
+    "DROP": "OBJECT_DELETION",
+    "DECLARE": "VARIABLE_DECLARATION",
+    "SET": "VARIABLE_ASSIGNMENT",
+    "IF": "CONDITIONAL_LOGIC",
+    "ELSE": "CONDITIONAL_LOGIC",
+    "WHILE": "LOOP",
+    "BREAK": "LOOP",
+    "CONTINUE": "LOOP",
+    "GOTO": "CONTROL_FLOW",
+    "RETURN": "CONTROL_FLOW",
+    "EXEC": "PROCEDURE_CALL",
+    "EXECUTE": "PROCEDURE_CALL",
+    "COMMIT": "TRANSACTION_CONTROL",
+    "ROLLBACK": "TRANSACTION_CONTROL",
+    "RAISERROR": "ERROR_HANDLING",
+    "THROW": "ERROR_HANDLING",
+    "PRINT": "MESSAGE",
+    "OPEN": "CURSOR_OPERATION",
+    "FETCH": "CURSOR_OPERATION",
+    "CLOSE": "CURSOR_OPERATION",
+    "DEALLOCATE": "CURSOR_OPERATION",
+}
+
+STATEMENT_PURPOSES = {
+    "DATA_RETRIEVAL": "Reads data",
+    "DATA_INSERTION": "Inserts rows",
+    "DATA_MODIFICATION": "Updates rows",
+    "DATA_DELETION": "Deletes rows",
+    "DATA_MERGE": "Merges rows",
+    "OBJECT_CREATION": "Creates objects",
+    "OBJECT_MODIFICATION": "Alters objects",
+    "OBJECT_DELETION": "Drops objects",
+    "VARIABLE_DECLARATION": "Declares variables",
+    "VARIABLE_ASSIGNMENT": "Assigns variables",
+    "SESSION_SETTING": "Sets session options",
+    "CONDITIONAL_LOGIC": "Branches on a condition",
+    "LOOP": "Loops while a condition holds",
+    "CONTROL_FLOW": "Transfers control",
+    "PROCEDURE_CALL": "Calls procedures",
+    "TRANSACTION_CONTROL": "Controls the transaction",
+    "ERROR_HANDLING": "Raises errors",
+    "MESSAGE": "Prints messages",
+    "CURSOR_OPERATION": "Operates a cursor",
+}
+
+SESSION_OPTIONS = {
+    "NOCOUNT",
+    "XACT_ABORT",
+    "ANSI_NULLS",
+    "ANSI_WARNINGS",
+    "QUOTED_IDENTIFIER",
+    "ARITHABORT",
+    "DEADLOCK_PRIORITY",
+    "LOCK_TIMEOUT",
+    "TRANSACTION",
+    "DATEFIRST",
+    "DATEFORMAT",
+    "ROWCOUNT",
+}
+TRANSACTION_WORDS = {"TRAN", "TRANSACTION", "DISTRIBUTED"}
+PARAMETER_FLAGS = {"OUTPUT", "OUT", "READONLY"}
+
+# What a parameter reference means, by the clause it appears in
+USAGE_BY_CLAUSE = {
+    "WHERE": "filters rows",
+    "ON": "filters rows",
+    "HAVING": "filters rows",
+    "WHEN": "drives a CASE or MERGE condition",
+    "VALUES": "is inserted into a table",
+    "SET": "is written to a column",
+    "TOP": "limits the row count",
+    "FROM": "is read as a table",
+    "JOIN": "is read as a table",
+}
+
+
+def _render(items):
+    """Reassemble tokenized items as compact SQL text."""
+    text = ""
+    for kind, value in items:
+        if kind == "name":
+            value = ".".join(value)
+        elif kind == "star":
+            value = ".".join(value + ["*"])
+        glued = value in ("(", ")", ",", ".") or text.endswith(("(", "."))
+        # N'...' unicode literals
+        glued = glued or (text.endswith("N") and value.startswith("'") and text[-2:-1] in ("", " "))
+        if text and not glued:
+            text += " "
+        text += value
+    return text
+
+
+def _split_top_level(items, separator=","):
+    parts = [[]]
+    depth = 0
+    for item in items:
+        if item == ("punct", "("):
+            depth += 1
+        elif item == ("punct", ")"):
+            depth -= 1
+        if depth == 0 and item == ("punct", separator):
+            parts.append([])
+        else:
+            parts[-1].append(item)
+    return [part for part in parts if part]
+
+
+def _word(item):
+    """Upper-case text of a keyword or one-part name item, else None."""
+    kind, value = item
+    if kind == "kw":
+        return value
+    if kind == "name" and len(value) == 1:
+        return value[0].upper()
+    return None
+
+
+def _procedure_header(items):
+    """(name parts, parameter items, index of the body) of the first
+    CREATE/ALTER PROCEDURE in the item stream."""
+    for index, item in enumerate(items):
+        # PROC lexes as a name, PROCEDURE as a keyword
+        if _word(item) not in ("PROC", "PROCEDURE"):
+            continue
+        if index + 1 >= len(items) or items[index + 1][0] != "name":
+            continue
+        name = items[index + 1][1]
+        depth = 0
+        for end in range(index + 2, len(items)):
+            kind, value = items[end]
+            if (kind, value) == ("punct", "("):
+                depth += 1
+            elif (kind, value) == ("punct", ")"):
+                depth -= 1
+            elif depth == 0 and kind == "kw" and value in ("AS", "WITH", "FOR"):
+                return name, items[index + 2 : end], end
+        return name, items[index + 2 :], len(items)
+    return None, [], 0
+
+
+def extract_parameters(parameter_items):
+    """[{name, dataType, defaultValue, isOutput}] from a procedure's
+    parameter list; defaultValue is the SQL literal or None."""
+    # The list may be wrapped in parentheses as a whole
+    if (
+        parameter_items
+        and parameter_items[0] == ("punct", "(")
+        and parameter_items[-1] == ("punct", ")")
+        and len(_split_top_level(parameter_items)) == 1
+    ):
+        parameter_items = parameter_items[1:-1]
+
+    parameters = []
+    for part in _split_top_level(parameter_items):
+        if part[0][0] != "var":
+            continue
+        flags = {_word(item) for item in part} & PARAMETER_FLAGS
+        body = [item for item in part[1:] if _word(item) not in PARAMETER_FLAGS]
+        if body and body[0] == ("kw", "AS"):
+            body = body[1:]
+        equals = body.index(("other", "=")) if ("other", "=") in body else None
+        data_type = body if equals is None else body[:equals]
+        default = None if equals is None else _render(body[equals + 1 :])
+        parameters.append(
+            {
+                "name": part[0][1],
+                "dataType": _render(data_type),
+                "defaultValue": default,
+                "isOutput": bool(flags & {"OUTPUT", "OUT"}),
+            }
+        )
+    return parameters
+
+
+def _statement_type(statement):
+    head = next((value for kind, value in statement if kind == "kw"), None)
+    following = statement[1] if len(statement) > 1 else (None, None)
+    if head == "WITH":
+        # Common table expression: classified by the statement it feeds
+        head = next(
+            (value for kind, value in statement if kind == "kw" and value in DML_KEYWORDS),
+            "SELECT",
+        )
+    if head == "BEGIN":
+        if _word(following) in TRANSACTION_WORDS:
+            return "TRANSACTION_CONTROL"
+        return None
+    if head == "SET" and _word(following) in SESSION_OPTIONS:
+        return "SESSION_SETTING"
+    if head == "SELECT":
+        if following[0] == "var" and len(statement) > 2 and statement[2] == ("other", "="):
+            return "VARIABLE_ASSIGNMENT"
+        if ("kw", "INTO") in statement:
+            return "OBJECT_CREATION"
+    return STATEMENT_TYPES.get(head)
+
+
+def _table_names(statement):
+    """Tables and views a statement references, without aliases and CTEs."""
+    names = []
+    aliases = set()
+    ctes = set()
+    for index, (kind, value) in enumerate(statement):
+        following = statement[index + 1] if index + 1 < len(statement) else (None, None)
+        if (
+            kind == "name"
+            and following == ("kw", "AS")
+            and index + 2 < len(statement)
+            and statement[index + 2] == ("punct", "(")
+        ):
+            ctes.add(".".join(value).lower())
+        if kind != "kw" or not (value in TABLE_KEYWORDS or value.endswith("JOIN")):
+            continue
+        if following[0] != "name":
+            continue
+        names.append(following[1])
+        alias_index = index + 2
+        if alias_index < len(statement) and statement[alias_index] == ("kw", "AS"):
+            alias_index += 1
+        if alias_index < len(statement) and statement[alias_index][0] == "name":
+            aliases.add(".".join(statement[alias_index][1]).lower())
+
+    return [
+        ".".join(parts)
+        for parts in names
+        if ".".join(parts).lower() not in aliases and ".".join(parts).lower() not in ctes
+    ]
+
+
+def _canonical_names(dependencies):
+    names = {}
+    bare = {}
+    for dep in dependencies:
+        names[dep["name"].lower()] = dep
+        bare.setdefault(dep["name"].split(".")[-1].lower(), []).append(dep)
+    for name, deps in bare.items():
+        if len(deps) == 1:
+            names.setdefault(name, deps[0])
+    return names
+
+
+def extract_table_references(statements, procedure_definition, dependencies):
+    """[{tableName, columns}] in order of first reference. Catalog tables
+    and views list the columns the procedure reads or writes; temp tables
+    and unknown objects have no column list."""
+    known = _canonical_names(dependencies)
+    usage = analyze_column_usage(procedure_definition, dependencies)
+
+    references = {}
+    for statement in statements:
+        for name in _table_names(statement):
+            dep = known.get(name.lower()) or known.get(".".join(name.split(".")[-2:]).lower())
+            table_name = dep["name"] if dep else name
+            if table_name.lower() in (key.lower() for key in references):
+                continue
+            columns = []
+            if dep and dep["name"] in usage:
+                entry = usage[dep["name"]]
+                if entry["all_columns"]:
+                    columns = [column["name"] for column in dep.get("columns", [])]
+                else:
+                    used = set(entry["read"]) | set(entry["written"])
+                    columns = [
+                        column["name"] for column in dep["columns"] if column["name"] in used
+                    ]
+            references[table_name] = columns
+    return [{"tableName": name, "columns": columns} for name, columns in references.items()]
+
+
+def extract_statement_purpose(statements):
+    """[{statementType, purpose, count}], one entry per statement type in
+    order of first appearance, naming the objects involved."""
+    counts = Counter()
+    objects = {}
+    for statement in statements:
+        statement_type = _statement_type(statement)
+        if statement_type is None:
+            continue
+        counts[statement_type] += 1
+        targets = objects.setdefault(statement_type, [])
+        if statement_type == "PROCEDURE_CALL":
+            names = [".".join(value) for kind, value in statement[1:2] if kind == "name"]
+        else:
+            names = _table_names(statement)
+        for name in names:
+            if name not in targets:
+                targets.append(name)
+
+    purposes = []
+    for statement_type, count in counts.items():
+        purpose = STATEMENT_PURPOSES.get(statement_type, statement_type.lower())
+        if objects[statement_type]:
+            purpose += f" ({', '.join(objects[statement_type])})"
+        purposes.append({"statementType": statement_type, "purpose": purpose, "count": count})
+    return purposes
+
+
+def extract_parameter_usage(statements, parameters):
+    """[{parameterName, usage, references}] describing where each parameter
+    is used; parameters never referenced in the body are reported Unused."""
+    usages = {parameter["name"].lower(): Counter() for parameter in parameters}
+    references = Counter()
+    for statement in statements:
+        head = next((value for kind, value in statement if kind == "kw"), None)
+        clause = None
+        for index, (kind, value) in enumerate(statement):
+            if kind == "kw":
+                clause = value
+                continue
+            if kind != "var" or value.lower() not in usages:
+                continue
+            name = value.lower()
+            references[name] += 1
+            following = statement[index + 1] if index + 1 < len(statement) else (None, None)
+            if head in ("SET", "SELECT") and following == ("other", "=") and index <= 2:
+                usage = "is reassigned"
+            elif head in ("IF", "WHILE") and clause == head:
+                usage = "controls branching" if head == "IF" else "controls a loop"
+            elif head in ("EXEC", "EXECUTE"):
+                usage = "is passed to a procedure call"
+            elif head == "INSERT" and clause == "SELECT":
+                usage = "is inserted into a table"
+            elif clause in USAGE_BY_CLAUSE and not (clause == "SET" and head != "UPDATE"):
+                usage = USAGE_BY_CLAUSE[clause]
+            elif clause == "SELECT":
+                usage = "is returned or computed in a SELECT"
+            else:
+                usage = "is used in an expression"
+            usages[name][usage] += 1
+
+    result = []
+    for parameter in parameters:
+        name = parameter["name"].lower()
+        if not references[name]:
+            description = "Unused"
+        else:
+            description = "; ".join(
+                f"{usage} ({count}x)" for usage, count in usages[name].most_common()
+            )
+        result.append(
+            {
+                "parameterName": parameter["name"],
+                "usage": description,
+                "references": references[name],
+            }
+        )
+    return result
+
+
+def analyze_procedure_static(procedure_definition, dependencies=()):
+    """The _meta.json fields that follow from the code alone: metadata
+    (procedureName, parameters), tableReferences, statementPurpose and
+    parameterUsage."""
+    items = tokenize(procedure_definition)
+    name, parameter_items, body_start = _procedure_header(items)
+    parameters = extract_parameters(parameter_items)
+    # Statements of the body only, without the CREATE PROCEDURE header
+    statements = split_statements(items[body_start + 1 :] if name else items)
+
+    return {
+        "metadata": {
+            "procedureName": ".".join(name) if name else None,
+            "parameters": parameters,
+        },
+        "tableReferences": extract_table_references(
+            statements, procedure_definition, list(dependencies)
+        ),
+        "statementPurpose": extract_statement_purpose(statements),
+        "parameterUsage": extract_parameter_usage(statements, parameters),
+    }
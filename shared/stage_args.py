@@ -0,0 +1,42 @@
+import argparse
+from shared.manifest import is_fresh
+
+
+def parse_stage_args(description=None, args=None):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "--procedure",
+        action="append",
+        metavar="NAME",
+        help="only process this schema.procedure (repeatable); defaults to all",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="re-run even when the manifest shows the outputs are up to date",
+    )
+    return parser.parse_args(args)
+
+
+def selected_procedures(procedures, stage=None, description=None):
+    """Restrict a stage's discovered procedures to the --procedure arguments
+    it was launched with, keeping discovery order. When the stage name is
+    given, procedures whose outputs are fresh in the manifest are dropped
+    unless --force is passed."""
+    args = parse_stage_args(description)
+    if args.procedure:
+        wanted = set(args.procedure)
+        missing = wanted.difference(procedures)
+        if missing:
+            print(f"⚠️ Procedures not found for this stage: {sorted(missing)}")
+        procedures = [procedure for procedure in procedures if procedure in wanted]
+
+    if stage is None or args.force:
+        return procedures
+
+    stale = [procedure for procedure in procedures if not is_fresh(procedure, stage)]
+    if len(stale) < len(procedures):
+        print(
+            f"⏭️ Skipping {len(procedures) - len(stale)} procedures with up-to-date {stage} outputs"
+        )
+    return stale
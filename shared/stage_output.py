@@ -0,0 +1,115 @@
+import io
+import os
+import sys
+import logging
+import threading
+from collections import deque
+from contextvars import ContextVar
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+LOG_DIR = "output/logs"
+LOG_MAX_BYTES = 20 * 1024 * 1024
+LOG_BACKUPS = 5
+# Lines of a stage's output kept in memory to repeat when it fails
+TAIL_LINES = 200
+
+# The capture target of the running stage. A context variable rather than
+# a thread local so worker threads started through run_bounded, which copy
+# the context, write to the stage that started them
+_target = ContextVar("stage_output_target", default=None)
+
+
+def stage_logger(name):
+    """Rotating per-stage log file under output/logs; every procedure's
+    output for the stage goes to the same file, tagged with its name."""
+    logger = logging.getLogger(f"pipeline.{name}")
+    if not logger.handlers:
+        os.makedirs(LOG_DIR, exist_ok=True)
+        handler = RotatingFileHandler(
+            os.path.join(LOG_DIR, f"{name}.log"),
+            maxBytes=LOG_MAX_BYTES,
+            backupCount=LOG_BACKUPS,
+            encoding="utf-8",
+        )
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+
+class _Target:
+    def __init__(self, prefix, logger, echo):
+        self.prefix = prefix
+        self.logger = logger
+        self.echo = echo
+        self.pending = ""
+        self.tail = deque(maxlen=TAIL_LINES)
+
+
+class StageOutput(io.TextIOBase):
+    """Stand-in for sys.stdout/sys.stderr while stages run in-process.
+
+    Text written while a stage is running is split into lines,
+    tagged with [stage procedure], written to that stage's log and echoed to
+    the console; anything else goes to the console unchanged.
+    """
+
+    def __init__(self, console=None):
+        self.console = console or sys.__stdout__
+        self._lock = threading.Lock()
+
+    def install(self):
+        sys.stdout = self
+        sys.stderr = self
+
+    def uninstall(self):
+        sys.stdout = sys.__stdout__
+        sys.stderr = sys.__stderr__
+
+    @contextmanager
+    def capture(self, name, procedure, echo=True):
+        """Route this thread's output to the stage log; yields the deque of
+        the last TAIL_LINES lines."""
+        target = _Target(f"[{name} {procedure}]", stage_logger(name), echo)
+        token = _target.set(target)
+        try:
+            yield target.tail
+        finally:
+            if target.pending:
+                self._emit(target, target.pending)
+            _target.reset(token)
+
+    def _emit(self, target, line):
+        target.tail.append(line)
+        target.logger.info(f"{target.prefix} {line}")
+        if target.echo:
+            with self._lock:
+                self.console.write(f"{target.prefix} {line}\n")
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        target = _target.get()
+        if target is None:
+            with self._lock:
+                return self.console.write(text)
+
+        lines = (target.pending + text).split("\n")
+        target.pending = lines.pop()
+        for line in lines:
+            self._emit(target, line.rstrip("\r"))
+        return len(text)
+
+    def flush(self):
+        with self._lock:
+            self.console.flush()
+
+    @property
+    def encoding(self):
+        return getattr(self.console, "encoding", "utf-8")
+
+    def isatty(self):
+        return False
@@ -1,89 +1,72 @@
-from crewai import Crew, Agent, Task, LLM
-from shared.get_dependencies import get_dependencies
+from shared.prompt_format import render_dependency_prompt
 import os
 import json
-import boto3
-import dotenv
 import sqlparse
-import pyodbc
 import re
 from datetime import datetime
-from crewai.knowledge.source.text_file_knowledge_source import TextFileKnowledgeSource
-
-dotenv.load_dotenv()
-
-connection_string = os.getenv("CONNECTION_STRING")
-
-connection = pyodbc.connect(connection_string)
-cursor = connection.cursor()
-
-# Get all folder names from analysis directory
-procedures = []
-if os.path.exists("output/analysis"):
-    procedures = [
-        folder
-        for folder in os.listdir("output/analysis")
-        if os.path.isdir(os.path.join("output/analysis", folder))
-    ]
-print(f"Discovered procedures: {procedures}")
-
-# Create a text file knowledge source
-text_source = TextFileKnowledgeSource(file_paths=["tsqlt.txt"])
-
-
-openai_config = LLM(
-    model="gpt-4o",
-    api_key=os.getenv("OPENAI_API_KEY"),
-    temperature=0.1,  # Ensures deterministic SQL generation
-    max_retries=3,
-    request_timeout=60,
-    verbose=True,
-)
-
-bedrock_config = LLM(
-    model="bedrock/us.meta.llama3-3-70b-instruct-v1:0",
-    max_retries=2,
-    request_timeout=30,
-    temperature=0.1,
-    timeout=300,
-    verbose=True,
-)
-
-anthropic_config = LLM(
-    model="anthropic/claude-3-7-sonnet-20250219",
-    api_key=os.getenv("ANTHROPIC_API_KEY"),
-    timeout=900,  # Handles large JSON specs
-    request_timeout=900,
-    max_retries=2,
-    max_tokens=64000,  # Allows long test specs
-    verbose=True,
-)
-
-if os.getenv("LLM_CONFIG") == "bedrock":
-    llm_config = bedrock_config
-elif os.getenv("LLM_CONFIG") == "anthropic":
-    llm_config = anthropic_config
-else:
-    llm_config = openai_config
-
-
-# Create a coding agent
-agent = Agent(
-    role="tSQLt Developer",
-    goal="Analyze the business rule and stored procedure then provide tSQLt code.",
-    backstory="""You are an experienced SQL developer with strong SQL skills analyzing stored procedures and 
-    understanding the business logic behind the code that will lead to creating 
-    the FULL coverage for tSQLt test code. Always use unique naming for mock data and mock tables.
-    Version of tSQLt: Version:1.0.8083.3529 InstalledOnSQLServer: 15.00
-    """,
-    allow_code_execution=False,
-    llm=llm_config,
-    verbose=True,
-    # knowledge_sources=[text_source],
-)
-
-# Create Crew For Each Discovered Stored Procedure
-for procedure in procedures:
+from shared.kickoff import kickoff
+from shared.stage_args import selected_procedures
+from shared.runtime import RuntimeContext
+from shared.manifest import inputs_changed, record_stage
+
+
+def discover_procedures():
+    # Get all folder names from analysis directory
+    procedures = []
+    if os.path.exists("output/analysis"):
+        procedures = [
+            folder
+            for folder in os.listdir("output/analysis")
+            if os.path.isdir(os.path.join("output/analysis", folder))
+        ]
+    return procedures
+
+
+def tsqlt_knowledge_source():
+    # Create a text file knowledge source
+    from crewai.knowledge.source.text_file_knowledge_source import (
+        TextFileKnowledgeSource,
+    )
+
+    return TextFileKnowledgeSource(file_paths=["tsqlt.txt"])
+
+
+def create_agent(context):
+    from crewai import Agent
+
+    llm_config = context.llm(stage="sql_tests")
+
+    # Create a coding agent
+    agent = Agent(
+        role="tSQLt Developer",
+        goal="Analyze the business rule and stored procedure then provide tSQLt code.",
+        backstory="""You are an experienced SQL developer with strong SQL skills analyzing stored procedures and 
+        understanding the business logic behind the code that will lead to creating 
+        the FULL coverage for tSQLt test code. Always use unique naming for mock data and mock tables.
+        Version of tSQLt: Version:1.0.8083.3529 InstalledOnSQLServer: 15.00
+        """,
+        allow_code_execution=False,
+        llm=llm_config,
+        verbose=True,
+        # knowledge_sources=[tsqlt_knowledge_source()],
+    )
+
+    return agent
+
+
+def run_procedure(procedure, context):
+    # tSQLt batches run on a connection from the shared pool
+    with context.connection() as connection:
+        return generate_and_run_tests(procedure, context, connection)
+
+
+# Create Crew for one discovered stored procedure
+def generate_and_run_tests(procedure, context, connection):
+    from crewai import Crew, Task
+
+    agent = create_agent(context)
+    cursor = connection.cursor()
+
     # Create test directory path
     test_dir = os.path.join("output", "sql-tests", procedure)
     test_file_path = os.path.join(test_dir, f"{procedure}_test.sql")
@@ -92,8 +75,8 @@ for procedure in procedures:
     with open(os.path.join(procedure_code_dir, f"{procedure}.sql"), "r") as f:
         procedure_code = f.read()
 
-    # Check if test file already exists
-    if os.path.exists(test_file_path):
+    # Check if test file already exists and was generated from the current inputs
+    if os.path.exists(test_file_path) and not inputs_changed(procedure, "sql_tests"):
         print(f"✅ Test file already exists for {procedure}, skipping generation")
         # Read the existing test file
         with open(test_file_path, "r") as f:
@@ -142,7 +125,9 @@ GO
             f.write(test_class_code)
         print(f"✅ Test class created for {procedure}")
 
-        dependencies = get_dependencies(procedure)
+        dependencies = render_dependency_prompt(
+            procedure, context.dependencies(procedure), procedure_code
+        )
 
         # Parse Integration Test Specifications
         try:
@@ -363,10 +348,10 @@ THE JSON TEST SPECIFICATION STRUCTURE:
                     tasks=[fix_task],
                     verbose=True,
                     planning=True,
-                    # knowledge_sources=[text_source],
+                    # knowledge_sources=[tsqlt_knowledge_source()],
                 )
                 # Execute the crew
-                result = str(crew.kickoff())
+                result = kickoff(crew, procedure, "tsqlt_fix")
                 return result
 
             # Create a crew and add the task
@@ -375,11 +360,11 @@ THE JSON TEST SPECIFICATION STRUCTURE:
                 tasks=[task],
                 verbose=True,
                 planning=True,
-                # knowledge_sources=[text_source],
+                # knowledge_sources=[tsqlt_knowledge_source()],
             )
 
             # Execute the crew
-            result = str(crew.kickoff())
+            result = kickoff(crew, procedure, "tsqlt_tests")
 
             print(result)
 
@@ -762,6 +747,23 @@ THE JSON TEST SPECIFICATION STRUCTURE:
                 f"❌ Could not retrieve tSQLt results after all tests failure: {str(inner_e)}"
             )
 
-# Close the database connection
-connection.close()
-print("✅ tSQLt code completed for all procedures.")
+    record_stage(procedure, "sql_tests")
+    return True
+
+
+def main():
+    context = RuntimeContext()
+    procedures = selected_procedures(discover_procedures(), "sql_tests")
+    print(f"Discovered procedures: {procedures}")
+
+    try:
+        for procedure in procedures:
+            run_procedure(procedure, context)
+    finally:
+        context.close()
+
+    print("✅ tSQLt code completed for all procedures.")
+
+
+if __name__ == "__main__":
+    main()
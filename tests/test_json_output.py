@@ -0,0 +1,54 @@
+import pytest
+from shared.json_output import SCHEMAS, JsonOutputError, parse_artifact, parse_json, repair_json
+
+
+def test_bracketed_names_before_fence():
+    reply = (
+        "Here is the metadata for [dbo].[usp_GetOrders]:\n"
+        "```json\n"
+        '{"logicalBlocks": [], "potentialBusinessRules": [], "testValueCandidates": []}\n'
+        "```"
+    )
+    assert parse_artifact(reply, "meta") == {
+        "logicalBlocks": [],
+        "potentialBusinessRules": [],
+        "testValueCandidates": [],
+    }
+
+
+def test_bracketed_prose_before_unfenced_object():
+    assert parse_json('Note [1]: the result is {"a": 1}') == {"a": 1}
+    assert parse_json('Note [1]: the result is {"a": 1}', {"type": "object"}) == {"a": 1}
+
+
+def test_value_of_a_type_the_schema_rejects():
+    with pytest.raises(JsonOutputError):
+        parse_json("Note [1]: nothing else here", {"type": "object"})
+
+
+def test_truncated_fence_is_closed():
+    value, repairs = repair_json('```json\n{"businessRules": [{"id": "BR-001"}, {"id": "BR-0')
+    assert value == {"businessRules": [{"id": "BR-001"}]}
+    assert "dropped truncated last element" in repairs
+
+
+def test_truncated_nested_element_is_dropped():
+    assert repair_json('{"a": [1, 2, {"b": "x')[0] == {"a": [1, 2]}
+    assert repair_json('{"a": [1, {"b": [')[0] == {"a": [1]}
+
+
+def test_truncated_first_member_is_rejected():
+    with pytest.raises(JsonOutputError):
+        repair_json('see {"a": tru')
+
+
+def test_bare_member_and_trailing_comma():
+    reply = '```json\n"testScenarios": [{"testId": "T1"},\n]\n```'
+    assert parse_json(reply) == {"testScenarios": [{"testId": "T1"}]}
+
+
+def test_schema_violations_are_listed():
+    with pytest.raises(JsonOutputError) as error:
+        parse_artifact('{"businessRules": [{"id": 1}]}', "business_rules")
+    assert "$.businessRules[0]: missing required property 'name'" in error.value.errors
+    assert "meta" in SCHEMAS